@@ -1,5 +1,16 @@
 from django.contrib import admin
-from .models import Proforma, PurchaseOrder, Receipt
+from .models import (
+    Proforma,
+    PurchaseOrder,
+    Receipt,
+    ExtractionJob,
+    ExtractionCacheEntry,
+    VendorTemplate,
+    DocumentFingerprint,
+    DocumentText,
+    DocumentBlob,
+    UploadSession
+)
 
 
 @admin.register(Proforma)
@@ -24,3 +35,56 @@ class ReceiptAdmin(admin.ModelAdmin):
     list_filter = ['validation_status', 'uploaded_at']
     search_fields = ['request__title']
     readonly_fields = ['uploaded_at', 'validated_at', 'extracted_data', 'validation_results', 'discrepancies']
+
+
+@admin.register(ExtractionJob)
+class ExtractionJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'job_type', 'status', 'progress', 'stage', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['job_type', 'status', 'created_at']
+    readonly_fields = ['created_at', 'started_at', 'heartbeat_at', 'finished_at', 'worker', 'attempts', 'error']
+
+
+@admin.register(ExtractionCacheEntry)
+class ExtractionCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ['content_hash', 'document_type', 'text_version', 'result_version', 'size', 'hits', 'last_used_at']
+    list_filter = ['document_type', 'result_version']
+    search_fields = ['content_hash']
+    readonly_fields = ['created_at', 'last_used_at']
+
+
+@admin.register(VendorTemplate)
+class VendorTemplateAdmin(admin.ModelAdmin):
+    list_display = ['vendor_name', 'document_type', 'samples', 'hits', 'failures', 'updated_at']
+    list_filter = ['document_type']
+    search_fields = ['vendor_name']
+    readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(DocumentFingerprint)
+class DocumentFingerprintAdmin(admin.ModelAdmin):
+    list_display = ['id', 'document_type', 'proforma', 'receipt', 'image_hash', 'created_at']
+    list_filter = ['document_type']
+    search_fields = ['content_hash', 'image_hash']
+    readonly_fields = ['created_at', 'content_hash', 'image_hash', 'text_signature']
+
+
+@admin.register(DocumentText)
+class DocumentTextAdmin(admin.ModelAdmin):
+    list_display = ['id', 'document_type', 'request', 'updated_at']
+    list_filter = ['document_type']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(DocumentBlob)
+class DocumentBlobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'size', 'refcount', 'created_at']
+    search_fields = ['name', 'content_hash']
+    readonly_fields = ['name', 'content_hash', 'size', 'refcount', 'created_at']
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ['id', 'filename', 'created_by', 'size', 'offset', 'status', 'updated_at']
+    list_filter = ['status']
+    search_fields = ['filename', 'content_hash']
+    readonly_fields = ['created_at', 'updated_at', 'content_type', 'content_hash']
@@ -4,3 +4,19 @@ from django.apps import AppConfig
 class DocumentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'documents'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save, pre_save
+        from .models import Proforma, PurchaseOrder, Receipt
+        from .storage import release_document_file, release_replaced_file
+        from .vendors import remember_vendor
+        
+        # Keep the in-process vendor index current
+        post_save.connect(remember_vendor, sender=Proforma, dispatch_uid='vendor_index_proforma')
+        post_save.connect(remember_vendor, sender=PurchaseOrder, dispatch_uid='vendor_index_purchase_order')
+        
+        # Reference counts of content-addressed files
+        for model in (Proforma, PurchaseOrder, Receipt):
+            label = model._meta.model_name
+            pre_save.connect(release_replaced_file, sender=model, dispatch_uid=f'storage_replace_{label}')
+            post_delete.connect(release_document_file, sender=model, dispatch_uid=f'storage_release_{label}')
@@ -0,0 +1,183 @@
+"""
+Batch document uploads.
+
+A batch is a zip archive or a multipart set of files, each mapped to a
+purchase request. Every file is ingested (unpacked, hashed, saved and queued
+for extraction) by a bounded thread pool, and the caller gets back a
+manifest with one entry per file: what was created for it, or why it was
+rejected. One bad file never fails the rest of the batch.
+"""
+import json
+import posixpath
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connections
+from .upload_handlers import spool_file
+
+MANIFEST_NAME = 'manifest.json'
+
+# Archive members that are never documents
+IGNORED_PREFIXES = ('__MACOSX/',)
+
+
+class BatchError(Exception):
+    """The batch as a whole cannot be processed (unreadable archive, bad manifest, too many files)"""
+
+
+class BatchEntry:
+    """One file of a batch and the purchase request it belongs to"""
+
+    def __init__(self, name, request_id, file=None, member=None):
+        self.name = name
+        self.request_id = request_id
+        self.file = file
+        self.member = member
+
+    def open(self, archive):
+        """The entry's file, spooling it out of the archive first if needed"""
+        if self.file is None:
+            with archive.open(self.member) as source:
+                self.file = spool_file(source, posixpath.basename(self.name), settings.DOCUMENT_UPLOAD_MAX_SIZE)
+        return self.file
+
+
+def parse_manifest(value):
+    """
+    Parse a {filename: request id} mapping given as JSON text or a dict.
+
+    Raises:
+        BatchError: the manifest is not such a mapping
+    """
+    if not value:
+        return {}
+    if isinstance(value, (str, bytes)):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise BatchError('manifest is not valid JSON')
+    if not isinstance(value, dict):
+        raise BatchError('manifest must map file names to purchase request ids')
+    return {str(name): request_id for name, request_id in value.items()}
+
+
+def _request_from_path(name):
+    """Request id from an archive path laid out as <request id>/<file>, or None"""
+    folder = name.split('/', 1)[0] if '/' in name else ''
+    return int(folder) if folder.isdigit() else None
+
+
+def entries_from_files(files, request_ids=None, manifest=None):
+    """
+    Batch entries for uploaded files.
+
+    Each file is mapped through the manifest by name, or else to the
+    request id at the same position in request_ids.
+    """
+    manifest = manifest or {}
+    request_ids = request_ids or []
+    entries = []
+    for index, file in enumerate(files):
+        request_id = manifest.get(file.name)
+        if request_id is None and index < len(request_ids):
+            request_id = request_ids[index]
+        entries.append(BatchEntry(file.name, request_id, file=file))
+    return entries
+
+
+def entries_from_archive(archive, manifest=None):
+    """
+    Batch entries for the documents in an open zip archive.
+
+    Members are mapped through the manifest (given, or a manifest.json at
+    the top of the archive) by path or base name, or else by a leading
+    <request id>/ folder.
+
+    Raises:
+        BatchError: the manifest inside the archive is invalid
+    """
+    names = archive.namelist()
+    if not manifest and MANIFEST_NAME in names:
+        with archive.open(MANIFEST_NAME) as f:
+            manifest = parse_manifest(f.read())
+    manifest = manifest or {}
+
+    entries = []
+    for info in archive.infolist():
+        name = info.filename
+        if info.is_dir() or name == MANIFEST_NAME or name.startswith(IGNORED_PREFIXES):
+            continue
+        if posixpath.basename(name).startswith('.'):
+            continue
+        request_id = manifest.get(name, manifest.get(posixpath.basename(name)))
+        if request_id is None:
+            request_id = _request_from_path(name)
+        entries.append(BatchEntry(name, request_id, member=info))
+    return entries
+
+
+def open_archive(file):
+    """
+    Open an uploaded zip file.
+
+    Raises:
+        BatchError: the file is not a readable zip archive
+    """
+    try:
+        path = file.temporary_file_path()
+    except AttributeError:
+        path = file
+    try:
+        return zipfile.ZipFile(path)
+    except (zipfile.BadZipFile, OSError):
+        raise BatchError('archive is not a valid zip file')
+
+
+def run_batch(entries, ingest, archive=None, workers=None):
+    """
+    Ingest every entry of a batch with a bounded pool of threads.
+
+    Args:
+        entries: BatchEntry list
+        ingest: callable(request_id, file) returning a result dict for the
+            manifest; it reports problems with an 'error' key instead of raising
+        archive: open ZipFile the entries come from, if any
+        workers: maximum concurrent ingests (default DOCUMENT_BATCH_WORKERS)
+
+    Returns:
+        list: one result dict per entry, in entry order, each with 'file',
+        'request' and 'status' ('queued' or 'rejected')
+    """
+    if len(entries) > settings.DOCUMENT_BATCH_MAX_FILES:
+        raise BatchError(f'A batch may contain at most {settings.DOCUMENT_BATCH_MAX_FILES} files')
+    workers = workers or settings.DOCUMENT_BATCH_WORKERS
+
+    def process(entry):
+        result = {'file': entry.name, 'request': entry.request_id}
+        try:
+            if entry.request_id is None:
+                result['error'] = 'No purchase request given for this file'
+            else:
+                result.update(ingest(entry.request_id, entry.open(archive)))
+        except Exception as e:
+            print(f"Error ingesting batch file {entry.name}: {e}")
+            result['error'] = str(e)
+        finally:
+            if entry.member is not None and entry.file is not None:
+                # Spooled copies are moved into storage when saved; this removes rejected ones
+                entry.file.close()
+        result['status'] = 'rejected' if result.get('error') else 'queued'
+        return result
+
+    if workers <= 1 or len(entries) <= 1:
+        return [process(entry) for entry in entries]
+
+    def process_in_thread(entry):
+        try:
+            return process(entry)
+        finally:
+            # Pool threads get their own database connections; don't leak them
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(entries))) as executor:
+        return list(executor.map(process_in_thread, entries))
@@ -0,0 +1,450 @@
+"""
+Extraction benchmark and accuracy suite.
+
+Generates a synthetic corpus of proformas and receipts with known field
+values, rasterizes them into noisy "phone photo" images, then times each
+extraction path and scores its output against the ground truth. Used by the
+``benchmark_extraction`` management command.
+"""
+import json
+import os
+import random
+import statistics
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pypdfium2
+from PIL import Image, ImageFilter
+from reportlab.lib.pagesizes import A6
+from reportlab.pdfgen import canvas
+from .pdf_extraction import count_pages
+from .po_generator import render_po_pdf
+
+VENDORS = [
+    'ACME Supplies Ltd', 'Kivu Office World', 'Blue Nile Traders', 'Summit Tech Inc',
+    'Umuco Stationers Ltd', 'Great Lakes Equipment Co.', 'Nyarutarama Hardware Ltd', 'Delta Print Group',
+]
+PRODUCTS = [
+    'Office chair', 'Standing desk', 'A4 paper ream', 'Toner cartridge', 'USB-C hub', 'Laptop stand',
+    'Whiteboard markers', 'Network switch', 'HDMI cable', 'Desk lamp', 'Filing cabinet', 'Wireless mouse',
+]
+
+
+def _random_items(rng, max_items):
+    items = []
+    for description in rng.sample(PRODUCTS, rng.randint(1, max_items)):
+        quantity = rng.randint(1, 12)
+        unit_price = round(rng.uniform(2, 400), 2)
+        items.append({
+            'description': description,
+            'quantity': quantity,
+            'unit_price': unit_price,
+            'total': round(quantity * unit_price, 2),
+        })
+    return items
+
+
+def _truth(rng, max_items):
+    items = _random_items(rng, max_items)
+    return {
+        'vendor_name': rng.choice(VENDORS),
+        'date': (date(2025, 1, 1) + timedelta(days=rng.randint(0, 364))).isoformat(),
+        'items': items,
+        'total_amount': round(sum(item['total'] for item in items), 2),
+    }
+
+
+def proforma_context(truth):
+    """Purchase order render context for a synthetic proforma"""
+    return {
+        'po_number': 'PF-' + truth['date'].replace('-', ''),
+        'date': date.fromisoformat(truth['date']).strftime('%B %d, %Y'),
+        'vendor_name': truth['vendor_name'],
+        'vendor_address': '12 KN 4 Ave, Kigali',
+        'request_title': 'Benchmark request',
+        'request_description': 'Synthetic document for extraction benchmarks',
+        'requested_by': 'Benchmark User',
+        'items': truth['items'],
+        'total_amount': truth['total_amount'],
+        'terms': 'Payment terms: Net 30',
+        'approvals': [],
+    }
+
+
+def render_proforma(truth):
+    """Render a proforma-style PDF using the purchase order layout and styles"""
+    return render_po_pdf(proforma_context(truth))
+
+
+def render_receipt(truth, path):
+    """Render a till-receipt-style PDF"""
+    cv = canvas.Canvas(path, pagesize=A6)
+    width, height = A6
+    y = height - 30
+    lines = [truth['vendor_name'], '12 KN 4 Ave, Kigali', f"Date: {truth['date']}", '']
+    lines += [f"{item['quantity']} x {item['description']} @ {item['unit_price']:.2f}  {item['total']:.2f}" for item in truth['items']]
+    lines += ['', f"TOTAL: ${truth['total_amount']:.2f}", 'Thank you for your business']
+    for line in lines:
+        cv.setFont('Helvetica', 8)
+        cv.drawString(15, y, line)
+        y -= 12
+    cv.save()
+
+
+def rasterize(pdf_path, image_path, rng, dpi=200):
+    """Render the first page as a noisy, slightly rotated JPEG"""
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    try:
+        page = pdf[0]
+        image = page.render(scale=dpi / 72, grayscale=True).to_pil()
+        page.close()
+    finally:
+        pdf.close()
+    image = image.rotate(rng.uniform(-2, 2), resample=Image.BICUBIC, expand=True, fillcolor=255)
+    noise = Image.effect_noise(image.size, 24).filter(ImageFilter.GaussianBlur(0.6))
+    image = Image.blend(image, noise, 0.12)
+    image.save(image_path, 'JPEG', quality=70)
+
+
+def build_corpus(directory, count, seed=0, max_items=8):
+    """
+    Write count proformas and count receipts (PDF + noisy JPEG) to directory.
+
+    Returns:
+        list of dicts: document_type, pdf, image and truth for each document
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for index in range(count):
+        for document_type in ('proforma', 'receipt'):
+            truth = _truth(rng, max_items)
+            pdf_path = os.path.join(directory, f'{document_type}_{index:04d}.pdf')
+            if document_type == 'proforma':
+                with open(pdf_path, 'wb') as f:
+                    f.write(render_proforma(truth))
+            else:
+                render_receipt(truth, pdf_path)
+            image_path = pdf_path[:-4] + '.jpg'
+            rasterize(pdf_path, image_path, rng)
+            corpus.append({'document_type': document_type, 'pdf': pdf_path, 'image': image_path, 'truth': truth})
+    return corpus
+
+
+def _normalize(value):
+    return ' '.join(str(value or '').lower().replace('.', '').split())
+
+
+def score_fields(result, truth, document_type):
+    """Per-field correctness (True/False) of an extraction result"""
+    items = result.get('items_data', {}).get('items', []) if document_type == 'proforma' else result.get('items', [])
+    total = result.get('total_amount')
+    scores = {
+        'vendor_name': _normalize(result.get('vendor_name')) == _normalize(truth['vendor_name']),
+        'total_amount': total is not None and abs(float(total) - truth['total_amount']) < 0.01,
+        'item_count': len(items or []) == len(truth['items']),
+    }
+    if document_type == 'receipt':
+        scores['date'] = result.get('date') == truth['date']
+    return scores
+
+
+def _rss_mb():
+    """Current resident set size of this process, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _RSSMonitor:
+    """
+    Peak resident set size reached during one stage, above where the stage started.
+
+    ru_maxrss is a high-water mark for the whole process, so every stage after
+    the hungriest one would report the same figure; a sampling thread measures
+    each stage on its own, native allocations (pdfium, OCR) included.
+    """
+
+    INTERVAL = 0.01
+
+    def __init__(self):
+        self.start_mb = self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.start_mb = self.peak_mb = _rss_mb()
+        if self.start_mb is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.INTERVAL):
+            self.peak_mb = max(self.peak_mb, _rss_mb() or 0)
+
+    def stop(self):
+        """Stop sampling; returns the stage's RSS growth in MB (None if unknown)"""
+        if self._thread is None:
+            return None
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, _rss_mb() or 0)
+        return self.peak_mb - self.start_mb
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+class StageResult:
+    """Timings and accuracy collected for one extraction path"""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.pages = 0
+        self.field_hits = {}
+        self.field_totals = {}
+        self.errors = 0
+        self.skipped = ''
+        self.rss_growth_mb = None
+
+    def record(self, seconds, pages=1, scores=None):
+        self.latencies.append(seconds * 1000)
+        self.pages += pages
+        for field, ok in (scores or {}).items():
+            self.field_totals[field] = self.field_totals.get(field, 0) + 1
+            self.field_hits[field] = self.field_hits.get(field, 0) + int(ok)
+
+    def summary(self):
+        total_seconds = sum(self.latencies) / 1000
+        return {
+            'stage': self.name,
+            'documents': len(self.latencies),
+            'errors': self.errors,
+            'skipped': self.skipped,
+            'p50_ms': _round(_percentile(self.latencies, 50)),
+            'p95_ms': _round(_percentile(self.latencies, 95)),
+            'pages_per_sec': _round(self.pages / total_seconds) if total_seconds else None,
+            'rss_growth_mb': _round(self.rss_growth_mb),
+            'accuracy': {
+                field: _round(self.field_hits[field] / self.field_totals[field], 3)
+                for field in self.field_totals
+            },
+        }
+
+
+def _round(value, digits=2):
+    return round(value, digits) if value is not None else None
+
+
+class _StubLLMHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible chat completions endpoint"""
+
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.latency)
+        content = json.dumps({'vendor_name': 'Stub Vendor', 'total_amount': 0, 'items': []})
+        body = json.dumps({
+            'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': 'stub',
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub_llm(latency=0.0):
+    """Start a local stub LLM server; returns (server, base_url)"""
+    handler = type('StubLLMHandler', (_StubLLMHandler,), {'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/v1'
+
+
+def _timed(stage, func, *args):
+    started = time.perf_counter()
+    try:
+        value = func(*args)
+    except Exception as e:
+        stage.errors += 1
+        print(f"Benchmark error in {stage.name}: {e}")
+        return None, time.perf_counter() - started
+    return value, time.perf_counter() - started
+
+
+def run_benchmark(corpus, stages, stub_latency=0.0):
+    """
+    Run the selected extraction stages over the corpus.
+
+    Stages: 'text_pdf' (PDF text layer + rules), 'ocr' (noisy images + rules),
+    'rules' (rule engine on ground-truth text only), 'llm_stub' (prompt
+    building and LLM client round trip against a local stub server),
+    'po_render' (purchase order PDF rendering from a ready render context).
+    """
+    from .document_processor import DocumentProcessor
+    from .llm_client import LLMClient
+    from .ocr import get_ocr_engine
+
+    processor = DocumentProcessor(use_cache=False)
+    results = []
+    texts = {}
+
+    def parse(document, text):
+        if document['document_type'] == 'proforma':
+            return processor._extract_basic_data(text)
+        return processor._extract_basic_receipt_data(text)
+
+    if 'text_pdf' in stages:
+        stage = StageResult('text_pdf')
+        memory = _RSSMonitor().start()
+        for document in corpus:
+            text, seconds = _timed(stage, processor.extract_text_from_pdf, document['pdf'])
+            if text is None:
+                continue
+            texts[document['pdf']] = text
+            result, parse_seconds = _timed(stage, parse, document, text)
+            if result is not None:
+                pages = count_pages(document['pdf']) or 1
+                stage.record(seconds + parse_seconds, pages, score_fields(result, document['truth'], document['document_type']))
+        stage.rss_growth_mb = memory.stop()
+        results.append(stage)
+
+    if 'ocr' in stages:
+        stage = StageResult('ocr')
+        memory = _RSSMonitor().start()
+        try:
+            get_ocr_engine().image_to_string(Image.new('L', (32, 32), 255))
+        except Exception as e:
+            stage.skipped = f'OCR engine unavailable: {e}'
+        else:
+            for document in corpus:
+                text, seconds = _timed(stage, processor.extract_text_from_image, document['image'])
+                if text is None:
+                    continue
+                result, parse_seconds = _timed(stage, parse, document, text)
+                if result is not None:
+                    stage.record(seconds + parse_seconds, 1, score_fields(result, document['truth'], document['document_type']))
+        stage.rss_growth_mb = memory.stop()
+        results.append(stage)
+
+    if 'rules' in stages:
+        stage = StageResult('rules')
+        memory = _RSSMonitor().start()
+        for document in corpus:
+            text = texts.get(document['pdf']) or processor.extract_text_from_pdf(document['pdf'])
+            result, seconds = _timed(stage, parse, document, text)
+            if result is not None:
+                stage.record(seconds, 1, score_fields(result, document['truth'], document['document_type']))
+        stage.rss_growth_mb = memory.stop()
+        results.append(stage)
+
+    if 'llm_stub' in stages:
+        stage = StageResult('llm_stub')
+        memory = _RSSMonitor().start()
+        server, base_url = start_stub_llm(stub_latency)
+        try:
+            processor.llm_client = LLMClient(api_key='stub', base_url=base_url, max_retries=0)
+            for document in corpus:
+                text = texts.get(document['pdf']) or processor.extract_text_from_pdf(document['pdf'])
+                result, seconds = _timed(stage, processor._extract_with_ai, text, document['document_type'])
+                if result is not None:
+                    stage.record(seconds)
+        finally:
+            server.shutdown()
+        stage.rss_growth_mb = memory.stop()
+        results.append(stage)
+
+    if 'po_render' in stages:
+        stage = StageResult('po_render')
+        memory = _RSSMonitor().start()
+        # The first render builds the process-wide styles; keep it out of the timings
+        if corpus:
+            render_po_pdf(proforma_context(corpus[0]['truth']))
+        for document in corpus:
+            if document['document_type'] != 'proforma':
+                continue
+            _, seconds = _timed(stage, render_po_pdf, proforma_context(document['truth']))
+            stage.record(seconds)
+        stage.rss_growth_mb = memory.stop()
+        results.append(stage)
+
+    return [stage.summary() for stage in results]
+
+
+# Stored results that benchmark runs are checked against
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+
+# A field's accuracy may fall this far below the baseline before the check fails
+ACCURACY_TOLERANCE = 0.02
+
+# A stage's p95 latency may grow to this multiple of the baseline (timings vary by machine)
+MAX_SLOWDOWN = 3.0
+
+
+def make_baseline(results, count, seed):
+    """Baseline entry (accuracy, p95 and errors per stage) for a benchmark run"""
+    return {
+        'count': count,
+        'seed': seed,
+        'stages': {
+            result['stage']: {
+                'accuracy': result['accuracy'],
+                'p95_ms': result['p95_ms'],
+                'errors': result['errors'],
+            }
+            for result in results if not result['skipped']
+        },
+    }
+
+
+def load_baseline(path=BASELINE_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_to_baseline(results, baseline, accuracy_tolerance=ACCURACY_TOLERANCE, max_slowdown=MAX_SLOWDOWN):
+    """
+    Regressions of a benchmark run against a baseline.
+
+    A stage regresses if a field's accuracy drops more than accuracy_tolerance,
+    it has more errors, or its p95 latency exceeds max_slowdown times the
+    baseline (None skips the timing check). Skipped stages and stages missing
+    from the baseline are not checked.
+
+    Returns:
+        list of str: one message per regression (empty if none)
+    """
+    failures = []
+    for result in results:
+        expected = baseline['stages'].get(result['stage'])
+        if result['skipped'] or not expected:
+            continue
+        stage = result['stage']
+        for field, accuracy in expected['accuracy'].items():
+            actual = result['accuracy'].get(field)
+            if actual is None or actual < accuracy - accuracy_tolerance:
+                failures.append(f'{stage}: {field} accuracy {actual} is below the baseline {accuracy}')
+        if result['errors'] > expected.get('errors', 0):
+            failures.append(f"{stage}: {result['errors']} errors, baseline {expected.get('errors', 0)}")
+        limit = expected.get('p95_ms')
+        if max_slowdown and limit and result['p95_ms'] is not None and result['p95_ms'] > limit * max_slowdown:
+            failures.append(f"{stage}: p95 {result['p95_ms']}ms is over {max_slowdown}x the baseline {limit}ms")
+    return failures
@@ -4,134 +4,274 @@ using OCR, PDF parsing, and AI/LLM
 """
 import os
 import json
-import pdfplumber
-import pytesseract
-from PIL import Image
 from django.conf import settings
-from openai import OpenAI
+from .line_matcher import match_line_items
+from .llm_client import get_llm_client
+from .ocr import ocr_image_page
+from .pdf_extraction import count_pages, stream_pdf_pages
+from .prompt_builder import build_prompt_chunks, merge_partial_results
+from .text_layer import TextLayer, load_layer, save_layer
+from .vendors import similarity as vendor_similarity, suggest_vendors, vendors_match
+from . import rule_extractor, vendor_templates
+
+# Bump these when text extraction or prompts/parsers change so cached results are recomputed
+TEXT_EXTRACTOR_VERSION = '4'
+PROMPT_VERSION = '2'
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
 
 
 class DocumentProcessor:
     """Process documents to extract structured data"""
     
-    def __init__(self):
-        self.openai_client = None
-        if settings.OPENAI_API_KEY:
-            self.openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
+    def __init__(self, use_cache=None):
+        # Shared per process: reuses the HTTP connection pool and circuit breaker
+        self.llm_client = get_llm_client()
+        
+        if use_cache is None:
+            use_cache = settings.EXTRACTION_CACHE_ENABLED
+        self.cache = None
+        if use_cache:
+            from .extraction_cache import ExtractionCache
+            self.cache = ExtractionCache()
+        
+        # Text of the most recently extracted document, used for duplicate fingerprints
+        self.last_text = ''
+        # Text layer (word boxes) of the most recently extracted document, if it was read
+        self.last_layer = None
+        
+        # Optional callable(stage, data) told about each extraction step as it completes
+        self.on_event = None
+    
+    def emit(self, stage, **data):
+        """Report an extraction step to on_event, if set"""
+        if self.on_event:
+            self.on_event(stage, data)
+    
+    @property
+    def result_version(self):
+        """Version tag for structured results; AI and rule-based results are cached separately"""
+        return f"{PROMPT_VERSION}.{rule_extractor.RULES_VERSION}:{'ai' if self.llm_client else 'basic'}"
+    
+    def iter_pdf_pages(self, file_path):
+        """Yield a LayerPage for each PDF page in order, honouring PDF_MAX_PAGES"""
+        return stream_pdf_pages(
+            file_path,
+            max_pages=settings.PDF_MAX_PAGES,
+            workers=settings.PDF_EXTRACTION_WORKERS,
+            parallel_min_pages=settings.PDF_PARALLEL_MIN_PAGES,
+            ocr_dpi=settings.PDF_OCR_DPI if settings.PDF_OCR_ENABLED else None,
+            words=settings.TEXT_LAYER_ENABLED
+        )
     
     def extract_text_from_pdf(self, file_path):
-        """Extract text from PDF using pdfplumber"""
-        text = ""
+        """Extract text from PDF using pdfplumber, OCR'ing pages without a text layer"""
         try:
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
+            pages = []
+            page_count = min(count_pages(file_path), settings.PDF_MAX_PAGES) if self.on_event else None
+            for number, page in enumerate(self.iter_pdf_pages(file_path), 1):
+                pages.append(page)
+                self.emit('page extracted', page=number, pages=page_count)
         except Exception as e:
             print(f"Error extracting text from PDF: {e}")
-        return text
+            return ""
+        return self._keep_layer(file_path, pages)
     
     def extract_text_from_image(self, file_path):
         """Extract text from image using OCR"""
         try:
-            image = Image.open(file_path)
-            text = pytesseract.image_to_string(image)
-            return text
+            page = ocr_image_page(file_path)
         except Exception as e:
             print(f"Error extracting text from image: {e}")
             return ""
+        return self._keep_layer(file_path, [page])
+    
+    def _keep_layer(self, file_path, pages):
+        """Store the pages as the document's text layer and return its text"""
+        self.last_layer = TextLayer.from_pages(pages)
+        # An empty layer is more likely a failed OCR run than a blank document; retry it next time
+        if settings.TEXT_LAYER_ENABLED and self.last_layer.text:
+            save_layer(file_path, self.last_layer)
+        return self.last_layer.text
     
     def extract_text(self, file_path):
-        """Extract text from file (PDF or image)"""
+        """Extract text from file (PDF or image), reading its stored text layer if it has one"""
+        self.last_layer = None
         file_ext = os.path.splitext(file_path)[1].lower()
+        if file_ext != '.pdf' and file_ext not in IMAGE_EXTENSIONS:
+            return ""
+        
+        if settings.TEXT_LAYER_ENABLED:
+            layer = load_layer(file_path)
+            if layer is not None:
+                self.last_layer = layer
+                return layer.text
         
         if file_ext == '.pdf':
             return self.extract_text_from_pdf(file_path)
-        elif file_ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp']:
-            return self.extract_text_from_image(file_path)
-        else:
-            return ""
+        return self.extract_text_from_image(file_path)
     
     def extract_proforma_data(self, file_path):
         """Extract data from proforma invoice"""
-        text = self.extract_text(file_path)
+        return self._extract_document(file_path, 'proforma')
+    
+    def extract_receipt_data(self, file_path):
+        """Extract data from receipt"""
+        return self._extract_document(file_path, 'receipt')
+    
+    def _extract_document(self, file_path, document_type):
+        """Extract structured data, reusing cached text/results for identical files"""
+        content_hash = None
+        entry = None
+        if self.cache:
+            from .extraction_cache import file_sha256
+            content_hash = file_sha256(file_path)
+            entry = self.cache.get(content_hash, document_type)
+            if entry and entry.result and entry.result_version == self.result_version:
+                self.last_text = entry.text
+                result = entry.result
+                result.setdefault('extraction_metadata', {}).update(
+                    cache='hit',
+                    content_hash=content_hash
+                )
+                self.emit('fields parsed', **_event_fields(result))
+                return result
+        
+        if entry and entry.text and entry.text_version == TEXT_EXTRACTOR_VERSION:
+            text = entry.text
+        else:
+            text = self.extract_text(file_path)
+        self.last_text = text or ''
+        self.emit('text extracted', characters=len(self.last_text))
         
         if not text:
+            return self._empty_result(document_type)
+        
+        # Rule engine first; only documents it is unsure about go to the LLM
+        if document_type == 'proforma':
+            result = self._extract_basic_data(text)
+        else:
+            result = self._extract_basic_receipt_data(text)
+        
+        rules_confidence = result['extraction_metadata']['confidence_score']
+        if not (settings.EXTRACTION_RULES_FIRST and rules_confidence >= settings.EXTRACTION_RULES_MIN_CONFIDENCE):
+            # Known vendor layouts are read from their learned template
+            layout = None
+            if settings.VENDOR_TEMPLATES_ENABLED:
+                layout = vendor_templates.read_layout(file_path, self.last_layer)
+            template_result = None
+            if layout:
+                template_result = vendor_templates.apply_template(file_path, text, document_type, layout)
+            
+            if template_result:
+                result = template_result
+            elif self.llm_client:
+                # Use AI to extract structured data if OpenAI is available
+                self.emit('llm started', rules=_event_fields(result))
+                result = self._extract_with_ai(
+                    text, document_type=document_type, fallback=result, pages=self._page_texts(text)
+                )
+                if layout and not result['extraction_metadata'].get('fallback'):
+                    vendor_templates.learn_template(file_path, result, document_type, layout)
+        
+        if self.cache:
+            metadata = result.get('extraction_metadata', {})
+            # Don't pin a rule-based fallback caused by a failed AI call
+            cacheable = metadata.get('success') and not metadata.get('fallback')
+            self.cache.put(
+                content_hash,
+                document_type,
+                text,
+                TEXT_EXTRACTOR_VERSION,
+                result=result if cacheable else None,
+                result_version=self.result_version
+            )
+            metadata['cache'] = 'miss'
+            metadata['content_hash'] = content_hash
+        
+        self.emit('fields parsed', **_event_fields(result))
+        return result
+    
+    def _empty_result(self, document_type):
+        """Result returned when no text could be extracted from the document"""
+        extraction_metadata = {
+            'method': 'text_extraction',
+            'success': False,
+            'error': 'Could not extract text from document'
+        }
+        if document_type == 'proforma':
             return {
                 'vendor_name': '',
                 'vendor_address': '',
                 'total_amount': None,
                 'items_data': {},
                 'terms': '',
-                'extraction_metadata': {
-                    'method': 'text_extraction',
-                    'success': False,
-                    'error': 'Could not extract text from document'
-                }
+                'extraction_metadata': extraction_metadata
             }
-        
-        # Use AI to extract structured data if OpenAI is available
-        if self.openai_client:
-            return self._extract_with_ai(text, document_type='proforma')
-        else:
-            # Fallback to basic text parsing
-            return self._extract_basic_data(text)
+        return {
+            'vendor_name': '',
+            'items': [],
+            'total_amount': None,
+            'date': None,
+            'extraction_metadata': extraction_metadata
+        }
     
-    def extract_receipt_data(self, file_path):
-        """Extract data from receipt"""
-        text = self.extract_text(file_path)
-        
-        if not text:
-            return {
-                'vendor_name': '',
-                'items': [],
-                'total_amount': None,
-                'date': None,
-                'extraction_metadata': {
-                    'method': 'text_extraction',
-                    'success': False,
-                    'error': 'Could not extract text from document'
-                }
-            }
-        
-        # Use AI to extract structured data if OpenAI is available
-        if self.openai_client:
-            return self._extract_with_ai(text, document_type='receipt')
-        else:
-            # Fallback to basic text parsing
-            return self._extract_basic_receipt_data(text)
+    def _page_texts(self, text):
+        """Text of each page when the last text layer is the one text came from"""
+        if self.last_layer is not None and self.last_layer.text == text:
+            return self.last_layer.page_texts
+        return None
     
-    def _extract_with_ai(self, text, document_type='proforma'):
-        """Use OpenAI to extract structured data from text"""
+    def _extract_with_ai(self, text, document_type='proforma', fallback=None, pages=None):
+        """Use OpenAI to extract structured data from text (pages: text of each page, if known)"""
         try:
-            prompt = self._get_extraction_prompt(text, document_type)
+            chunks, prompt_stats = build_prompt_chunks(
+                text,
+                max_tokens=settings.PROMPT_MAX_INPUT_TOKENS,
+                max_chunks=settings.PROMPT_MAX_CHUNKS,
+                pages=pages
+            )
             
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
+            results = []
+            prompt_tokens = 0
+            completion_tokens = 0
+            response_ms = 0
+            for chunk in chunks:
+                prompt = self._get_extraction_prompt(chunk, document_type)
+                response = self.llm_client.complete_json([
                     {"role": "system", "content": "You are a document extraction assistant. Extract structured data from documents and return valid JSON only."},
                     {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.1
-            )
+                ])
+                results.append(json.loads(response.content))
+                prompt_tokens += response.prompt_tokens or 0
+                completion_tokens += response.completion_tokens or 0
+                response_ms += response.elapsed_ms
             
-            extracted_data = json.loads(response.choices[0].message.content)
+            extracted_data = merge_partial_results(results, document_type)
             extracted_data['extraction_metadata'] = {
                 'method': 'openai_gpt4',
                 'success': True,
-                'confidence': 'high'
+                'confidence': 'high',
+                'prompt': {
+                    **prompt_stats,
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'response_ms': response_ms,
+                }
             }
             return extracted_data
             
         except Exception as e:
             print(f"Error in AI extraction: {e}")
-            # Fallback to basic extraction
-            if document_type == 'proforma':
-                return self._extract_basic_data(text)
-            else:
-                return self._extract_basic_receipt_data(text)
+            # Fallback to rule-based extraction
+            if fallback is None:
+                if document_type == 'proforma':
+                    fallback = self._extract_basic_data(text)
+                else:
+                    fallback = self._extract_basic_receipt_data(text)
+            fallback['extraction_metadata']['fallback'] = True
+            fallback['extraction_metadata']['ai_error'] = str(e)[:200]
+            return fallback
     
     def _get_extraction_prompt(self, text, document_type):
         """Generate prompt for AI extraction"""
@@ -172,86 +312,12 @@ Return a JSON object with the following structure:
 If any field cannot be found, use empty string for text fields, null for numbers, and empty array for items."""
     
     def _extract_basic_data(self, text):
-        """Basic text parsing for proforma (fallback)"""
-        # Simple regex-based extraction (can be improved)
-        import re
-        
-        vendor_name = ""
-        total_amount = None
-        items_data = {}
-        
-        # Try to find total amount
-        amount_patterns = [
-            r'total[:\s]+[\$€£]?\s*([\d,]+\.?\d*)',
-            r'amount[:\s]+[\$€£]?\s*([\d,]+\.?\d*)',
-            r'[\$€£]\s*([\d,]+\.?\d*)',
-        ]
-        
-        for pattern in amount_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                try:
-                    total_amount = float(match.group(1).replace(',', ''))
-                    break
-                except:
-                    pass
-        
-        # Try to find vendor name (first line or company name pattern)
-        lines = text.split('\n')
-        if lines:
-            vendor_name = lines[0].strip()[:100]
-        
-        return {
-            'vendor_name': vendor_name,
-            'vendor_address': '',
-            'total_amount': total_amount,
-            'items_data': items_data,
-            'terms': '',
-            'extraction_metadata': {
-                'method': 'basic_text_parsing',
-                'success': True,
-                'confidence': 'low'
-            }
-        }
+        """Rule-based parsing for proforma (no LLM)"""
+        return rule_extractor.extract_proforma(text)
     
     def _extract_basic_receipt_data(self, text):
-        """Basic text parsing for receipt (fallback)"""
-        import re
-        
-        vendor_name = ""
-        total_amount = None
-        
-        # Try to find total amount
-        amount_patterns = [
-            r'total[:\s]+[\$€£]?\s*([\d,]+\.?\d*)',
-            r'amount[:\s]+[\$€£]?\s*([\d,]+\.?\d*)',
-        ]
-        
-        for pattern in amount_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                try:
-                    total_amount = float(match.group(1).replace(',', ''))
-                    break
-                except:
-                    pass
-        
-        # Try to find vendor name
-        lines = text.split('\n')
-        if lines:
-            vendor_name = lines[0].strip()[:100]
-        
-        return {
-            'vendor_name': vendor_name,
-            'items': [],
-            'total_amount': total_amount,
-            'date': None,
-            'extraction_metadata': {
-                'method': 'basic_text_parsing',
-                'success': True,
-                'confidence': 'low'
-            }
-        }
+        """Rule-based parsing for receipt (no LLM)"""
+        return rule_extractor.extract_receipt(text)
     
     def validate_receipt_against_po(self, receipt_data, purchase_order):
         """Validate receipt against purchase order"""
@@ -263,16 +329,17 @@ If any field cannot be found, use empty string for text fields, null for numbers
             'overall_valid': False
         }
         
-        # Check vendor name
-        receipt_vendor = receipt_data.get('vendor_name', '').lower().strip()
-        po_vendor = purchase_order.vendor_name.lower().strip()
-        validation_results['vendor_match'] = receipt_vendor == po_vendor or receipt_vendor in po_vendor or po_vendor in receipt_vendor
+        # Check vendor name (normalized: case, punctuation, accents and legal suffixes ignored)
+        receipt_vendor = receipt_data.get('vendor_name') or ''
+        validation_results['vendor_match'] = vendors_match(receipt_vendor, purchase_order.vendor_name)
         
         if not validation_results['vendor_match']:
             discrepancies.append({
                 'type': 'vendor_mismatch',
                 'expected': purchase_order.vendor_name,
-                'found': receipt_data.get('vendor_name', ''),
+                'found': receipt_vendor,
+                'similarity': round(vendor_similarity(receipt_vendor, purchase_order.vendor_name), 3),
+                'suggestions': suggest_vendors(receipt_vendor, limit=3) if receipt_vendor else [],
                 'severity': 'high'
             })
         
@@ -293,21 +360,15 @@ If any field cannot be found, use empty string for text fields, null for numbers
                     'severity': 'high'
                 })
         
-        # Check items (basic check)
+        # Match individual line items
         receipt_items = receipt_data.get('items', [])
         po_items = purchase_order.items_data.get('items', [])
         
         if receipt_items and po_items:
-            # Simple item count check
-            validation_results['items_match'] = len(receipt_items) == len(po_items)
-            
-            if not validation_results['items_match']:
-                discrepancies.append({
-                    'type': 'item_count_mismatch',
-                    'expected_count': len(po_items),
-                    'found_count': len(receipt_items),
-                    'severity': 'medium'
-                })
+            matches, line_discrepancies = match_line_items(receipt_items, po_items)
+            validation_results['line_matches'] = matches
+            validation_results['items_match'] = not line_discrepancies
+            discrepancies.extend(line_discrepancies)
         
         # Overall validation
         validation_results['overall_valid'] = (
@@ -318,3 +379,19 @@ If any field cannot be found, use empty string for text fields, null for numbers
         
         return validation_results, discrepancies
 
+
+def _event_fields(result):
+    """The headline fields of an extraction result, small enough to stream as a progress event"""
+    metadata = result.get('extraction_metadata', {})
+    items = result.get('items') or result.get('items_data', {}).get('items') or []
+    try:
+        total = float(result.get('total_amount'))
+    except (TypeError, ValueError):
+        total = None
+    return {
+        'vendor_name': result.get('vendor_name', ''),
+        'total_amount': total,
+        'item_count': len(items),
+        'method': metadata.get('method', ''),
+        'confidence': metadata.get('confidence', ''),
+    }
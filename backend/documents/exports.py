@@ -0,0 +1,339 @@
+"""
+Bulk export of purchase order PDFs.
+
+Purchase orders are selected by date, vendor and receipt status, read from
+the database in chunks, and their PDFs collected (or rendered, for POs the
+background renderer has not reached yet) in a process pool. Results are
+yielded in order through a bounded window, so a zip export streams with
+constant memory however many POs it holds (bar the archive's directory
+entry of each file, which the zip format keeps until the end). A merged PDF needs its page
+tree and cross-reference table at the end, so its pages are assembled into
+a temporary file first (memory grows with the imported page objects only,
+a few KB per PO) and then streamed; PO_EXPORT_MAX_PDF_ORDERS caps it.
+
+The response has started by the time a PO fails to read or render, so a
+failure never aborts the stream: the zip gets a PO_<number>.error.txt entry
+instead of the PDF, and the merged PDF leaves the PO out (both are logged).
+"""
+import gc
+import tempfile
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+import pypdfium2
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from .models import Receipt
+from .po_generator import po_render_context, render_po_pdf, render_queryset
+
+EXPORT_FORMATS = ('zip', 'pdf')
+
+# Receipt validation statuses, plus 'none' for POs without a receipt
+EXPORT_STATUSES = [choice for choice, _ in Receipt.VALIDATION_STATUS_CHOICES] + ['none']
+
+CONTENT_TYPES = {
+    'zip': 'application/zip',
+    'pdf': 'application/pdf',
+}
+
+# Bytes per chunk written to the response
+CHUNK_SIZE = 64 * 1024
+
+# Purchase orders read from the database per query
+QUERY_CHUNK_SIZE = 200
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+class ExportError(Exception):
+    """The export parameters are invalid"""
+
+
+def get_executor(workers):
+    """
+    Return a process pool shared by all exports in this process.
+
+    Workers are forked, which is only safe from a single-threaded process
+    such as the management command; HTTP exports default to
+    PO_EXPORT_HTTP_PROCESSES = 1 (no pool).
+    """
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=workers)
+            _executor_workers = workers
+        return _executor
+
+
+def _parse_date(value, name):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        raise ExportError(f'{name} must be a date (YYYY-MM-DD)')
+
+
+def parse_export_params(params):
+    """
+    Export options from query parameters (or command options).
+
+    Accepts output (zip or pdf), from and to (inclusive ISO dates), vendor
+    (part of the vendor name) and status (comma-separated receipt statuses).
+
+    Raises:
+        ExportError: a parameter is invalid
+    """
+    output = params.get('output') or 'zip'
+    if output not in EXPORT_FORMATS:
+        raise ExportError(f"output must be one of: {', '.join(EXPORT_FORMATS)}")
+    statuses = [status.strip() for status in (params.get('status') or '').split(',') if status.strip()]
+    unknown = set(statuses) - set(EXPORT_STATUSES)
+    if unknown:
+        raise ExportError(f"status must be one of: {', '.join(EXPORT_STATUSES)}")
+    date_from = _parse_date(params.get('from'), 'from')
+    date_to = _parse_date(params.get('to'), 'to')
+    if date_from and date_to and date_from > date_to:
+        raise ExportError('from must not be after to')
+    return {
+        'output': output,
+        'date_from': date_from,
+        'date_to': date_to,
+        'vendor': (params.get('vendor') or '').strip(),
+        'statuses': statuses,
+    }
+
+
+def filter_purchase_orders(queryset, date_from=None, date_to=None, vendor='', statuses=None, **kwargs):
+    """Purchase orders generated between the dates, for the vendor, whose receipts have one of the statuses"""
+    if date_from:
+        queryset = queryset.filter(generated_at__date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(generated_at__date__lte=date_to)
+    if vendor:
+        queryset = queryset.filter(vendor_name__icontains=vendor)
+    if statuses:
+        receipts = Receipt.objects.filter(request_id=OuterRef('request_id'))
+        matches = Exists(receipts.filter(validation_status__in=statuses))
+        if 'none' in statuses:
+            matches |= ~Exists(receipts)
+        queryset = queryset.filter(matches)
+    return queryset
+
+
+def export_filename(options):
+    """Download name such as purchase-orders-2025-10-01-to-2025-10-31.zip"""
+    parts = ['purchase-orders']
+    if options['date_from']:
+        parts.append(options['date_from'].isoformat())
+    if options['date_to']:
+        parts += ['to', options['date_to'].isoformat()]
+    return '-'.join(parts) + '.' + options['output']
+
+
+def _export_pdf(task):
+    """
+    PDF bytes of one purchase order: its stored file, or a fresh render.
+
+    Runs in pool workers, so it only touches plain data, never the database.
+    """
+    kind, value = task
+    if kind == 'file':
+        with open(value, 'rb') as f:
+            return f.read()
+    return render_po_pdf(value)
+
+
+def _task(purchase_order):
+    if purchase_order.file:
+        try:
+            return ('file', purchase_order.file.path)
+        except NotImplementedError:
+            # Storage without local paths: read it here
+            with purchase_order.file.open('rb') as f:
+                return ('bytes', f.read())
+    return ('context', po_render_context(purchase_order))
+
+
+def iter_export_documents(queryset, processes=None):
+    """
+    Yield (file name, PDF bytes, error) for each purchase order, oldest first.
+
+    A PO whose PDF could not be read or rendered comes with no bytes and the
+    error message. Missing PDFs are rendered for the export only; the
+    background renderer still owns saving them.
+    """
+    processes = settings.PO_EXPORT_PROCESSES if processes is None else processes
+    purchase_orders = render_queryset(queryset).order_by('generated_at', 'id').iterator(chunk_size=QUERY_CHUNK_SIZE)
+
+    def tasks():
+        for index, purchase_order in enumerate(purchase_orders, 1):
+            name = f'PO_{purchase_order.po_number}.pdf'
+            try:
+                task = _task(purchase_order)
+            except Exception as e:
+                task = ('error', _failure(name, e))
+            yield name, task
+            if index % QUERY_CHUNK_SIZE == 0:
+                # Loaded POs, requests and items reference each other; free each chunk's
+                # cycles now rather than letting them pile up until a full collection
+                gc.collect()
+
+    if processes <= 1:
+        for name, task in tasks():
+            if task[0] == 'error':
+                yield name, None, task[1]
+            elif task[0] == 'bytes':
+                yield name, task[1], None
+            else:
+                try:
+                    yield name, _export_pdf(task), None
+                except Exception as e:
+                    yield name, None, _failure(name, e)
+        return
+
+    executor = get_executor(processes)
+    pending = deque()
+    for name, task in tasks():
+        if task[0] in ('bytes', 'error'):
+            pending.append((name, task))
+        else:
+            pending.append((name, executor.submit(_export_pdf, task)))
+        # Bound the PDFs held in memory while the database keeps streaming
+        while len(pending) >= processes * 2:
+            yield _result(pending.popleft())
+    while pending:
+        yield _result(pending.popleft())
+
+
+def _failure(name, error):
+    print(f"Error exporting {name}: {error}")
+    return str(error) or type(error).__name__
+
+
+def _result(entry):
+    name, value = entry
+    if isinstance(value, tuple):
+        kind, data = value
+        return (name, data, None) if kind == 'bytes' else (name, None, data)
+    try:
+        return name, value.result(), None
+    except Exception as e:
+        return name, None, _failure(name, e)
+
+
+class _ZipSink:
+    """Write-only file object collecting what ZipFile writes so it can be yielded"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(documents):
+    """Yield a zip archive of the documents as it is written"""
+    sink = _ZipSink()
+    # An unseekable sink makes ZipFile stream each member with a data descriptor
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        for name, content, error in documents:
+            if error is not None:
+                name = name[:-len('.pdf')] + '.error.txt'
+                content = f'This purchase order could not be exported: {error}\n'.encode()
+            with archive.open(name, 'w') as member:
+                for start in range(0, len(content), CHUNK_SIZE):
+                    member.write(content[start:start + CHUNK_SIZE])
+            data = sink.take()
+            if data:
+                yield data
+    data = sink.take()
+    if data:
+        yield data
+
+
+def stream_merged_pdf(documents):
+    """Yield one PDF with the pages of every document that could be exported, in order"""
+    merged = pypdfium2.PdfDocument.new()
+    with tempfile.TemporaryFile() as output:
+        try:
+            for name, content, error in documents:
+                if error is not None:
+                    continue
+                try:
+                    source = pypdfium2.PdfDocument(content)
+                except pypdfium2.PdfiumError as e:
+                    _failure(name, e)
+                    continue
+                try:
+                    merged.import_pages(source)
+                finally:
+                    source.close()
+            merged.save(output)
+        finally:
+            merged.close()
+        output.seek(0)
+        while True:
+            data = output.read(CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+
+
+def export_purchase_orders(queryset, options, processes=None):
+    """
+    Stream the selected purchase orders as a zip or a merged PDF.
+
+    Args:
+        queryset: purchase orders the caller may see
+        options: dict from parse_export_params
+        processes: pool size (default PO_EXPORT_PROCESSES; 1 runs in-process)
+
+    Returns:
+        (int, iterator): number of purchase orders and the file's byte chunks
+
+    Raises:
+        ExportError: a merged PDF would exceed PO_EXPORT_MAX_PDF_ORDERS
+    """
+    queryset = filter_purchase_orders(queryset, **options)
+    count = queryset.count()
+    if options['output'] == 'pdf' and count > settings.PO_EXPORT_MAX_PDF_ORDERS:
+        raise ExportError(
+            f'A merged PDF may contain at most {settings.PO_EXPORT_MAX_PDF_ORDERS} purchase orders; '
+            f'{count} match, export them as a zip instead'
+        )
+    documents = iter_export_documents(queryset, processes)
+    if options['output'] == 'pdf':
+        return count, stream_merged_pdf(documents)
+    return count, stream_zip(documents)
+
+
+async def aiter_chunks(chunks):
+    """
+    Async iterator over a sync chunk iterator.
+
+    Under ASGI Django would otherwise buffer a sync iterator whole before
+    sending it; each chunk is produced in the request's sync thread instead,
+    so the queryset keeps its database connection.
+    """
+    done = object()
+    next_chunk = sync_to_async(next)
+    while True:
+        chunk = await next_chunk(chunks, done)
+        if chunk is done:
+            return
+        yield chunk
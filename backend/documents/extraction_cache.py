@@ -0,0 +1,112 @@
+"""
+Persistent extraction cache keyed by document content.
+
+Entries are looked up by the SHA-256 of the file bytes, so re-validating a
+receipt or uploading the same vendor PDF to another request costs one hash
+and one query instead of another round of OCR and LLM calls.
+
+The cache's total size is kept as a running estimate in each process: puts
+add their size, and the table is only summed (and trimmed) when the
+estimate goes over the limit or every EVICT_SYNC_PUTS puts, which also
+picks up what other processes stored.
+"""
+import hashlib
+import threading
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import ExtractionCacheEntry
+
+# Puts between authoritative size checks when the estimate stays under the limit
+EVICT_SYNC_PUTS = 100
+
+_estimated_total = None
+_puts_since_sync = 0
+_estimate_lock = threading.Lock()
+
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    """Hash a file without loading it into memory"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """Size-bounded, LRU-evicted store of extracted text and structured results"""
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes if max_bytes is not None else settings.EXTRACTION_CACHE_MAX_BYTES
+
+    def get(self, content_hash, document_type):
+        """Return the cache entry for a document, or None"""
+        entry = ExtractionCacheEntry.objects.filter(
+            content_hash=content_hash,
+            document_type=document_type
+        ).first()
+        if entry:
+            ExtractionCacheEntry.objects.filter(pk=entry.pk).update(
+                hits=F('hits') + 1,
+                last_used_at=timezone.now()
+            )
+        return entry
+
+    def put(self, content_hash, document_type, text, text_version, result=None, result_version=''):
+        """Store (or replace) the extracted text and, if available, the structured result"""
+        defaults = {
+            'text': text,
+            'text_version': text_version,
+            'result': result or {},
+            'result_version': result_version if result else '',
+            'size': len(text.encode('utf-8')) + (len(str(result)) if result else 0),
+        }
+        try:
+            with transaction.atomic():
+                ExtractionCacheEntry.objects.update_or_create(
+                    content_hash=content_hash,
+                    document_type=document_type,
+                    defaults=defaults
+                )
+        except IntegrityError:
+            # Another worker cached the same document concurrently
+            return
+        if self._count_put(defaults['size']):
+            self.evict()
+
+    def _count_put(self, size):
+        """Add a put to the running size estimate; True if it is time to evict"""
+        global _estimated_total, _puts_since_sync
+        with _estimate_lock:
+            if _estimated_total is None:
+                return True
+            _puts_since_sync += 1
+            if _puts_since_sync >= EVICT_SYNC_PUTS:
+                return True
+            # Replacing an entry counts its size twice; the next sync corrects that
+            _estimated_total += size
+            return _estimated_total > self.max_bytes
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        global _estimated_total, _puts_since_sync
+        total = ExtractionCacheEntry.objects.aggregate(total=Sum('size'))['total'] or 0
+        if total > self.max_bytes:
+            total = self._delete_stale(total)
+        with _estimate_lock:
+            _estimated_total = total
+            _puts_since_sync = 0
+
+    def _delete_stale(self, total):
+        """Delete least recently used entries until total fits; returns the new total"""
+        stale = ExtractionCacheEntry.objects.order_by('last_used_at').values_list('pk', 'size')
+        to_delete = []
+        for pk, size in stale.iterator():
+            if total <= self.max_bytes:
+                break
+            to_delete.append(pk)
+            total -= size
+        ExtractionCacheEntry.objects.filter(pk__in=to_delete).delete()
+        return total
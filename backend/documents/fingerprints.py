@@ -0,0 +1,219 @@
+"""
+Near-duplicate detection for uploaded proformas and receipts.
+
+Each document gets a 64-bit difference hash of its first page image and a
+MinHash signature of its extracted text. Both are split into bands and
+stored as locality-sensitive hashing buckets, so finding likely duplicates
+of a new upload is an indexed lookup of its own buckets rather than a scan
+of every stored document.
+"""
+import hashlib
+import os
+import re
+import zlib
+import numpy as np
+import pypdfium2
+from django.db import transaction
+from PIL import Image, ImageOps
+from .models import DocumentFingerprint, FingerprintBucket
+from .previews import document_hash
+
+# MinHash signature length and its LSH banding (16 bands x 4 rows: ~50% similar texts become candidates)
+NUM_PERMUTATIONS = 64
+TEXT_BANDS = 16
+
+# Character shingle size; robust to OCR noise while still distinguishing documents
+SHINGLE_SIZE = 5
+
+# The 64-bit image hash is split into 4 bands of 16 bits: pairs within 3 bits
+# always share a band, pairs within IMAGE_MAX_DISTANCE bits usually do
+IMAGE_BANDS = 4
+IMAGE_MAX_DISTANCE = 6
+
+# Estimated text Jaccard similarity above which documents are likely duplicates
+TEXT_DUPLICATE_THRESHOLD = 0.8
+# Lower text similarity accepted when the page images also match
+TEXT_SUPPORT_THRESHOLD = 0.5
+
+# Universal hashing parameters for the MinHash permutations (fixed so signatures stay comparable)
+MERSENNE_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(20240611)
+PERMUTATION_A = _rng.randint(1, MERSENNE_PRIME, NUM_PERMUTATIONS).astype(np.uint64)
+PERMUTATION_B = _rng.randint(0, MERSENNE_PRIME, NUM_PERMUTATIONS).astype(np.uint64)
+
+NON_WORD = re.compile(r'[^a-z0-9]+')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+
+
+def _first_page_image(file_path):
+    """Small grayscale image of the document's first page, or None"""
+    extension = os.path.splitext(file_path)[1].lower()
+    try:
+        if extension == '.pdf':
+            pdf = pypdfium2.PdfDocument(file_path)
+            try:
+                if len(pdf) == 0:
+                    return None
+                page = pdf[0]
+                image = page.render(scale=0.5, grayscale=True).to_pil()
+                page.close()
+            finally:
+                pdf.close()
+            return image.convert('L')
+        if extension in IMAGE_EXTENSIONS:
+            with Image.open(file_path) as image:
+                image.draft('L', (256, 256))
+                return image.convert('L')
+    except Exception as e:
+        print(f"Error rendering document for fingerprint: {e}")
+    return None
+
+
+def image_hash(file_path):
+    """64-bit difference hash of the first page as 16 hex digits, or '' if it cannot be rendered"""
+    image = _first_page_image(file_path)
+    if image is None:
+        return ''
+    # Hash the printed area only, so margins and page size don't dominate the hash
+    box = ImageOps.invert(image.point(lambda value: 255 if value > 200 else 0)).getbbox()
+    if box:
+        image = image.crop(box)
+    pixels = np.asarray(image.resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    if bits.all() or not bits.any():
+        # Blank or uniform pages all hash alike and say nothing about duplication
+        return ''
+    return f'{int("".join("1" if bit else "0" for bit in bits), 2):016x}'
+
+
+def hamming_distance(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def shingles(text):
+    normalized = ' '.join(NON_WORD.sub(' ', (text or '').lower()).split())
+    if len(normalized) < SHINGLE_SIZE:
+        return set()
+    return {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+def text_signature(text):
+    """MinHash signature of the text's character shingles ([] for empty text)"""
+    grams = shingles(text)
+    if not grams:
+        return []
+    values = np.fromiter((zlib.crc32(gram.encode()) for gram in grams), dtype=np.uint64, count=len(grams))
+    values %= MERSENNE_PRIME
+    hashed = (values[None, :] * PERMUTATION_A[:, None] + PERMUTATION_B[:, None]) % MERSENNE_PRIME
+    return hashed.min(axis=1).astype(int).tolist()
+
+
+def signature_similarity(a, b):
+    """Estimated Jaccard similarity of two MinHash signatures"""
+    if not a or not b or len(a) != len(b):
+        return 0.0
+    return float(np.mean(np.asarray(a) == np.asarray(b)))
+
+
+def bucket_keys(image_hash_value, signature):
+    """LSH bucket keys for an image hash and a text signature"""
+    keys = []
+    if image_hash_value:
+        width = 16 // IMAGE_BANDS
+        for band in range(IMAGE_BANDS):
+            keys.append(f'i{band}:{image_hash_value[band * width:(band + 1) * width]}')
+    if signature:
+        rows = len(signature) // TEXT_BANDS
+        for band in range(TEXT_BANDS):
+            values = ','.join(str(value) for value in signature[band * rows:(band + 1) * rows])
+            keys.append(f't{band}:{hashlib.blake2b(values.encode(), digest_size=8).hexdigest()}')
+    return keys
+
+
+def _compare(fingerprint, candidate):
+    """Duplicate evidence between two fingerprints, or None if they are not likely duplicates"""
+    if fingerprint.content_hash and fingerprint.content_hash == candidate.content_hash:
+        return {'match': 'identical_file', 'text_similarity': 1.0, 'image_distance': 0, 'severity': 'high'}
+
+    text_similarity = signature_similarity(fingerprint.text_signature, candidate.text_signature)
+    distance = None
+    if fingerprint.image_hash and candidate.image_hash:
+        distance = hamming_distance(fingerprint.image_hash, candidate.image_hash)
+    image_match = distance is not None and distance <= IMAGE_MAX_DISTANCE
+    no_text = not fingerprint.text_signature or not candidate.text_signature
+
+    if text_similarity >= TEXT_DUPLICATE_THRESHOLD:
+        match = 'text_and_image' if image_match else 'text'
+    elif image_match and (no_text or text_similarity >= TEXT_SUPPORT_THRESHOLD):
+        match = 'image'
+    else:
+        return None
+    return {
+        'match': match,
+        'text_similarity': round(text_similarity, 3),
+        'image_distance': distance,
+        'severity': 'high' if text_similarity >= 0.95 or match == 'text_and_image' else 'medium',
+    }
+
+
+def find_duplicates(fingerprint, keys=None):
+    """Stored documents of the same type that are likely duplicates of this fingerprint"""
+    if keys is None:
+        keys = list(fingerprint.buckets.values_list('key', flat=True))
+    candidates = DocumentFingerprint.objects.filter(document_type=fingerprint.document_type).exclude(pk=fingerprint.pk)
+    if fingerprint.content_hash:
+        candidates = candidates.filter(buckets__key__in=keys) | candidates.filter(content_hash=fingerprint.content_hash)
+    else:
+        candidates = candidates.filter(buckets__key__in=keys)
+
+    duplicates = []
+    for candidate in candidates.distinct().select_related('proforma', 'receipt'):
+        evidence = _compare(fingerprint, candidate)
+        if evidence is None:
+            continue
+        document = candidate.proforma or candidate.receipt
+        duplicates.append({
+            'type': 'possible_duplicate',
+            'duplicate_of': document.pk,
+            'request': document.request_id,
+            **evidence,
+        })
+    duplicates.sort(key=lambda item: (item['severity'] != 'high', -item['text_similarity']))
+    return duplicates
+
+
+def fingerprint_document(document, document_type, text):
+    """
+    Store the fingerprint of a Proforma or Receipt and return its likely duplicates.
+
+    Args:
+        document: Proforma or Receipt instance with a file
+        document_type: 'proforma' or 'receipt'
+        text: text extracted from the document
+
+    Returns:
+        list: 'possible_duplicate' discrepancy dicts, most likely first
+    """
+    file_path = document.file.path
+    # Hashed while uploading; only older rows are hashed (and stored) here
+    content_hash = document_hash(document)
+    image_hash_value = image_hash(file_path)
+    signature = text_signature(text)
+
+    keys = bucket_keys(image_hash_value, signature)
+    with transaction.atomic():
+        fingerprint, _ = DocumentFingerprint.objects.update_or_create(
+            **{document_type: document},
+            defaults={
+                'document_type': document_type,
+                'content_hash': content_hash,
+                'image_hash': image_hash_value,
+                'text_signature': signature,
+            }
+        )
+        fingerprint.buckets.all().delete()
+        FingerprintBucket.objects.bulk_create([
+            FingerprintBucket(fingerprint=fingerprint, key=key)
+            for key in keys
+        ])
+    return find_duplicates(fingerprint, keys)
@@ -0,0 +1,293 @@
+"""
+DB-backed job queue for document extraction and receipt validation.
+
+Uploads enqueue an ExtractionJob and return immediately; the
+``run_document_worker`` management command claims queued jobs and runs the
+OCR/LLM work outside the request/response cycle.
+"""
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import ExtractionEvent, ExtractionJob
+from .document_processor import DocumentProcessor
+from .previews import warm_previews
+from .services import process_proforma, render_purchase_order_pdf, validate_receipt
+
+
+def enqueue_job(job_type, created_by=None, proforma=None, receipt=None, purchase_order=None):
+    """
+    Queue a job for the document worker (or run it inline if configured).
+
+    Inside a transaction the job row commits with it; an inline run waits
+    until the transaction has committed.
+    """
+    job = ExtractionJob.objects.create(
+        job_type=job_type,
+        created_by=created_by,
+        proforma=proforma,
+        receipt=receipt,
+        purchase_order=purchase_order,
+    )
+
+    if settings.DOCUMENT_JOBS_INLINE:
+        transaction.on_commit(lambda: _run_inline(job))
+
+    return job
+
+
+def _run_inline(job):
+    claimed = claim_job(job.pk, worker_name(), _claimable_filter())
+    if claimed:
+        run_job(claimed)
+        job.refresh_from_db()
+
+
+def worker_name():
+    """Identify the current worker process in job bookkeeping"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _stale_before():
+    return timezone.now() - timedelta(seconds=settings.DOCUMENT_JOB_TIMEOUT)
+
+
+def _claimable_filter():
+    """Queued jobs, plus running jobs whose worker stopped sending heartbeats"""
+    return Q(status='queued') | Q(status='running', heartbeat_at__lt=_stale_before())
+
+
+def claim_job(pk, worker, claimable):
+    """
+    Atomically move a single job to 'running'.
+
+    The conditional UPDATE acts as the lock: when several workers race for the
+    same row only one of them sees an updated row count of 1.
+    """
+    now = timezone.now()
+    claimed = ExtractionJob.objects.filter(claimable, pk=pk).update(
+        status='running',
+        worker=worker,
+        started_at=now,
+        heartbeat_at=now,
+        attempts=F('attempts') + 1,
+    )
+    if claimed:
+        return ExtractionJob.objects.get(pk=pk)
+    return None
+
+
+def claim_next_job(worker, batch_size=10):
+    """Claim the oldest available job, or return None if the queue is empty"""
+    claimable = _claimable_filter()
+
+    # Give up on jobs that keep killing their worker
+    ExtractionJob.objects.filter(
+        status='running',
+        heartbeat_at__lt=_stale_before(),
+        attempts__gte=settings.DOCUMENT_JOB_MAX_ATTEMPTS,
+    ).update(
+        status='failed',
+        error='Job timed out too many times',
+        finished_at=timezone.now(),
+    )
+
+    candidates = ExtractionJob.objects.filter(claimable).order_by('created_at').values_list('pk', flat=True)
+    for pk in candidates[:batch_size]:
+        job = claim_job(pk, worker, claimable)
+        if job:
+            return job
+    return None
+
+
+class Heartbeat:
+    """
+    Refresh a running job's heartbeat from a background thread.
+
+    Progress reports also beat, but one OCR page or a run of LLM retries can
+    take longer than DOCUMENT_JOB_TIMEOUT; without a beat in between, another
+    worker would reclaim the job while it is still running. Beats stop once
+    the job is no longer running under this worker.
+    """
+
+    def __init__(self, job, interval=None):
+        self.job = job
+        self.interval = settings.DOCUMENT_JOB_HEARTBEAT_INTERVAL if interval is None else interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'heartbeat-{job.pk}', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                beating = ExtractionJob.objects.filter(
+                    pk=self.job.pk, status='running', worker=self.job.worker
+                ).update(heartbeat_at=timezone.now())
+                if not beating:
+                    break
+        except Exception as e:
+            print(f"Error sending heartbeat for {self.job}: {e}")
+        finally:
+            # The thread's own database connection
+            connection.close()
+
+
+def _run_proforma_extraction(job, processor):
+    job.report_progress(10, 'extracting')
+    process_proforma(job.proforma, processor)
+    job.report_progress(95, 'rendering preview')
+    warm_previews(job.proforma)
+
+
+def _run_receipt_extraction(job, processor):
+    validate_receipt(job.receipt, processor, extract=True, progress=job.report_progress)
+    job.report_progress(95, 'rendering preview')
+    warm_previews(job.receipt)
+
+
+def _run_receipt_validation(job, processor):
+    validate_receipt(job.receipt, processor, extract=True, progress=job.report_progress)
+
+
+def _run_purchase_order_render(job, processor):
+    job.report_progress(10, 'rendering')
+    purchase_order = render_purchase_order_pdf(job.purchase_order)
+    job.report_progress(95, 'rendering preview')
+    warm_previews(purchase_order)
+
+
+JOB_HANDLERS = {
+    'proforma_extraction': _run_proforma_extraction,
+    'receipt_extraction': _run_receipt_extraction,
+    'receipt_validation': _run_receipt_validation,
+    'purchase_order_render': _run_purchase_order_render,
+}
+
+
+# Progress reported for extraction steps (see DocumentProcessor.emit); pages fill the range up to text extraction
+STAGE_PROGRESS = {
+    'text extracted': 40,
+    'llm started': 45,
+    'fields parsed': 60,
+}
+PAGE_PROGRESS_RANGE = (10, 40)
+
+
+def _stage_reporter(job):
+    """DocumentProcessor.on_event callback that records extraction steps on the job"""
+    def on_event(stage, data):
+        if stage == 'page extracted' and data.get('pages'):
+            start, end = PAGE_PROGRESS_RANGE
+            progress = start + (end - start) * min(data['page'], data['pages']) // data['pages']
+        else:
+            progress = STAGE_PROGRESS.get(stage, job.progress)
+        job.report_progress(max(progress, job.progress), stage, data)
+    return on_event
+
+
+def run_job(job, processor=None):
+    """Execute a claimed job and record its outcome"""
+    handler = JOB_HANDLERS[job.job_type]
+    processor = processor or DocumentProcessor()
+
+    processor.on_event = _stage_reporter(job)
+    try:
+        with Heartbeat(job):
+            handler(job, processor)
+    except Exception as e:
+        print(f"Error running {job}: {e}")
+        traceback.print_exc()
+        job.status = 'failed'
+        job.error = str(e)
+    else:
+        job.status = 'completed'
+        job.progress = 100
+        job.stage = 'done'
+        job.error = ''
+    finally:
+        processor.on_event = None
+
+    job.finished_at = timezone.now()
+    # Like claiming, the conditional UPDATE decides: a worker whose job was
+    # reclaimed after its heartbeat went stale must not overwrite the new run
+    finished = ExtractionJob.objects.filter(pk=job.pk, worker=job.worker, status='running').update(
+        status=job.status,
+        progress=job.progress,
+        stage=job.stage,
+        error=job.error,
+        finished_at=job.finished_at,
+    )
+    if not finished:
+        print(f"Job {job.pk} was reclaimed by another worker; discarding this run's outcome")
+        job.refresh_from_db()
+        return job
+    ExtractionEvent.objects.create(
+        job=job,
+        progress=job.progress,
+        stage=job.stage if job.status == 'completed' else 'failed',
+        data={'status': job.status, 'error': job.error}
+    )
+    prune_events_periodically()
+    return job
+
+
+def prune_events():
+    """Delete progress events of jobs that finished more than JOB_EVENTS_TTL seconds ago"""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_EVENTS_TTL)
+    deleted, _ = ExtractionEvent.objects.filter(job__finished_at__lt=cutoff).delete()
+    return deleted
+
+
+_last_prune = None
+
+
+def prune_events_periodically():
+    """Run prune_events at most once per JOB_EVENTS_PRUNE_INTERVAL seconds in this process"""
+    global _last_prune
+    now = time.monotonic()
+    if _last_prune is not None and now - _last_prune < settings.JOB_EVENTS_PRUNE_INTERVAL:
+        return 0
+    _last_prune = now
+    return prune_events()
+
+
+def work(poll_interval=2.0, burst=False, should_stop=None):
+    """
+    Worker loop: claim and run jobs until stopped.
+
+    Args:
+        poll_interval: seconds to sleep when the queue is empty
+        burst: return as soon as the queue is empty
+        should_stop: optional callable checked between jobs
+
+    Returns:
+        int: number of jobs processed
+    """
+    name = worker_name()
+    processor = DocumentProcessor()
+    processed = 0
+
+    while not (should_stop and should_stop()):
+        job = claim_next_job(name)
+        if job is None:
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_job(job, processor)
+        processed += 1
+
+    return processed
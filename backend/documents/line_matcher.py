@@ -0,0 +1,215 @@
+"""
+Line-item matching between receipts and purchase orders.
+
+Receipt lines are paired with PO lines by an optimal assignment over a
+combined score of description similarity (character trigram cosine),
+quantity and unit price. Scores for all pairs are computed at once with
+NumPy, so documents with hundreds of lines match in milliseconds.
+"""
+import re
+import numpy as np
+
+# Weights of the combined pair score
+DESCRIPTION_WEIGHT = 0.6
+QUANTITY_WEIGHT = 0.15
+PRICE_WEIGHT = 0.25
+
+# Pairs whose descriptions are less similar than this are never matched
+MIN_DESCRIPTION_SIMILARITY = 0.35
+
+# Cost given to pairs that may not be matched; the assignment only picks them when forced
+FORBIDDEN_COST = 10.0
+
+# Unit prices that differ by less than this are treated as equal (same as the total check)
+PRICE_TOLERANCE = 0.01
+
+NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def _number(value):
+    try:
+        return float(str(value).replace(',', '').strip())
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _description(item):
+    text = item.get('description') or item.get('name') or ''
+    return ' '.join(NON_WORD.sub(' ', str(text).lower()).split())
+
+
+def _line_values(items):
+    """Quantities and unit prices as arrays; missing values are NaN"""
+    quantities = np.array([_number(item.get('quantity', 1)) for item in items], dtype=float)
+    prices = np.array([_number(item.get('unit_price')) for item in items], dtype=float)
+    totals = np.array([_number(item.get('total', item.get('total_price'))) for item in items], dtype=float)
+    # Derive a unit price from the line total where only the total was read
+    derived = np.divide(totals, quantities, out=np.full_like(totals, np.nan), where=quantities > 0)
+    prices = np.where(np.isnan(prices), derived, prices)
+    return quantities, prices
+
+
+def _trigram_indices(descriptions, vocabulary):
+    """(row, trigram column) index pairs for building trigram count vectors"""
+    rows, columns = [], []
+    for row, text in enumerate(descriptions):
+        padded = f'  {text} '
+        for index in range(len(padded) - 2):
+            rows.append(row)
+            columns.append(vocabulary.setdefault(padded[index:index + 3], len(vocabulary)))
+    return rows, columns
+
+
+def description_similarity(a, b):
+    """Cosine similarity of character trigrams for every pair of descriptions (len(a) x len(b))"""
+    vocabulary = {}
+    a_rows, a_columns = _trigram_indices(a, vocabulary)
+    b_rows, b_columns = _trigram_indices(b, vocabulary)
+    matrix_a = np.zeros((len(a), len(vocabulary)))
+    matrix_b = np.zeros((len(b), len(vocabulary)))
+    np.add.at(matrix_a, (a_rows, a_columns), 1)
+    np.add.at(matrix_b, (b_rows, b_columns), 1)
+    for matrix in (matrix_a, matrix_b):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix_a @ matrix_b.T
+
+
+def _closeness(a, b):
+    """1 for equal values falling to 0 as the relative difference reaches 100%; 1 where unknown"""
+    a, b = a[:, None], b[None, :]
+    scale = np.maximum(np.abs(a), np.abs(b))
+    difference = np.divide(np.abs(a - b), scale, out=np.zeros(np.broadcast(a, b).shape), where=scale > 0)
+    closeness = 1 - np.minimum(difference, 1)
+    return np.where(np.isnan(closeness), 1.0, closeness)
+
+
+def assign(cost):
+    """
+    Minimum-cost assignment of rows to columns (Hungarian method, shortest augmenting paths).
+
+    Returns:
+        list of (row, column) pairs; every row is assigned if rows <= columns, else every column
+    """
+    cost = np.asarray(cost, dtype=float)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=int)  # owner[j]: 1-based row assigned to column j
+    way = np.zeros(m + 1, dtype=int)
+
+    for row in range(1, n + 1):
+        owner[0] = row
+        column = 0
+        min_values = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[column] = True
+            current_row = owner[column]
+            reduced = cost[current_row - 1] - u[current_row] - v[1:]
+            free = ~used[1:]
+            better = free & (reduced < min_values[1:])
+            min_values[1:][better] = reduced[better]
+            way[1:][better] = column
+            candidates = np.where(free, min_values[1:], np.inf)
+            next_column = int(np.argmin(candidates)) + 1
+            delta = candidates[next_column - 1]
+            u[owner[used]] += delta
+            v[used] -= delta
+            min_values[1:][free] -= delta
+            column = next_column
+            if owner[column] == 0:
+                break
+        while column:
+            previous = way[column]
+            owner[column] = owner[previous]
+            column = previous
+
+    pairs = [(int(owner[j]) - 1, j - 1) for j in range(1, m + 1) if owner[j]]
+    if transposed:
+        pairs = [(j, i) for i, j in pairs]
+    return sorted(pairs)
+
+
+def match_line_items(receipt_items, po_items):
+    """
+    Pair receipt lines with PO lines and report per-line discrepancies.
+
+    Returns:
+        tuple: (list of match dicts, list of discrepancy dicts)
+    """
+    receipt_items = [item for item in receipt_items or [] if isinstance(item, dict)]
+    po_items = [item for item in po_items or [] if isinstance(item, dict)]
+    matches = []
+    pairs = []
+    if receipt_items and po_items:
+        receipt_quantities, receipt_prices = _line_values(receipt_items)
+        po_quantities, po_prices = _line_values(po_items)
+        descriptions = description_similarity(
+            [_description(item) for item in receipt_items],
+            [_description(item) for item in po_items],
+        )
+        score = (
+            DESCRIPTION_WEIGHT * descriptions
+            + QUANTITY_WEIGHT * _closeness(receipt_quantities, po_quantities)
+            + PRICE_WEIGHT * _closeness(receipt_prices, po_prices)
+        )
+        allowed = descriptions >= MIN_DESCRIPTION_SIMILARITY
+        cost = np.where(allowed, 1 - score, FORBIDDEN_COST)
+        pairs = [(i, j) for i, j in assign(cost) if allowed[i, j]]
+
+    discrepancies = []
+    for i, j in pairs:
+        matches.append({
+            'receipt_line': i,
+            'po_line': j,
+            'score': round(float(score[i, j]), 3),
+            'description_similarity': round(float(descriptions[i, j]), 3),
+        })
+        line = {
+            'receipt_line': i,
+            'po_line': j,
+            'description': receipt_items[i].get('description') or po_items[j].get('description', ''),
+        }
+        found_quantity, expected_quantity = receipt_quantities[i], po_quantities[j]
+        if not np.isnan(found_quantity) and not np.isnan(expected_quantity) and found_quantity != expected_quantity:
+            discrepancies.append({
+                'type': 'line_quantity_mismatch',
+                **line,
+                'expected': float(expected_quantity),
+                'found': float(found_quantity),
+                'severity': 'high' if found_quantity > expected_quantity else 'medium'
+            })
+        found_price, expected_price = receipt_prices[i], po_prices[j]
+        if not np.isnan(found_price) and not np.isnan(expected_price) and abs(found_price - expected_price) >= PRICE_TOLERANCE:
+            discrepancies.append({
+                'type': 'line_price_mismatch',
+                **line,
+                'expected': round(float(expected_price), 2),
+                'found': round(float(found_price), 2),
+                'difference': round(float(found_price - expected_price), 2),
+                'severity': 'high' if found_price > expected_price else 'low'
+            })
+
+    matched_receipt_lines = {i for i, _ in pairs}
+    matched_po_lines = {j for _, j in pairs}
+    for i, item in enumerate(receipt_items):
+        if i not in matched_receipt_lines:
+            discrepancies.append({
+                'type': 'unexpected_line_item',
+                'receipt_line': i,
+                'found': item,
+                'severity': 'high'
+            })
+    for j, item in enumerate(po_items):
+        if j not in matched_po_lines:
+            discrepancies.append({
+                'type': 'missing_line_item',
+                'po_line': j,
+                'expected': item,
+                'severity': 'medium'
+            })
+    return matches, discrepancies
@@ -0,0 +1,196 @@
+"""
+Process-wide LLM client used for document extraction.
+
+One OpenAI client (and so one keep-alive HTTP connection pool) is shared by
+every DocumentProcessor in a process. Calls have a per-attempt timeout and an
+overall deadline, transient failures are retried with jittered exponential
+backoff, and a circuit breaker short-circuits straight to the regex fallback
+while the provider is failing.
+"""
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+import httpx
+import openai
+from django.conf import settings
+from openai import OpenAI
+
+# Errors worth retrying; anything else (bad request, auth) fails immediately
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+LLMResponse = namedtuple('LLMResponse', ['content', 'prompt_tokens', 'completion_tokens', 'elapsed_ms'])
+
+
+class LLMUnavailable(Exception):
+    """Raised when the LLM cannot be used for this call (circuit open or retries exhausted)"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed: calls go through. After failure_threshold consecutive failures the
+    circuit opens and calls are rejected for reset_timeout seconds, then a
+    single trial call is let through (half-open) to decide whether to close.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        """True if a call may be attempted now"""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self._trial_in_flight = False
+
+
+class LLMClient:
+    """OpenAI chat client with deadlines, bounded retries and a circuit breaker"""
+
+    def __init__(self, api_key, base_url=None, model='gpt-4o-mini', timeout=30.0,
+                 max_retries=2, deadline=60.0, breaker=None, max_connections=10):
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker()
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=60.0,
+            ),
+            timeout=timeout,
+        )
+        # Retries are handled here so they share the deadline and the breaker
+        self.client = OpenAI(
+            api_key=api_key,
+            base_url=base_url or None,
+            http_client=self.http_client,
+            max_retries=0,
+            timeout=timeout,
+        )
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff, capped at 8 seconds"""
+        return random.uniform(0, min(8.0, 0.5 * (2 ** attempt)))
+
+    def complete_json(self, messages, temperature=0.1):
+        """
+        Run a JSON-mode chat completion.
+
+        Returns:
+            LLMResponse: message content, token usage and wall time of the call
+
+        Raises:
+            LLMUnavailable: circuit open, deadline exceeded or retries exhausted
+            openai.OpenAIError: non-retryable API errors
+        """
+        if not self.breaker.allow():
+            raise LLMUnavailable('LLM circuit breaker is open')
+
+        started = time.monotonic()
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            remaining = self.deadline - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            try:
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    response_format={"type": "json_object"},
+                    temperature=temperature,
+                    timeout=min(self.timeout, remaining),
+                )
+            except RETRYABLE_ERRORS as e:
+                last_error = e
+                if attempt < self.max_retries:
+                    pause = self._backoff(attempt)
+                    if time.monotonic() - started + pause >= self.deadline:
+                        break
+                    time.sleep(pause)
+                continue
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_success()
+            usage = response.usage
+            return LLMResponse(
+                content=response.choices[0].message.content,
+                prompt_tokens=usage.prompt_tokens if usage else None,
+                completion_tokens=usage.completion_tokens if usage else None,
+                elapsed_ms=round((time.monotonic() - started) * 1000),
+            )
+
+        self.breaker.record_failure()
+        raise LLMUnavailable(f'LLM call failed after retries: {last_error}')
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """Return this process's shared LLM client, or None if no API key is configured"""
+    global _client, _client_pid
+    if not settings.OPENAI_API_KEY:
+        return None
+    with _client_lock:
+        # Connection pools must not be shared across fork
+        if _client is None or _client_pid != os.getpid():
+            _client = LLMClient(
+                api_key=settings.OPENAI_API_KEY,
+                base_url=settings.OPENAI_BASE_URL,
+                model=settings.OPENAI_MODEL,
+                timeout=settings.LLM_TIMEOUT,
+                max_retries=settings.LLM_MAX_RETRIES,
+                deadline=settings.LLM_DEADLINE,
+                breaker=CircuitBreaker(
+                    failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+                    reset_timeout=settings.LLM_CIRCUIT_RESET_TIMEOUT,
+                ),
+            )
+            _client_pid = os.getpid()
+    return _client
@@ -0,0 +1,114 @@
+"""
+Management command to benchmark document extraction speed and accuracy.
+
+Results are checked against a stored baseline (documents/benchmark_baseline.json)
+and the command fails if accuracy drops or a stage gets much slower.
+"""
+import json
+import shutil
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from documents.benchmark import (
+    ACCURACY_TOLERANCE,
+    BASELINE_PATH,
+    MAX_SLOWDOWN,
+    build_corpus,
+    compare_to_baseline,
+    load_baseline,
+    make_baseline,
+    run_benchmark,
+)
+
+STAGES = ['text_pdf', 'ocr', 'rules', 'llm_stub', 'po_render']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark extraction paths on a synthetic proforma/receipt corpus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=20, help='Documents of each type to generate')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the corpus')
+        parser.add_argument(
+            '--stages',
+            default=','.join(STAGES),
+            help=f'Comma-separated stages to run ({", ".join(STAGES)})',
+        )
+        parser.add_argument('--stub-latency', type=float, default=0.0, help='Seconds the stub LLM waits per call')
+        parser.add_argument('--output-dir', help='Write the corpus here and keep it (default: temporary directory)')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+        parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline results to check against')
+        parser.add_argument('--save-baseline', action='store_true', help='Write these results as the new baseline')
+        parser.add_argument('--no-check', action='store_true', help='Do not fail on regressions against the baseline')
+        parser.add_argument(
+            '--accuracy-tolerance',
+            type=float,
+            default=ACCURACY_TOLERANCE,
+            help='Allowed drop in field accuracy before failing',
+        )
+        parser.add_argument(
+            '--max-slowdown',
+            type=float,
+            default=MAX_SLOWDOWN,
+            help='Allowed p95 latency as a multiple of the baseline (0 disables the timing check)',
+        )
+
+    def handle(self, *args, **options):
+        stages = [stage.strip() for stage in options['stages'].split(',') if stage.strip()]
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise CommandError(f'Unknown stages: {", ".join(sorted(unknown))}')
+
+        directory = options['output_dir'] or tempfile.mkdtemp(prefix='extraction-benchmark-')
+        try:
+            corpus = build_corpus(directory, options['count'], seed=options['seed'])
+            results = run_benchmark(corpus, stages, stub_latency=options['stub_latency'])
+        finally:
+            if not options['output_dir']:
+                shutil.rmtree(directory, ignore_errors=True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.print_results(corpus, results)
+        self.check_baseline(results, options)
+
+    def check_baseline(self, results, options):
+        if options['save_baseline']:
+            with open(options['baseline'], 'w') as f:
+                json.dump(make_baseline(results, options['count'], options['seed']), f, indent=2)
+                f.write('\n')
+            self.stderr.write(f"Saved baseline to {options['baseline']}")
+            return
+        if options['no_check']:
+            return
+        try:
+            baseline = load_baseline(options['baseline'])
+        except FileNotFoundError:
+            raise CommandError(f"No baseline at {options['baseline']}; run with --save-baseline or --no-check")
+        if (baseline['count'], baseline['seed']) != (options['count'], options['seed']):
+            self.stderr.write(
+                f"Baseline was recorded with --count {baseline['count']} --seed {baseline['seed']}; "
+                'accuracy is compared across different corpora'
+            )
+        failures = compare_to_baseline(
+            results,
+            baseline,
+            accuracy_tolerance=options['accuracy_tolerance'],
+            max_slowdown=options['max_slowdown'] or None,
+        )
+        if failures:
+            raise CommandError('Benchmark regressed against the baseline:\n' + '\n'.join(failures))
+
+    def print_results(self, corpus, results):
+        self.stdout.write(self.style.SUCCESS(f'Benchmarked {len(corpus)} documents'))
+        for result in results:
+            if result['skipped']:
+                self.stdout.write(f"{result['stage']:<10} skipped: {result['skipped']}")
+                continue
+            accuracy = ', '.join(f'{field}={value:.0%}' for field, value in result['accuracy'].items())
+            self.stdout.write(
+                f"{result['stage']:<10} docs={result['documents']} errors={result['errors']} "
+                f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+                f"pages/s={result['pages_per_sec']} rss+={result['rss_growth_mb']}MB"
+                + (f' | {accuracy}' if accuracy else '')
+            )
@@ -0,0 +1,97 @@
+"""
+Management command to move documents stored under their uploaded names into
+content-addressed storage (deduplicating identical files) and to reconcile
+blob reference counts with the documents that actually use them.
+"""
+import os
+from collections import Counter
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from documents.models import DocumentBlob, Proforma, PurchaseOrder, Receipt
+from documents.storage import BLOB_DIR, document_storage, is_blob
+from documents.text_layer import layer_path
+
+MODELS = (Proforma, PurchaseOrder, Receipt)
+
+
+class LegacyFile(File):
+    """An already-stored file that storage can move into place instead of copying"""
+
+    def temporary_file_path(self):
+        return self.name
+
+
+class Command(BaseCommand):
+    help = 'Move legacy document files into content-addressed storage and fix blob reference counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without changing it')
+
+    def migrate_file(self, document):
+        """Move one document's legacy file into storage; returns the bytes freed by deduplication"""
+        path = document_storage.path(document.file.name)
+        if not os.path.exists(path):
+            self.stderr.write(f'Missing file for {document._meta.model_name} {document.pk}: {document.file.name}')
+            return 0
+        size = os.path.getsize(path)
+        legacy_layer = layer_path(path)
+        with open(path, 'rb') as f:
+            with transaction.atomic():
+                name = document_storage.save(document.file.name, LegacyFile(f, name=path))
+                type(document).objects.filter(pk=document.pk).update(
+                    file=name,
+                    original_filename=document.original_filename or os.path.basename(document.file.name)[:255],
+                )
+        if os.path.exists(legacy_layer):
+            blob_layer = layer_path(document_storage.path(name))
+            if os.path.exists(blob_layer):
+                os.remove(legacy_layer)
+            else:
+                os.replace(legacy_layer, blob_layer)
+        # Storage moved the legacy file into place, or deleted it if the bytes were already stored
+        return size if DocumentBlob.objects.get(name=name).refcount > 1 else 0
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        moved = freed = 0
+        for model in MODELS:
+            legacy = model.objects.exclude(file='').exclude(file__isnull=True).exclude(file__startswith=BLOB_DIR + '/')
+            for document in legacy.only('id', 'file', 'original_filename').iterator(chunk_size=500):
+                moved += 1
+                if not dry_run:
+                    freed += self.migrate_file(document)
+        self.stdout.write(f'Moved {moved} legacy file(s) into content-addressed storage')
+
+        # Reconcile counts with the documents that reference each blob
+        references = Counter()
+        for model in MODELS:
+            references.update(
+                name for name in model.objects.values_list('file', flat=True).iterator() if is_blob(name)
+            )
+        fixed = collected = 0
+        for blob in DocumentBlob.objects.iterator():
+            count = references.pop(blob.name, 0)
+            if blob.refcount != count:
+                fixed += 1
+                if not dry_run:
+                    DocumentBlob.objects.filter(pk=blob.pk).update(refcount=count)
+            if count == 0:
+                collected += 1
+                if not dry_run and document_storage.collect(blob.name):
+                    freed += blob.size
+        for name, count in references.items():
+            # Referenced files without a row (e.g. saved outside a transaction that then failed)
+            fixed += 1
+            if not dry_run and document_storage.exists(name):
+                DocumentBlob.objects.create(
+                    name=name,
+                    content_hash=os.path.splitext(os.path.basename(name))[0],
+                    size=document_storage.size(name),
+                    refcount=count,
+                )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Fixed {fixed} reference count(s), deleted {collected} unreferenced file(s), '
+            f'freed {freed / (1024 * 1024):.1f} MB' + (' [dry run, nothing changed]' if dry_run else '')
+        ))
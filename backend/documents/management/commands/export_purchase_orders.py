@@ -0,0 +1,61 @@
+"""
+Management command to export purchase order PDFs for a period as one zip
+or one merged PDF (e.g. for month-end close).
+"""
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from documents.exports import EXPORT_FORMATS, EXPORT_STATUSES, ExportError, export_purchase_orders, parse_export_params
+from documents.models import PurchaseOrder
+
+
+class Command(BaseCommand):
+    help = 'Export purchase order PDFs selected by date, vendor or receipt status as a zip or merged PDF'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_path', help='File to write')
+        parser.add_argument('--output', choices=EXPORT_FORMATS, help='zip or pdf (default: from the file extension)')
+        parser.add_argument('--from', dest='from', help='Only POs generated on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--to', help='Only POs generated on or before this date (YYYY-MM-DD)')
+        parser.add_argument('--vendor', help='Only POs whose vendor name contains this text')
+        parser.add_argument(
+            '--status',
+            action='append',
+            choices=EXPORT_STATUSES,
+            help="Only POs with a receipt in this validation status, or 'none' for no receipt (repeatable)",
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=settings.PO_EXPORT_PROCESSES,
+            help='Processes collecting/rendering PDFs (default: PO_EXPORT_PROCESSES; 1 runs inline)',
+        )
+
+    def handle(self, *args, **options):
+        path = options['output_path']
+        output = options['output'] or ('pdf' if path.lower().endswith('.pdf') else 'zip')
+        try:
+            export_options = parse_export_params({
+                'output': output,
+                'from': options['from'],
+                'to': options['to'],
+                'vendor': options['vendor'],
+                'status': ','.join(options['status'] or []),
+            })
+            count, chunks = export_purchase_orders(
+                PurchaseOrder.objects.all(), export_options, processes=max(1, options['processes'])
+            )
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        started = time.perf_counter()
+        size = 0
+        with open(path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {count} purchase order(s) to {path} ({size / 1024:.0f} KB) in {elapsed:.1f}s'
+        ))
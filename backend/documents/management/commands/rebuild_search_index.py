@@ -0,0 +1,82 @@
+"""
+Management command to (re)build the full-text search index of documents.
+
+Text comes from each document's stored text layer or the extraction cache,
+so existing documents are indexed without OCR or LLM calls; pass --extract
+to read documents that have neither.
+"""
+import time
+from django.core.management.base import BaseCommand
+from documents import search
+from documents.document_processor import DocumentProcessor
+from documents.models import DocumentText, ExtractionCacheEntry, Proforma, PurchaseOrder, Receipt
+from documents.text_layer import load_layer
+
+
+class Command(BaseCommand):
+    help = 'Index the text of proformas, receipts and purchase orders for full-text search'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--type',
+            action='append',
+            choices=search.DOCUMENT_TYPES,
+            help='Only this document type (repeatable)',
+        )
+        parser.add_argument('--missing', action='store_true', help='Only documents that are not indexed yet')
+        parser.add_argument(
+            '--extract',
+            action='store_true',
+            help='Extract text from files without a stored text layer or cached text (may run OCR)',
+        )
+
+    def stored_text(self, document, document_type):
+        """Previously extracted text of a proforma/receipt, or None"""
+        if not document.file:
+            return None
+        try:
+            layer = load_layer(document.file.path)
+        except OSError:
+            return None
+        if layer is not None:
+            return layer.text
+        if document.content_hash:
+            entry = ExtractionCacheEntry.objects.filter(
+                content_hash=document.content_hash, document_type=document_type
+            ).exclude(text='').values_list('text', flat=True).first()
+            if entry:
+                return entry
+        if self.processor:
+            return self.processor.extract_text(document.file.path)
+        return None
+
+    def handle(self, *args, **options):
+        types = options['type'] or search.DOCUMENT_TYPES
+        self.processor = DocumentProcessor(use_cache=False) if options['extract'] else None
+        started = time.perf_counter()
+        indexed = skipped = 0
+
+        sources = {
+            'proforma': (Proforma.objects.all(), lambda p: search.proforma_text(p, self.stored_text(p, 'proforma'))),
+            'receipt': (Receipt.objects.all(), lambda r: search.receipt_text(r, self.stored_text(r, 'receipt'))),
+            'purchase_order': (PurchaseOrder.objects.all(), search.purchase_order_text),
+        }
+        for document_type in types:
+            queryset, text_of = sources[document_type]
+            if options['missing']:
+                queryset = queryset.exclude(
+                    id__in=DocumentText.objects.filter(document_type=document_type).values(f'{document_type}_id')
+                )
+            for document in queryset.order_by('id').iterator(chunk_size=500):
+                text = text_of(document)
+                if not text:
+                    skipped += 1
+                    continue
+                search.index_document(document, document_type, text)
+                indexed += 1
+            self.stdout.write(f'Indexed {document_type} text ({indexed} document(s) so far)')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {indexed} document(s) in {elapsed:.1f}s; {skipped} had no text'
+        ))
@@ -0,0 +1,171 @@
+"""
+Management command to re-validate receipts against their purchase orders
+using the already-extracted receipt data (no OCR or LLM calls).
+"""
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from documents.document_processor import DocumentProcessor
+from documents.models import Receipt
+from documents.services import duplicate_discrepancies, receipt_validation_status
+from documents.vendors import get_vendor_index
+
+_processor = None
+
+
+def _validate_batch(batch):
+    """
+    Validate a batch of (receipt id, extracted data, purchase order fields, duplicate flags) rows.
+
+    Runs in pool workers, so it only touches plain data, never the database.
+    """
+    global _processor
+    if _processor is None:
+        _processor = DocumentProcessor(use_cache=False)
+    results = []
+    for receipt_id, extracted_data, purchase_order, duplicates in batch:
+        validation_results, discrepancies = _processor.validate_receipt_against_po(
+            extracted_data, SimpleNamespace(**purchase_order)
+        )
+        # Duplicate flags come from upload-time fingerprinting and are kept as they are
+        discrepancies += duplicates
+        results.append((
+            receipt_id,
+            validation_results,
+            discrepancies,
+            receipt_validation_status(validation_results, discrepancies),
+        ))
+    return results
+
+
+class Command(BaseCommand):
+    help = 'Re-run receipt validation against purchase orders using stored extracted data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--status',
+            action='append',
+            choices=[choice for choice, _ in Receipt.VALIDATION_STATUS_CHOICES],
+            help='Only receipts with this validation status (repeatable)',
+        )
+        parser.add_argument('--ids', help='Comma-separated receipt ids')
+        parser.add_argument('--since', help='Only receipts uploaded at or after this ISO datetime')
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=settings.DOCUMENT_WORKER_PROCESSES,
+            help='Worker processes (default: DOCUMENT_WORKER_PROCESSES; 1 runs inline)',
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='Receipts per batch')
+        parser.add_argument('--dry-run', action='store_true', help='Validate but do not save results')
+
+    def get_queryset(self, options):
+        queryset = Receipt.objects.filter(request__purchase_order__isnull=False).exclude(extracted_data={})
+        if options['status']:
+            queryset = queryset.filter(validation_status__in=options['status'])
+        if options['ids']:
+            queryset = queryset.filter(id__in=[int(pk) for pk in options['ids'].split(',') if pk.strip()])
+        if options['since']:
+            queryset = queryset.filter(uploaded_at__gte=parse_datetime(options['since']))
+        return queryset.select_related('request__purchase_order').only(
+            'id',
+            'extracted_data',
+            'discrepancies',
+            'request__id',
+            'request__purchase_order__vendor_name',
+            'request__purchase_order__total_amount',
+            'request__purchase_order__items_data',
+        ).order_by('id')
+
+    def iter_batches(self, queryset, batch_size):
+        """Stream rows from the database as plain-data batches"""
+        batch = []
+        for receipt in queryset.iterator(chunk_size=batch_size):
+            purchase_order = receipt.request.purchase_order
+            batch.append((
+                receipt.id,
+                receipt.extracted_data,
+                {
+                    'vendor_name': purchase_order.vendor_name,
+                    'total_amount': purchase_order.total_amount,
+                    'items_data': purchase_order.items_data,
+                },
+                duplicate_discrepancies(receipt.discrepancies),
+            ))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def write_results(self, results, dry_run):
+        if dry_run:
+            return
+        validated_at = timezone.now()
+        receipts = [
+            Receipt(
+                id=receipt_id,
+                validation_results=validation_results,
+                discrepancies=discrepancies,
+                validation_status=validation_status,
+                validated_at=validated_at,
+            )
+            for receipt_id, validation_results, discrepancies, validation_status in results
+        ]
+        Receipt.objects.bulk_update(
+            receipts,
+            ['validation_results', 'discrepancies', 'validation_status', 'validated_at'],
+        )
+
+    def handle(self, *args, **options):
+        queryset = self.get_queryset(options)
+        processes = max(1, options['processes'])
+        batch_size = max(1, options['batch_size'])
+        counts = {'valid': 0, 'invalid': 0, 'discrepancy': 0}
+        processed = 0
+        started = time.perf_counter()
+
+        def collect(results):
+            nonlocal processed
+            self.write_results(results, options['dry_run'])
+            for _, _, _, validation_status in results:
+                counts[validation_status] += 1
+            processed += len(results)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'Validated {processed} receipt(s), {processed / elapsed:.0f} rows/sec')
+
+        # Workers inherit the vendor index instead of each querying for it
+        get_vendor_index()
+
+        if processes == 1:
+            for batch in self.iter_batches(queryset, batch_size):
+                collect(_validate_batch(batch))
+        else:
+            # Children must not inherit the parent's database connections
+            connections.close_all()
+            with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork')) as executor:
+                # Fork the workers now, before the streaming query opens a new connection
+                executor.submit(_validate_batch, []).result()
+                pending = deque()
+                for batch in self.iter_batches(queryset, batch_size):
+                    pending.append(executor.submit(_validate_batch, batch))
+                    # Bound the batches held in memory while the database keeps streaming
+                    while len(pending) >= processes * 2:
+                        collect(pending.popleft().result())
+                while pending:
+                    collect(pending.popleft().result())
+
+        elapsed = time.perf_counter() - started
+        rate = processed / elapsed if elapsed else 0
+        summary = ', '.join(f'{count} {status}' for status, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Re-validated {processed} receipt(s) in {elapsed:.1f}s ({rate:.0f} rows/sec): {summary}'
+            + (' [dry run, nothing saved]' if options['dry_run'] else '')
+        ))
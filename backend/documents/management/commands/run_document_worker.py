@@ -0,0 +1,76 @@
+"""
+Management command to run the background document extraction worker.
+"""
+import multiprocessing
+import signal
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from documents.jobs import work
+
+
+def _worker_process(poll_interval, burst, stop_event):
+    """Entry point for a forked worker process"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    work(poll_interval=poll_interval, burst=burst, should_stop=stop_event.is_set)
+
+
+class Command(BaseCommand):
+    help = 'Process queued proforma/receipt extraction and validation jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=settings.DOCUMENT_WORKER_PROCESSES,
+            help='Number of worker processes (default: DOCUMENT_WORKER_PROCESSES)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait between polls when the queue is empty',
+        )
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='Exit once the queue is empty instead of polling forever',
+        )
+
+    def handle(self, *args, **options):
+        processes = max(1, options['processes'])
+        poll_interval = options['poll_interval']
+        burst = options['burst']
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Starting document worker with {processes} process(es)')
+        )
+
+        if processes == 1:
+            processed = work(poll_interval=poll_interval, burst=burst)
+            self.stdout.write(self.style.SUCCESS(f'Worker finished, processed {processed} job(s)'))
+            return
+
+        # Children must not inherit the parent's database connections
+        connections.close_all()
+
+        ctx = multiprocessing.get_context('fork')
+        stop_event = ctx.Event()
+        # Not daemonic: workers may start their own PDF extraction pools
+        children = [
+            ctx.Process(target=_worker_process, args=(poll_interval, burst, stop_event))
+            for _ in range(processes)
+        ]
+        for child in children:
+            child.start()
+
+        def _stop(signum, frame):
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+
+        for child in children:
+            child.join()
+
+        self.stdout.write(self.style.SUCCESS('Worker stopped'))
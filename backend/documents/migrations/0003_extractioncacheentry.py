@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0002_extractionjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractionCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('document_type', models.CharField(max_length=20)),
+                ('text_version', models.CharField(max_length=20)),
+                ('result_version', models.CharField(blank=True, max_length=40)),
+                ('text', models.TextField(blank=True)),
+                ('result', models.JSONField(blank=True, default=dict)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_used_at'], name='documents_e_last_us_1de895_idx')],
+                'constraints': [models.UniqueConstraint(fields=('content_hash', 'document_type'), name='unique_extraction_cache_entry')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_extractioncacheentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vendor_name', models.CharField(max_length=200)),
+                ('document_type', models.CharField(max_length=20)),
+                ('fingerprint', models.JSONField(default=list)),
+                ('fields', models.JSONField(default=dict)),
+                ('samples', models.PositiveIntegerField(default=1)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('failures', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['document_type', 'vendor_name'], name='documents_v_documen_7d3b75_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 00:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
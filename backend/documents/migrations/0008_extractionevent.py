@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-17 00:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_purchaseorder_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractionEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('progress', models.PositiveSmallIntegerField(default=0)),
+                ('stage', models.CharField(blank=True, max_length=50)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='documents.extractionjob')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.8 on 2026-10-17 00:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Full-text index of DocumentText.text; see documents/search.py for the matching queries
+POSTGRES_FORWARD = [
+    "ALTER TABLE documents_documenttext ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('english', text)) STORED",
+    "CREATE INDEX documents_documenttext_search_gin ON documents_documenttext USING GIN (search_vector)",
+]
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS documents_documenttext_search_gin",
+    "ALTER TABLE documents_documenttext DROP COLUMN IF EXISTS search_vector",
+]
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE documents_documenttext_fts USING fts5("
+    "text, content='documents_documenttext', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER documents_documenttext_fts_insert AFTER INSERT ON documents_documenttext BEGIN "
+    "INSERT INTO documents_documenttext_fts(rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER documents_documenttext_fts_delete AFTER DELETE ON documents_documenttext BEGIN "
+    "INSERT INTO documents_documenttext_fts(documents_documenttext_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER documents_documenttext_fts_update AFTER UPDATE ON documents_documenttext BEGIN "
+    "INSERT INTO documents_documenttext_fts(documents_documenttext_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO documents_documenttext_fts(rowid, text) VALUES (new.id, new.text); END",
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS documents_documenttext_fts_insert",
+    "DROP TRIGGER IF EXISTS documents_documenttext_fts_delete",
+    "DROP TRIGGER IF EXISTS documents_documenttext_fts_update",
+    "DROP TABLE IF EXISTS documents_documenttext_fts",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0008_extractionevent'),
+        ('requests', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_type', models.CharField(choices=[('proforma', 'Proforma'), ('receipt', 'Receipt'), ('purchase_order', 'Purchase Order')], max_length=20)),
+                ('text', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('proforma', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_text', to='documents.proforma')),
+                ('purchase_order', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_text', to='documents.purchaseorder')),
+                ('receipt', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_text', to='documents.receipt')),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='document_texts', to='requests.purchaserequest')),
+            ],
+        ),
+        migrations.RunPython(
+            _run({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            _run({'postgresql': POSTGRES_REVERSE, 'sqlite': SQLITE_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-17 00:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0009_documenttext'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='extractionjob',
+            name='purchase_order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='documents.purchaseorder'),
+        ),
+        migrations.AlterField(
+            model_name='extractionjob',
+            name='job_type',
+            field=models.CharField(choices=[('proforma_extraction', 'Proforma Extraction'), ('receipt_extraction', 'Receipt Extraction'), ('receipt_validation', 'Receipt Validation'), ('purchase_order_render', 'Purchase Order Rendering')], max_length=30),
+        ),
+    ]
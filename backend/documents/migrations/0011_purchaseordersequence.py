@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-17 00:25
+
+from datetime import datetime
+from django.db import migrations, models
+
+
+def seed_sequences(apps, schema_editor):
+    """Continue each day's numbering after the purchase orders that already exist"""
+    PurchaseOrder = apps.get_model('documents', 'PurchaseOrder')
+    PurchaseOrderSequence = apps.get_model('documents', 'PurchaseOrderSequence')
+    last_values = {}
+    for po_number in PurchaseOrder.objects.values_list('po_number', flat=True).iterator():
+        try:
+            _, day, value = po_number.split('-')
+            day = datetime.strptime(day, '%Y%m%d').date()
+            value = int(value)
+        except ValueError:
+            continue
+        last_values[day] = max(value, last_values.get(day, 0))
+    PurchaseOrderSequence.objects.bulk_create(
+        [PurchaseOrderSequence(day=day, last_value=value) for day, value in last_values.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0010_extractionjob_purchase_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurchaseOrderSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('last_value', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
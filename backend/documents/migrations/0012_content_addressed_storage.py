@@ -0,0 +1,69 @@
+# Generated by Django 5.2.8 on 2026-10-17 00:28
+
+import documents.storage
+import documents.utils
+import os
+from django.db import migrations, models
+
+
+def fill_original_filenames(apps, schema_editor):
+    """Existing files are still stored under their uploaded name"""
+    for model_name in ('Proforma', 'PurchaseOrder', 'Receipt'):
+        model = apps.get_model('documents', model_name)
+        documents = []
+        for document in model.objects.exclude(file='').exclude(file__isnull=True).only('id', 'file').iterator():
+            document.original_filename = os.path.basename(document.file.name)[:255]
+            documents.append(document)
+        model.objects.bulk_update(documents, ['original_filename'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0011_purchaseordersequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('content_hash', models.CharField(db_index=True, max_length=64)),
+                ('size', models.BigIntegerField()),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='proforma',
+            name='original_filename',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='original_filename',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='receipt',
+            name='original_filename',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='proforma',
+            name='file',
+            field=models.FileField(storage=documents.storage.get_document_storage, upload_to=documents.utils.get_document_upload_path),
+        ),
+        migrations.AlterField(
+            model_name='purchaseorder',
+            name='file',
+            field=models.FileField(blank=True, null=True, storage=documents.storage.get_document_storage, upload_to=documents.utils.get_document_upload_path),
+        ),
+        migrations.AlterField(
+            model_name='receipt',
+            name='file',
+            field=models.FileField(storage=documents.storage.get_document_storage, upload_to=documents.utils.get_document_upload_path),
+        ),
+        migrations.RunPython(fill_original_filenames, migrations.RunPython.noop),
+    ]
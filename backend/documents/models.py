@@ -1,5 +1,8 @@
+import os
+import uuid
 from django.db import models
 from django.conf import settings
+from .storage import get_document_storage
 from .utils import get_document_upload_path
 
 
@@ -11,7 +14,9 @@ class Proforma(models.Model):
         on_delete=models.CASCADE,
         related_name='proforma'
     )
-    file = models.FileField(upload_to=get_document_upload_path)
+    file = models.FileField(upload_to=get_document_upload_path, storage=get_document_storage)
+    original_filename = models.CharField(max_length=255, blank=True)  # Name of the file as uploaded
+    content_hash = models.CharField(max_length=64, blank=True)  # SHA-256 computed while uploading
     uploaded_at = models.DateTimeField(auto_now_add=True)
     
     # Extracted data
@@ -35,7 +40,9 @@ class PurchaseOrder(models.Model):
         related_name='purchase_order'
     )
     po_number = models.CharField(max_length=50, unique=True)
-    file = models.FileField(upload_to=get_document_upload_path, null=True, blank=True)
+    file = models.FileField(upload_to=get_document_upload_path, storage=get_document_storage, null=True, blank=True)
+    original_filename = models.CharField(max_length=255, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)  # SHA-256 of the generated PDF
     generated_at = models.DateTimeField(auto_now_add=True)
     generated_by = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -57,21 +64,34 @@ class PurchaseOrder(models.Model):
     def save(self, *args, **kwargs):
         if not self.po_number:
             # Generate PO number
-            from datetime import datetime
-            prefix = "PO"
-            timestamp = datetime.now().strftime("%Y%m%d")
-            last_po = PurchaseOrder.objects.filter(po_number__startswith=f"{prefix}-{timestamp}").order_by('-po_number').first()
-            if last_po:
-                try:
-                    seq = int(last_po.po_number.split('-')[-1]) + 1
-                except:
-                    seq = 1
-            else:
-                seq = 1
-            self.po_number = f"{prefix}-{timestamp}-{seq:04d}"
+            from .sequences import allocate_po_number
+            self.po_number = allocate_po_number()
         super().save(*args, **kwargs)
 
 
+class DocumentBlob(models.Model):
+    """A file in content-addressed storage and how many documents reference it (see documents.storage)"""
+    
+    name = models.CharField(max_length=255, unique=True)  # Storage name, derived from the hash
+    content_hash = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.name} ({self.refcount} references)"
+
+
+class PurchaseOrderSequence(models.Model):
+    """Last PO number handed out on a day (see documents.sequences)"""
+    
+    day = models.DateField(unique=True)
+    last_value = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.day}: {self.last_value}"
+
+
 class Receipt(models.Model):
     """Receipt document for validation"""
     
@@ -87,7 +107,9 @@ class Receipt(models.Model):
         on_delete=models.CASCADE,
         related_name='receipts'
     )
-    file = models.FileField(upload_to=get_document_upload_path)
+    file = models.FileField(upload_to=get_document_upload_path, storage=get_document_storage)
+    original_filename = models.CharField(max_length=255, blank=True)  # Name of the file as uploaded
+    content_hash = models.CharField(max_length=64, blank=True)  # SHA-256 computed while uploading
     uploaded_at = models.DateTimeField(auto_now_add=True)
     uploaded_by = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -109,3 +131,303 @@ class Receipt(models.Model):
     
     def __str__(self):
         return f"Receipt for {self.request.title} - {self.get_validation_status_display()}"
+
+
+class ExtractionJob(models.Model):
+    """Background extraction/validation job picked up by the document worker"""
+    
+    JOB_TYPE_CHOICES = [
+        ('proforma_extraction', 'Proforma Extraction'),
+        ('receipt_extraction', 'Receipt Extraction'),
+        ('receipt_validation', 'Receipt Validation'),
+        ('purchase_order_render', 'Purchase Order Rendering'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    job_type = models.CharField(max_length=30, choices=JOB_TYPE_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    progress = models.PositiveSmallIntegerField(default=0)  # Percent complete
+    stage = models.CharField(max_length=50, blank=True)
+    
+    proforma = models.ForeignKey(
+        Proforma,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='jobs'
+    )
+    receipt = models.ForeignKey(
+        Receipt,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='jobs'
+    )
+    purchase_order = models.ForeignKey(
+        PurchaseOrder,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='jobs'
+    )
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='extraction_jobs'
+    )
+    
+    # Worker bookkeeping
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_job_type_display()} #{self.pk} - {self.get_status_display()}"
+    
+    def report_progress(self, progress, stage='', data=None):
+        """
+        Record progress and refresh the heartbeat without touching other fields.
+        
+        Each report is also stored as an ExtractionEvent (with optional partial
+        results in data) for clients following the job's event stream.
+        """
+        from django.utils import timezone
+        self.progress = progress
+        self.stage = stage
+        self.heartbeat_at = timezone.now()
+        ExtractionJob.objects.filter(pk=self.pk).update(
+            progress=self.progress,
+            stage=self.stage,
+            heartbeat_at=self.heartbeat_at
+        )
+        ExtractionEvent.objects.create(job=self, progress=progress, stage=stage, data=data or {})
+
+
+class ExtractionEvent(models.Model):
+    """A progress event of an extraction job, streamed to clients as it happens"""
+    
+    job = models.ForeignKey(ExtractionJob, on_delete=models.CASCADE, related_name='events')
+    progress = models.PositiveSmallIntegerField(default=0)
+    stage = models.CharField(max_length=50, blank=True)
+    data = models.JSONField(default=dict, blank=True)  # Partial results available at this stage
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"{self.job} - {self.stage} ({self.progress}%)"
+
+
+class ExtractionCacheEntry(models.Model):
+    """Cached extraction output keyed by the SHA-256 of the document bytes"""
+    
+    content_hash = models.CharField(max_length=64)
+    document_type = models.CharField(max_length=20)  # 'proforma' or 'receipt'
+    
+    # Versions of the text extractor and of the prompt/parser that produced the cached data
+    text_version = models.CharField(max_length=20)
+    result_version = models.CharField(max_length=40, blank=True)
+    
+    text = models.TextField(blank=True)
+    result = models.JSONField(default=dict, blank=True)
+    size = models.PositiveIntegerField(default=0)  # Approximate bytes used, for eviction
+    hits = models.PositiveIntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'document_type'], name='unique_extraction_cache_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['last_used_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.document_type} {self.content_hash[:12]} (v{self.result_version or self.text_version})"
+
+
+class VendorTemplate(models.Model):
+    """Layout template learned from a high-confidence extraction of a vendor's document"""
+    
+    vendor_name = models.CharField(max_length=200)
+    document_type = models.CharField(max_length=20)  # 'proforma' or 'receipt'
+    fingerprint = models.JSONField(default=list)  # Anchor words with quantized positions
+    fields = models.JSONField(default=dict)  # Constant values and locators for variable fields
+    
+    samples = models.PositiveIntegerField(default=1)
+    hits = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['document_type', 'vendor_name']),
+        ]
+    
+    def __str__(self):
+        return f"{self.vendor_name} ({self.document_type})"
+
+
+class DocumentFingerprint(models.Model):
+    """Perceptual image hash and text MinHash of an uploaded proforma or receipt"""
+    
+    DOCUMENT_TYPE_CHOICES = [
+        ('proforma', 'Proforma'),
+        ('receipt', 'Receipt'),
+    ]
+    
+    document_type = models.CharField(max_length=20, choices=DOCUMENT_TYPE_CHOICES)
+    proforma = models.OneToOneField(
+        Proforma,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='fingerprint'
+    )
+    receipt = models.OneToOneField(
+        Receipt,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='fingerprint'
+    )
+    
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)  # SHA-256 of the file
+    image_hash = models.CharField(max_length=16, blank=True)  # 64-bit difference hash, hex
+    text_signature = models.JSONField(default=list, blank=True)  # MinHash of text shingles
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        document = self.proforma or self.receipt
+        return f"Fingerprint of {self.document_type} #{document.pk if document else '?'}"
+
+
+class FingerprintBucket(models.Model):
+    """LSH bucket membership of a fingerprint; documents sharing a bucket are duplicate candidates"""
+    
+    fingerprint = models.ForeignKey(
+        DocumentFingerprint,
+        on_delete=models.CASCADE,
+        related_name='buckets'
+    )
+    key = models.CharField(max_length=24, db_index=True)  # Band id and band hash
+    
+    def __str__(self):
+        return self.key
+
+
+class DocumentText(models.Model):
+    """
+    Searchable text of a proforma, receipt or purchase order.
+    
+    The full-text index itself is database specific and is created by
+    migration 0009: a generated tsvector column with a GIN index on
+    PostgreSQL, an FTS5 table kept in sync by triggers on SQLite.
+    """
+    
+    DOCUMENT_TYPE_CHOICES = [
+        ('proforma', 'Proforma'),
+        ('receipt', 'Receipt'),
+        ('purchase_order', 'Purchase Order'),
+    ]
+    
+    document_type = models.CharField(max_length=20, choices=DOCUMENT_TYPE_CHOICES)
+    proforma = models.OneToOneField(
+        Proforma,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='search_text'
+    )
+    receipt = models.OneToOneField(
+        Receipt,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='search_text'
+    )
+    purchase_order = models.OneToOneField(
+        PurchaseOrder,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='search_text'
+    )
+    # Denormalised from the document so searches can filter by request owner in the index query
+    request = models.ForeignKey(
+        'requests.PurchaseRequest',
+        on_delete=models.CASCADE,
+        related_name='document_texts'
+    )
+    
+    text = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        document = self.proforma or self.receipt or self.purchase_order
+        return f"Text of {self.document_type} #{document.pk if document else '?'}"
+
+
+class UploadSession(models.Model):
+    """Resumable chunked upload of a large document; deleted once attached to a proforma/receipt"""
+    
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('complete', 'Complete'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions'
+    )
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()  # Total bytes the client will send
+    offset = models.PositiveBigIntegerField(default=0)  # Bytes received so far
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    
+    # Set when the last chunk arrives
+    content_type = models.CharField(max_length=100, blank=True)  # Sniffed from the file's first bytes
+    content_hash = models.CharField(max_length=64, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size} bytes, {self.status})"
+    
+    @property
+    def partial_path(self):
+        """Where the received bytes are assembled"""
+        return os.path.join(settings.DOCUMENT_UPLOAD_TEMP_DIR, f'{self.id}.part')
@@ -0,0 +1,263 @@
+"""
+OCR engines and image preprocessing.
+
+The default engine keeps a warm Tesseract instance (via the tesserocr API
+binding) per worker thread, so language data is loaded once instead of
+forking a tesseract process and writing temp files for every image. When
+tesserocr is not installed the pytesseract subprocess engine is used.
+"""
+import os
+import threading
+from abc import ABC, abstractmethod
+import pytesseract
+from PIL import Image, ImageOps
+from django.conf import settings
+from .text_layer import LayerPage
+
+try:
+    import tesserocr
+except ImportError:  # pragma: no cover - optional dependency
+    tesserocr = None
+
+# Long-side pixel cap for images without DPI metadata (typical for phone-camera
+# JPEGs); this is an A4 page at 300 DPI
+MAX_OCR_PIXELS = 3508
+
+# Skew search range and resolution, in degrees
+DESKEW_MAX_ANGLE = 5.0
+DESKEW_STEP = 0.5
+DESKEW_SAMPLE_SIZE = 400
+
+
+def _target_size(size, dpi, max_dpi):
+    """Size that brings an image down to at most max_dpi (never upscales)"""
+    width, height = size
+    if dpi and dpi > max_dpi:
+        scale = max_dpi / dpi
+    else:
+        scale = min(1.0, MAX_OCR_PIXELS / max(width, height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def _row_profile_score(image):
+    """Variance of row darkness; highest when text lines are horizontal"""
+    rows = list(image.resize((1, image.height), Image.BOX).getdata())
+    mean = sum(rows) / len(rows)
+    return sum((value - mean) ** 2 for value in rows)
+
+
+def estimate_skew(image):
+    """Estimate skew (degrees) of a grayscale page with a projection profile"""
+    sample = image.copy()
+    sample.thumbnail((DESKEW_SAMPLE_SIZE, DESKEW_SAMPLE_SIZE))
+    sample = ImageOps.invert(sample)
+
+    best_angle, best_score = 0.0, _row_profile_score(sample)
+    steps = int(DESKEW_MAX_ANGLE / DESKEW_STEP)
+    for i in range(-steps, steps + 1):
+        angle = i * DESKEW_STEP
+        if angle == 0:
+            continue
+        score = _row_profile_score(sample.rotate(angle, resample=Image.BILINEAR, fillcolor=0))
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+def preprocess_image(source, max_dpi=None, deskew=None):
+    """
+    Prepare an image for OCR: grayscale, bounded resolution and deskewed.
+
+    Args:
+        source: file path or PIL image
+        max_dpi: downscale images scanned above this resolution
+        deskew: straighten slightly rotated scans/photos
+
+    Returns:
+        PIL.Image: 8-bit grayscale image
+    """
+    max_dpi = max_dpi or settings.OCR_MAX_DPI
+    deskew = settings.OCR_DESKEW if deskew is None else deskew
+
+    if isinstance(source, (str, os.PathLike)):
+        with Image.open(source) as image:
+            return _prepare(image, max_dpi, deskew)
+    return _prepare(source, max_dpi, deskew)
+
+
+def _prepare(image, max_dpi, deskew):
+    dpi = image.info.get('dpi', (None,))[0]
+    target = _target_size(image.size, dpi, max_dpi)
+
+    if image.format == 'JPEG':
+        # Let the JPEG decoder scale by 1/2, 1/4 or 1/8 and skip chroma
+        # upsampling instead of decoding the full-size colour image
+        image.draft('L', target)
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'L':
+        image = image.convert('L')
+
+    # Compare long sides: EXIF rotation may have swapped width and height
+    long_side = max(target)
+    if max(image.size) > long_side:
+        scale = long_side / max(image.size)
+        image = image.resize(
+            (max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+            Image.LANCZOS
+        )
+
+    if deskew:
+        angle = estimate_skew(image)
+        if angle:
+            image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+    return image
+
+
+class OCREngine(ABC):
+    """Base class for OCR engines"""
+
+    name = 'base'
+
+    @abstractmethod
+    def image_to_string(self, image):
+        """OCR an image to plain text"""
+
+    @abstractmethod
+    def image_to_data(self, image):
+        """
+        OCR an image keeping word positions.
+
+        Returns:
+            tuple: (text, words) with words as (text, left, top, right, bottom,
+            confidence) tuples in image pixels
+        """
+
+
+class PytesseractEngine(OCREngine):
+    """Runs the tesseract CLI for each image (no persistent state)"""
+
+    name = 'pytesseract'
+
+    def __init__(self, lang='eng'):
+        self.lang = lang
+
+    def image_to_string(self, image):
+        return pytesseract.image_to_string(image, lang=self.lang)
+
+    def image_to_data(self, image):
+        data = pytesseract.image_to_data(image, lang=self.lang, output_type=pytesseract.Output.DICT)
+        words = []
+        lines = []
+        previous = None
+        for i, text in enumerate(data['text']):
+            text = (text or '').strip()
+            if data['level'][i] != 5 or not text:
+                continue
+            left, top = data['left'][i], data['top'][i]
+            words.append((text, left, top, left + data['width'][i], top + data['height'][i], int(float(data['conf'][i]))))
+            # Rebuild the plain text layout: words joined by lines, paragraphs separated by a blank line
+            line = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            if previous and line == previous:
+                lines[-1] += ' ' + text
+            else:
+                if previous and line[:2] != previous[:2]:
+                    lines.append('')
+                lines.append(text)
+            previous = line
+        return ('\n'.join(lines) + '\n') if lines else '', words
+
+
+class TesserocrEngine(OCREngine):
+    """Keeps one initialised Tesseract API per thread for the life of the process"""
+
+    name = 'tesserocr'
+
+    def __init__(self, lang='eng', tessdata_path=None):
+        self.lang = lang
+        self.tessdata_path = tessdata_path
+        self._local = threading.local()
+
+    def _api(self):
+        api = getattr(self._local, 'api', None)
+        if api is None:
+            kwargs = {'lang': self.lang}
+            if self.tessdata_path:
+                kwargs['path'] = self.tessdata_path
+            api = tesserocr.PyTessBaseAPI(**kwargs)
+            self._local.api = api
+        return api
+
+    def image_to_string(self, image):
+        api = self._api()
+        try:
+            api.SetImage(image)
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+
+    def image_to_data(self, image):
+        api = self._api()
+        try:
+            api.SetImage(image)
+            api.Recognize()
+            text = api.GetUTF8Text()
+            words = []
+            level = tesserocr.RIL.WORD
+            for word in tesserocr.iterate_level(api.GetIterator(), level):
+                word_text = (word.GetUTF8Text(level) or '').strip()
+                box = word.BoundingBox(level)
+                if word_text and box:
+                    words.append((word_text, *box, int(word.Confidence(level))))
+            return text, words
+        finally:
+            api.Clear()
+
+
+_engine = None
+_engine_pid = None
+
+
+def get_ocr_engine():
+    """Return this process's OCR engine, creating it on first use (and after fork)"""
+    global _engine, _engine_pid
+    if _engine is None or _engine_pid != os.getpid():
+        _engine = _create_engine(settings.OCR_ENGINE)
+        _engine_pid = os.getpid()
+    return _engine
+
+
+def _create_engine(name):
+    if name in ('auto', 'tesserocr') and tesserocr is not None:
+        try:
+            engine = TesserocrEngine(settings.OCR_LANG, settings.OCR_TESSDATA_PATH or None)
+            engine._api()  # Fail fast if language data is missing
+            return engine
+        except Exception as e:
+            if name == 'tesserocr':
+                raise
+            print(f"tesserocr unavailable, falling back to pytesseract: {e}")
+    return PytesseractEngine(settings.OCR_LANG)
+
+
+def ocr_image(source):
+    """Preprocess an image (path or PIL image) and OCR it with the process-wide engine"""
+    return get_ocr_engine().image_to_string(preprocess_image(source))
+
+
+def ocr_image_page(source):
+    """
+    OCR an image (path or PIL image) keeping word boxes.
+
+    Returns:
+        LayerPage: boxes are fractions of the preprocessed image; width and
+        height are its pixel size
+    """
+    image = preprocess_image(source)
+    text, words = get_ocr_engine().image_to_data(image)
+    width, height = image.size
+    return LayerPage(text, width, height, [
+        (word, left / width, top / height, right / width, bottom / height, confidence)
+        for word, left, top, right, bottom, confidence in words
+    ], source='ocr')
@@ -0,0 +1,188 @@
+"""
+Streaming and parallel PDF text extraction.
+
+Pages are yielded one at a time, in document order, so callers never hold the
+whole parsed document in memory. Large documents can be split into page
+ranges and extracted in a process pool.
+
+Pages whose text layer is missing or unusable (scans, broken font maps) are
+rendered with pypdfium2 and OCR'd individually; pages with a good text layer
+never pay the OCR cost.
+
+This module does not touch Django models so it is safe to import in pool
+worker processes (which are forked with settings already configured).
+"""
+import math
+import re
+from concurrent.futures import ProcessPoolExecutor
+import pdfplumber
+import pypdfium2
+from .ocr import ocr_image, ocr_image_page
+from .text_layer import NATIVE_CONFIDENCE, LayerPage
+
+# Minimum pages handed to a pool worker per task, so small ranges don't pay
+# more in re-opening the PDF than they gain in parallelism
+MIN_PAGES_PER_TASK = 4
+
+# A text layer with fewer meaningful characters than this is treated as missing
+MIN_TEXT_LAYER_CHARS = 20
+# Share of characters that must be letters, digits, whitespace or common punctuation
+MIN_READABLE_RATIO = 0.6
+
+CID_PATTERN = re.compile(r'\(cid:\d+\)')
+READABLE_PATTERN = re.compile(r'[\w\s.,:;$€£%#/()&@\'"+-]')
+
+_executor = None
+_executor_workers = 0
+
+
+def get_executor(workers):
+    """Return a process pool shared by all extractions in this process"""
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers != workers:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ProcessPoolExecutor(max_workers=workers)
+        _executor_workers = workers
+    return _executor
+
+
+def count_pages(file_path):
+    """Number of pages in a PDF"""
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+
+def needs_ocr(text):
+    """True if a page's text layer is missing or looks like garbage"""
+    if not text:
+        return True
+    # pdfminer emits (cid:NN) for glyphs it cannot map to characters
+    text = CID_PATTERN.sub('\ufffd', text)
+    meaningful = sum(1 for ch in text if not ch.isspace())
+    if meaningful < MIN_TEXT_LAYER_CHARS:
+        return True
+    readable = len(READABLE_PATTERN.findall(text))
+    return readable / len(text) < MIN_READABLE_RATIO
+
+
+def ocr_pdf_page(pdf_document, page_index, dpi, words=False):
+    """Render a single page at the given DPI and OCR it (to a LayerPage if words is set)"""
+    page = pdf_document[page_index]
+    try:
+        bitmap = page.render(scale=dpi / 72, grayscale=True)
+        if words:
+            return ocr_image_page(bitmap.to_pil())
+        return ocr_image(bitmap.to_pil())
+    finally:
+        page.close()
+
+
+def _native_words(page):
+    """Words of a pdfplumber page as LayerPage word tuples"""
+    return [
+        (word['text'], word['x0'] / page.width, word['top'] / page.height,
+         word['x1'] / page.width, word['bottom'] / page.height, NATIVE_CONFIDENCE)
+        for word in page.extract_words()
+    ]
+
+
+def iter_pages(file_path, start=0, stop=None, ocr_dpi=None, words=True):
+    """
+    Yield a LayerPage for each page in [start, stop), in order.
+
+    Each page's parsed objects are released as soon as it is read. If
+    ocr_dpi is set, pages without a usable text layer are OCR'd at that DPI.
+    Word boxes are only collected when words is set.
+    """
+    pdf_document = None
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            pages = pdf.pages[start:stop]
+            for page in pages:
+                try:
+                    text = page.extract_text() or ''
+                    layer_page = LayerPage(text, float(page.width), float(page.height), _native_words(page) if words else ())
+                finally:
+                    page.close()
+
+                if ocr_dpi and needs_ocr(text):
+                    try:
+                        if pdf_document is None:
+                            pdf_document = pypdfium2.PdfDocument(file_path)
+                        ocr_page = ocr_pdf_page(pdf_document, page.page_number - 1, ocr_dpi, words=words)
+                        if not words:
+                            ocr_page = LayerPage(ocr_page, 0, 0, source='ocr')
+                        if len(ocr_page.text.strip()) > len(text.strip()):
+                            # Boxes are fractions of the page, so keep the page size in points
+                            ocr_page.width, ocr_page.height = layer_page.width, layer_page.height
+                            layer_page = ocr_page
+                    except Exception as e:
+                        print(f"Error running OCR on PDF page {page.page_number}: {e}")
+
+                yield layer_page
+    finally:
+        if pdf_document is not None:
+            pdf_document.close()
+
+
+def iter_page_texts(file_path, start=0, stop=None, ocr_dpi=None):
+    """Yield the text of each page in [start, stop), in order"""
+    for page in iter_pages(file_path, start, stop, ocr_dpi, words=False):
+        yield page.text
+
+
+def extract_page_range(file_path, start, stop, ocr_dpi=None, words=True):
+    """Pool task: extract pages [start, stop)"""
+    return list(iter_pages(file_path, start, stop, ocr_dpi, words))
+
+
+def _page_ranges(page_count, workers):
+    """Split pages into contiguous ranges, a few per worker for load balancing"""
+    size = max(MIN_PAGES_PER_TASK, math.ceil(page_count / (workers * 4)))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def stream_pdf_text(file_path, max_pages=None, workers=1, parallel_min_pages=16, ocr_dpi=None):
+    """Yield page texts in document order (see stream_pdf_pages)"""
+    for page in stream_pdf_pages(file_path, max_pages, workers, parallel_min_pages, ocr_dpi, words=False):
+        yield page.text
+
+
+def stream_pdf_pages(file_path, max_pages=None, workers=1, parallel_min_pages=16, ocr_dpi=None, words=True):
+    """
+    Yield a LayerPage per page in document order.
+
+    Args:
+        file_path: path to the PDF
+        max_pages: stop after this many pages (None for no limit)
+        workers: process pool size; 1 extracts sequentially in this process
+        parallel_min_pages: only use the pool for documents at least this long
+        ocr_dpi: DPI for OCR of pages without a text layer (None disables OCR)
+        words: also collect word boxes
+    """
+    if workers <= 1:
+        yield from iter_pages(file_path, 0, max_pages, ocr_dpi, words)
+        return
+
+    page_count = count_pages(file_path)
+    if max_pages is not None:
+        page_count = min(page_count, max_pages)
+
+    if page_count < parallel_min_pages:
+        yield from iter_pages(file_path, 0, page_count, ocr_dpi, words)
+        return
+
+    ranges = _page_ranges(page_count, workers)
+    executor = get_executor(workers)
+    # Executor.map returns results in submission order
+    results = executor.map(
+        extract_page_range,
+        [file_path] * len(ranges),
+        [start for start, _ in ranges],
+        [stop for _, stop in ranges],
+        [ocr_dpi] * len(ranges),
+        [words] * len(ranges),
+    )
+    for pages in results:
+        yield from pages
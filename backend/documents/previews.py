@@ -0,0 +1,130 @@
+"""
+Page previews for proformas, receipts and purchase orders.
+
+Pages are rendered at a few fixed sizes (PDFs with pypdfium2, images with
+Pillow) and stored under DOCUMENT_PREVIEW_DIR keyed by the document's content
+hash, size and page. A render is produced once, on first request or ahead of
+time by the document worker, and then served straight from disk.
+"""
+import os
+import tempfile
+import pypdfium2
+from django.conf import settings
+from PIL import Image, ImageOps
+from .extraction_cache import file_sha256
+
+# Longest edge in pixels of each preview size
+PREVIEW_SIZES = {
+    'thumb': 240,
+    'medium': 960,
+    'large': 1800,
+}
+
+PREVIEW_FORMAT = 'WEBP'
+PREVIEW_CONTENT_TYPE = 'image/webp'
+PREVIEW_QUALITY = 80
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+
+
+class PreviewError(Exception):
+    """Raised when a preview cannot be rendered (unsupported file, missing page)"""
+
+
+def document_hash(document):
+    """Content hash of a document's file, computed and stored on first use for older rows"""
+    if not document.content_hash:
+        document.content_hash = file_sha256(document.file.path)
+        type(document).objects.filter(pk=document.pk).update(content_hash=document.content_hash)
+    return document.content_hash
+
+
+def preview_path(content_hash, size, page):
+    """Where the preview of one page at one size is stored"""
+    return os.path.join(settings.DOCUMENT_PREVIEW_DIR, content_hash[:2], content_hash, f'{size}-{page}.webp')
+
+
+def page_count(file_path):
+    if os.path.splitext(file_path)[1].lower() == '.pdf':
+        pdf = pypdfium2.PdfDocument(file_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    return 1
+
+
+def _render_pdf_page(file_path, page_index, max_edge):
+    pdf = pypdfium2.PdfDocument(file_path)
+    try:
+        if not 0 <= page_index < len(pdf):
+            raise PreviewError(f'Page {page_index + 1} does not exist')
+        page = pdf[page_index]
+        try:
+            width, height = page.get_size()
+            bitmap = page.render(scale=max_edge / max(width, height), rotation=0)
+            return bitmap.to_pil()
+        finally:
+            page.close()
+    finally:
+        pdf.close()
+
+
+def _render_image(file_path, page_index, max_edge):
+    if page_index != 0:
+        raise PreviewError(f'Page {page_index + 1} does not exist')
+    with Image.open(file_path) as image:
+        # Lets the JPEG decoder downscale while decoding
+        image.draft('RGB', (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        return image.convert('RGB')
+
+
+def render_page(file_path, size='thumb', page_index=0):
+    """Render one page of a PDF or image to a PIL image at a preview size"""
+    if size not in PREVIEW_SIZES:
+        raise PreviewError(f'Unknown preview size: {size}')
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.pdf':
+        return _render_pdf_page(file_path, page_index, PREVIEW_SIZES[size])
+    if extension in IMAGE_EXTENSIONS:
+        return _render_image(file_path, page_index, PREVIEW_SIZES[size])
+    raise PreviewError('Previews are only available for PDFs and images')
+
+
+def get_preview(document, size='thumb', page_index=0):
+    """
+    Path of the stored preview for a document page, rendering it if needed.
+
+    Raises:
+        PreviewError: the file type, size or page is not supported
+    """
+    path = preview_path(document_hash(document), size, page_index)
+    if os.path.exists(path):
+        return path
+
+    image = render_page(document.file.path, size, page_index)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename so concurrent readers never see a partial file
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, PREVIEW_FORMAT, quality=PREVIEW_QUALITY)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return path
+
+
+def warm_previews(document, sizes=('thumb',)):
+    """Render first-page previews ahead of time; failures are logged, never raised"""
+    if not document.file:
+        return
+    for size in sizes:
+        try:
+            get_preview(document, size, 0)
+        except Exception as e:
+            print(f"Error rendering preview: {e}")
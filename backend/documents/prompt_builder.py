@@ -0,0 +1,234 @@
+"""
+Token-budgeted prompt construction for LLM extraction.
+
+Long proformas carry pages of terms and repeated page headers/footers that
+cost tokens without helping extraction. The builder drops that boilerplate,
+keeps the regions that carry fields (header block, item lines, totals and
+payment terms) within a token budget, and splits documents that still do
+not fit into chunks whose partial results are merged afterwards.
+"""
+import re
+from collections import Counter
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+# Rough characters-per-token ratio for English business documents,
+# used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+# Lines at the top of the document that usually hold vendor name/address
+HEADER_LINES = 25
+
+# A short line without numbers at the top or bottom of this many pages is a page header/footer
+REPEATED_LINE_MIN_PAGES = 2
+REPEATED_LINE_MAX_LENGTH = 80
+# Lines at each end of a page that can be a header/footer
+PAGE_EDGE_LINES = 3
+
+# Lines kept after a terms-and-conditions heading (payment terms are usually first)
+TERMS_LINES_KEPT = 8
+
+DIGITS = re.compile(r'\d+')
+WHITESPACE = re.compile(r'[ \t]+')
+AMOUNT = re.compile(r'\d[\d,]*\.\d{2}\b')
+QUANTITY_LINE = re.compile(r'^\s*\d+\s+\S.*\d')
+# Description followed by quantity and price columns, e.g. "Cable 2mm 10 500"
+ITEM_ROW = re.compile(r'[A-Za-z].*\s\d[\d,]*(\.\d+)?\s+\d[\d,]*(\.\d+)?\s*$')
+TOTALS = re.compile(r'\b(sub\s*total|total|grand total|amount due|balance due|tax|vat|discount|shipping)\b', re.IGNORECASE)
+FIELD_KEYWORDS = re.compile(
+    r'\b(invoice|proforma|receipt|date|vendor|supplier|seller|bill to|ship to|address|'
+    r'tel|phone|email|payment|due|currency|qty|quantity|unit price|description)\b',
+    re.IGNORECASE
+)
+TERMS_HEADING = re.compile(r'\b(terms (and|&) conditions|general conditions|conditions of sale)\b', re.IGNORECASE)
+
+# Line priorities: higher is kept first when trimming to the budget
+PRIORITY_HEADER = 4
+PRIORITY_TOTALS = 4
+PRIORITY_ITEMS = 3
+PRIORITY_FIELDS = 2
+PRIORITY_OTHER = 1
+PRIORITY_TERMS = 0
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Count tokens with tiktoken when available, else estimate from length"""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding('o200k_base')
+        return len(_encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _normalize(line):
+    """Key used to spot the same header/footer on different pages"""
+    return line.lower()
+
+
+def _is_boilerplate_candidate(line):
+    # Lines with numbers may be item rows, totals or dates; they are always kept
+    return len(line) <= REPEATED_LINE_MAX_LENGTH and not DIGITS.search(line)
+
+
+def clean_lines(text, pages=None):
+    """
+    Collapse whitespace and drop blank lines and repeated page headers/footers.
+
+    A line counts as a header/footer only if it sits among the first or last
+    PAGE_EDGE_LINES lines of at least REPEATED_LINE_MIN_PAGES pages and has
+    no numbers. Without page texts nothing but blank lines is dropped.
+    """
+    page_lines = []
+    for page in (pages if pages else [text]):
+        lines = [WHITESPACE.sub(' ', line).strip() for line in page.splitlines()]
+        page_lines.append([line for line in lines if line])
+
+    edge_pages = Counter()
+    for lines in page_lines:
+        edges = lines[:PAGE_EDGE_LINES] + lines[-PAGE_EDGE_LINES:]
+        edge_pages.update({_normalize(line) for line in edges if _is_boilerplate_candidate(line)})
+    repeated = {key for key, count in edge_pages.items() if count >= REPEATED_LINE_MIN_PAGES}
+
+    kept = []
+    seen_repeated = set()
+    for lines in page_lines:
+        for index, line in enumerate(lines):
+            key = _normalize(line)
+            at_edge = index < PAGE_EDGE_LINES or index >= len(lines) - PAGE_EDGE_LINES
+            if key in repeated and at_edge:
+                # Keep the first occurrence; it may be the vendor letterhead
+                if key in seen_repeated:
+                    continue
+                seen_repeated.add(key)
+            kept.append(line)
+    return kept
+
+
+def _line_priorities(lines):
+    priorities = []
+    in_terms = False
+    terms_kept = 0
+    for index, line in enumerate(lines):
+        if TERMS_HEADING.search(line):
+            in_terms = True
+            terms_kept = 0
+
+        if index < HEADER_LINES:
+            priority = PRIORITY_HEADER
+        elif TOTALS.search(line):
+            priority = PRIORITY_TOTALS
+            in_terms = False
+        elif AMOUNT.search(line) or QUANTITY_LINE.match(line) or ITEM_ROW.search(line):
+            priority = PRIORITY_ITEMS
+        elif in_terms:
+            terms_kept += 1
+            priority = PRIORITY_FIELDS if terms_kept <= TERMS_LINES_KEPT else PRIORITY_TERMS
+        elif FIELD_KEYWORDS.search(line):
+            priority = PRIORITY_FIELDS
+        else:
+            priority = PRIORITY_OTHER
+        priorities.append(priority)
+    return priorities
+
+
+def _select_lines(lines, budget):
+    """Keep the highest-priority lines that fit in budget tokens, in document order"""
+    priorities = _line_priorities(lines)
+    costs = [count_tokens(line) + 1 for line in lines]
+
+    selected = set()
+    used = 0
+    for priority in sorted(set(priorities), reverse=True):
+        for index, line_priority in enumerate(priorities):
+            if line_priority != priority:
+                continue
+            if used + costs[index] > budget:
+                continue
+            selected.add(index)
+            used += costs[index]
+    return [line for index, line in enumerate(lines) if index in selected]
+
+
+def _split_chunks(lines, budget):
+    chunks = []
+    current = []
+    used = 0
+    for line in lines:
+        cost = count_tokens(line) + 1
+        if current and used + cost > budget:
+            chunks.append('\n'.join(current))
+            current, used = [], 0
+        current.append(line)
+        used += cost
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+
+def build_prompt_chunks(text, max_tokens, max_chunks=1, pages=None):
+    """
+    Reduce document text to at most max_chunks pieces of about max_tokens each.
+
+    pages (the text of each page, when known) lets page headers and footers
+    be recognised and dropped.
+
+    Returns:
+        tuple: (list of chunk texts, stats dict for extraction_metadata)
+    """
+    original_tokens = count_tokens(text)
+    lines = clean_lines(text, pages)
+    cleaned = '\n'.join(lines)
+    cleaned_tokens = count_tokens(cleaned)
+
+    if cleaned_tokens <= max_tokens:
+        chunks = [cleaned]
+        selected_count = len(lines)
+    else:
+        selected = _select_lines(lines, max_tokens * max_chunks)
+        selected_count = len(selected)
+        chunks = _split_chunks(selected, max_tokens)
+
+    stats = {
+        'original_tokens': original_tokens,
+        'input_tokens': sum(count_tokens(chunk) for chunk in chunks),
+        'dropped_lines': len(text.splitlines()) - selected_count,
+        'chunks': len(chunks),
+    }
+    return chunks, stats
+
+
+def _merge_items(item_lists):
+    # Chunks never overlap, so identical items in different chunks are separate lines
+    return [item for items in item_lists for item in items or [] if isinstance(item, dict)]
+
+
+def merge_partial_results(results, document_type):
+    """Combine per-chunk extraction results into one result"""
+    if len(results) == 1:
+        return results[0]
+
+    merged = {}
+    # Header fields come from the first chunk that has them
+    text_fields = ['vendor_name', 'vendor_address', 'terms'] if document_type == 'proforma' else ['vendor_name', 'date']
+    for field in text_fields:
+        merged[field] = next((r.get(field) for r in results if r.get(field)), '' if field != 'date' else None)
+
+    # Totals are printed at the end, so prefer the last chunk that has one
+    merged['total_amount'] = next(
+        (r.get('total_amount') for r in reversed(results) if r.get('total_amount') is not None),
+        None
+    )
+
+    if document_type == 'proforma':
+        merged['items_data'] = {
+            'items': _merge_items((r.get('items_data') or {}).get('items') for r in results)
+        }
+    else:
+        merged['items'] = _merge_items(r.get('items') for r in results)
+    return merged
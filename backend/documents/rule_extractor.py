@@ -0,0 +1,324 @@
+"""
+Rule-based extraction engine.
+
+A declarative set of precompiled patterns pulls vendor, address, dates,
+currency, line items, totals and payment terms out of document text in a
+single pass over its lines, and scores each field with a confidence. For
+common invoice/receipt layouts this is good enough to skip the LLM entirely.
+"""
+import re
+from collections import Counter, namedtuple
+from datetime import datetime
+
+# Bump when rules change so cached rule-based results are recomputed
+RULES_VERSION = '3'
+
+# Confidence of a total that disagrees with the printed subtotal and tax
+CONTRADICTED_TOTAL_CONFIDENCE = 0.3
+
+AMOUNT = r'[$€£]?\s?(?P<{name}>\d{{1,3}}(?:,\d{{3}})+(?:\.\d{{1,2}})?|\d+(?:\.\d{{1,2}})?)'
+
+
+def _amount(name='value'):
+    return AMOUNT.format(name=name)
+
+
+Rule = namedtuple('Rule', ['field', 'pattern', 'confidence'])
+
+# Labelled single-value fields, most specific first. The first rule that
+# matches a line wins for that line; for totals the last matching line in
+# the document wins because totals are printed at the bottom.
+LINE_RULES = [
+    Rule('total_amount', rf'^(?:grand\s+total|total\s+amount|total\s+due|amount\s+due|balance\s+due|amount\s+payable)\b[^\d$€£]*{_amount()}', 0.95),
+    Rule('subtotal', rf'^sub\s*-?\s*total\b[^\d$€£]*{_amount()}', 0.9),
+    # The amount, not the rate: 'VAT 18%: 54.00' is 54.00
+    Rule('tax', rf'^(?:tax|vat|gst|sales\s+tax)\b[^\d$€£]*?(?:\d+(?:\.\d+)?\s*%[^\d$€£]*)?{_amount()}(?![\d.,]*\s*%)', 0.85),
+    Rule('total_amount', rf'^total\b[^\d$€£]*{_amount()}', 0.9),
+    Rule('vendor_name', r'^(?:vendor|supplier|seller|from|company|merchant)\s*(?:name)?\s*[:\-]\s*(?P<value>.{2,100})$', 0.95),
+    Rule('vendor_address', r'^(?:address|vendor\s+address|supplier\s+address)\s*[:\-]\s*(?P<value>.{4,200})$', 0.9),
+    Rule('date', r'^(?:invoice\s+|receipt\s+|issue\s+|document\s+)?date\s*(?:of\s+issue)?\s*[:\-]?\s*(?P<value>.{6,30})$', 0.9),
+    Rule('terms', r'^(?:payment\s+terms|terms\s+of\s+payment|terms)\s*[:\-]\s*(?P<value>.{2,300})$', 0.9),
+    Rule('currency', r'^currency\s*[:\-]\s*(?P<value>[A-Za-z]{3})\b', 0.95),
+]
+
+LINE_PATTERN = re.compile(
+    '|'.join(f'(?P<r{i}>{rule.pattern.replace("(?P<value>", f"(?P<r{i}_value>")})' for i, rule in enumerate(LINE_RULES)),
+    re.IGNORECASE
+)
+
+ITEM_PATTERNS = [
+    # Description  Qty  Unit price  Total
+    re.compile(
+        r'^(?P<description>[A-Za-z].*?)\s+(?P<quantity>\d+(?:\.\d+)?)\s*(?:x|pcs|units?)?\s+'
+        rf'{_amount("unit_price")}\s+{_amount("total")}$',
+        re.IGNORECASE
+    ),
+    # Qty  Description  Unit price  Total  /  Qty x Description @ Unit price  Total
+    re.compile(
+        r'^(?P<quantity>\d+(?:\.\d+)?)\s*(?:x\s+)?(?P<description>[A-Za-z].*?)\s+@?\s*'
+        rf'{_amount("unit_price")}\s+{_amount("total")}$',
+        re.IGNORECASE
+    ),
+    # Description  Total (receipts often omit quantity and unit price)
+    re.compile(rf'^(?P<description>[A-Za-z][^:]*?)\s{{2,}}{_amount("total")}$'),
+]
+
+NON_ITEM_WORDS = re.compile(
+    r'\b(total|subtotal|sub-total|tax|vat|gst|balance|amount due|change|cash|card|tendered|discount|shipping|paid)\b',
+    re.IGNORECASE
+)
+
+CURRENCY_SYMBOLS = {'$': 'USD', '€': 'EUR', '£': 'GBP'}
+CURRENCY_CODES = re.compile(r'\b(USD|EUR|GBP|RWF|KES|UGX|TZS|NGN|ZAR|CAD|AUD|INR|JPY|CHF|CNY)\b')
+CURRENCY_SYMBOL = re.compile(r'[$€£]')
+
+DATE_PATTERNS = [
+    (re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b'), ('%Y', '%m', '%d')),
+    (re.compile(r'\b(\d{1,2})[/.](\d{1,2})[/.](\d{4})\b'), ('%d', '%m', '%Y')),
+    (re.compile(r'\b(\d{1,2})\s+([A-Za-z]{3,9})\.?,?\s+(\d{4})\b'), ('%d', '%B', '%Y')),
+    (re.compile(r'\b([A-Za-z]{3,9})\.?\s+(\d{1,2}),?\s+(\d{4})\b'), ('%B', '%d', '%Y')),
+]
+
+LEGAL_SUFFIX = re.compile(
+    r'\b(ltd|limited|inc|incorporated|llc|plc|gmbh|sarl|s\.a\.|co\.|company|corp|corporation|group|enterprises?|traders?|supplies)\b\.?',
+    re.IGNORECASE
+)
+DOCUMENT_TITLE = re.compile(
+    r'^(pro\s*-?\s*forma|proforma|invoice|tax invoice|receipt|sales receipt|quotation|quote|bill|statement)\b',
+    re.IGNORECASE
+)
+ADDRESS_HINT = re.compile(
+    r'\b(street|st\.|road|rd\.|avenue|ave\.?|boulevard|blvd|lane|drive|p\.?o\.?\s*box|suite|floor|building|'
+    r'district|city|kigali|nairobi|kampala|zip|postal)\b|\d+\s+\w+|,',
+    re.IGNORECASE
+)
+CONTACT_LINE = re.compile(r'(@|\bwww\.|\bhttps?://|\btel\b|\bphone\b|\bfax\b|\+?\d[\d\s-]{7,}\d)', re.IGNORECASE)
+
+HEADER_LINES = 8
+
+
+def parse_amount(value):
+    """Parse '1,234.50' into 1234.5"""
+    try:
+        return float(value.replace(',', '').strip())
+    except (AttributeError, ValueError):
+        return None
+
+
+def parse_date(value):
+    """Normalise a date string to YYYY-MM-DD, or None"""
+    for pattern, parts in DATE_PATTERNS:
+        match = pattern.search(value)
+        if not match:
+            continue
+        groups = list(match.groups())
+        formats = list(parts)
+        for i, fmt in enumerate(formats):
+            if fmt == '%B' and len(groups[i]) <= 4:
+                formats[i] = '%b'
+                groups[i] = groups[i][:3]
+        try:
+            return datetime.strptime(' '.join(groups), ' '.join(formats)).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_item(line):
+    if NON_ITEM_WORDS.search(line) or CONTACT_LINE.search(line):
+        return None
+    for pattern in ITEM_PATTERNS:
+        match = pattern.match(line)
+        if not match:
+            continue
+        groups = match.groupdict()
+        total = parse_amount(groups.get('total'))
+        quantity = parse_amount(groups.get('quantity')) if groups.get('quantity') else 1
+        unit_price = parse_amount(groups.get('unit_price')) if groups.get('unit_price') else total
+        if total is None:
+            continue
+        consistent = unit_price is not None and abs(quantity * unit_price - total) < 0.02
+        if quantity == int(quantity):
+            quantity = int(quantity)
+        return {
+            'description': groups['description'].strip(' .-:'),
+            'quantity': quantity,
+            'unit_price': unit_price,
+            'total': total,
+        }, 0.9 if consistent and groups.get('unit_price') else 0.6
+    return None
+
+
+def _looks_like_vendor(line):
+    if DOCUMENT_TITLE.match(line) or CONTACT_LINE.search(line) or parse_date(line):
+        return False
+    letters = sum(ch.isalpha() for ch in line)
+    return letters >= 2 and letters / len(line) > 0.5
+
+
+def extract(text):
+    """
+    Run every rule over the text in one pass.
+
+    Returns:
+        tuple: (fields dict, per-field confidence dict)
+    """
+    lines = [line.strip() for line in text.splitlines()]
+    lines = [line for line in lines if line]
+
+    fields = {}
+    confidence = {}
+    items = []
+    item_confidences = []
+    currencies = Counter()
+    vendor_line_index = None
+
+    def record(field, value, score, prefer_last=False):
+        if value in (None, ''):
+            return
+        if field not in fields or score > confidence[field] or (prefer_last and score >= confidence[field]):
+            fields[field] = value
+            confidence[field] = score
+
+    for index, line in enumerate(lines):
+        for symbol in CURRENCY_SYMBOL.findall(line):
+            currencies[CURRENCY_SYMBOLS[symbol]] += 1
+        for code in CURRENCY_CODES.findall(line):
+            currencies[code.upper()] += 2
+
+        match = LINE_PATTERN.search(line)
+        if match:
+            rule_index = int(match.lastgroup[1:])
+            rule = LINE_RULES[rule_index]
+            raw = match.group(f'r{rule_index}_value').strip()
+            if rule.field in ('total_amount', 'subtotal', 'tax'):
+                record(rule.field, parse_amount(raw), rule.confidence, prefer_last=True)
+            elif rule.field == 'date':
+                record('date', parse_date(raw), rule.confidence)
+            elif rule.field == 'currency':
+                record('currency', raw.upper(), rule.confidence)
+            else:
+                record(rule.field, raw[:200], rule.confidence)
+                if rule.field == 'vendor_name':
+                    vendor_line_index = index
+            continue
+
+        item = _parse_item(line)
+        if item:
+            items.append(item[0])
+            item_confidences.append(item[1])
+            continue
+
+        if 'date' not in fields or confidence['date'] < 0.6:
+            record('date', parse_date(line), 0.5)
+
+        if index < HEADER_LINES and 'vendor_name' not in fields and _looks_like_vendor(line):
+            record('vendor_name', line[:100], 0.85 if LEGAL_SUFFIX.search(line) else 0.5)
+            vendor_line_index = index
+
+    # Address: the lines right under the vendor name in the header block
+    if 'vendor_address' not in fields and vendor_line_index is not None:
+        address_lines = []
+        for line in lines[vendor_line_index + 1:vendor_line_index + 4]:
+            if LINE_PATTERN.search(line) or DOCUMENT_TITLE.match(line) or CONTACT_LINE.search(line):
+                break
+            if not ADDRESS_HINT.search(line):
+                break
+            address_lines.append(line)
+        if address_lines:
+            record('vendor_address', ', '.join(address_lines), 0.6)
+
+    if items:
+        fields['items'] = items
+        confidence['items'] = round(sum(item_confidences) / len(item_confidences), 2)
+
+    if 'currency' not in fields and currencies:
+        record('currency', currencies.most_common(1)[0][0], 0.7)
+
+    _cross_check_totals(fields, confidence)
+    return fields, confidence
+
+
+def _cross_check_totals(fields, confidence):
+    """Raise, lower or infer total_amount from subtotal + tax and item totals"""
+    total = fields.get('total_amount')
+    subtotal = fields.get('subtotal')
+    tax = fields.get('tax') or 0
+    items_sum = round(sum(item['total'] for item in fields.get('items', [])), 2)
+
+    if total is None:
+        if subtotal is not None:
+            fields['total_amount'] = round(subtotal + tax, 2)
+            confidence['total_amount'] = 0.7
+        elif items_sum:
+            fields['total_amount'] = items_sum
+            confidence['total_amount'] = 0.5
+        return
+
+    if items_sum and (abs(items_sum - total) < 0.02 or (subtotal is not None and abs(items_sum - subtotal) < 0.02)):
+        if 'items' in confidence:
+            confidence['items'] = max(confidence['items'], 0.95)
+
+    # Only the total itself adding up confirms it; items matching the subtotal say nothing about it
+    if (subtotal is not None and abs(subtotal + tax - total) < 0.02) or (items_sum and abs(items_sum - total) < 0.02):
+        confidence['total_amount'] = max(confidence['total_amount'], 0.98)
+    elif subtotal is not None:
+        # The printed total contradicts subtotal + tax: one of them is misread
+        confidence['total_amount'] = min(confidence['total_amount'], CONTRADICTED_TOTAL_CONFIDENCE)
+
+
+def overall_confidence(confidence, required=('vendor_name', 'total_amount')):
+    """Weakest confidence among the required fields (0 if any is missing)"""
+    return min(confidence.get(field, 0.0) for field in required)
+
+
+def confidence_label(score):
+    if score >= 0.8:
+        return 'high'
+    if score >= 0.5:
+        return 'medium'
+    return 'low'
+
+
+def extract_proforma(text):
+    """Rule-based proforma extraction in the DocumentProcessor result format"""
+    fields, confidence = extract(text)
+    score = overall_confidence(confidence)
+    items_data = {}
+    if fields.get('items'):
+        items_data['items'] = fields['items']
+    if fields.get('currency'):
+        items_data['currency'] = fields['currency']
+    return {
+        'vendor_name': fields.get('vendor_name', ''),
+        'vendor_address': fields.get('vendor_address', ''),
+        'total_amount': fields.get('total_amount'),
+        'items_data': items_data,
+        'terms': fields.get('terms', ''),
+        'extraction_metadata': _metadata(fields, confidence, score),
+    }
+
+
+def extract_receipt(text):
+    """Rule-based receipt extraction in the DocumentProcessor result format"""
+    fields, confidence = extract(text)
+    score = overall_confidence(confidence)
+    return {
+        'vendor_name': fields.get('vendor_name', ''),
+        'items': fields.get('items', []),
+        'total_amount': fields.get('total_amount'),
+        'date': fields.get('date'),
+        'currency': fields.get('currency'),
+        'extraction_metadata': _metadata(fields, confidence, score),
+    }
+
+
+def _metadata(fields, confidence, score):
+    return {
+        'method': 'rule_engine',
+        'rules_version': RULES_VERSION,
+        'success': True,
+        'confidence': confidence_label(score),
+        'confidence_score': round(score, 2),
+        'field_confidence': confidence,
+    }
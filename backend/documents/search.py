@@ -0,0 +1,192 @@
+"""
+Full-text search over the extracted text of proformas, receipts and purchase orders.
+
+Each document's text is kept in a DocumentText row. PostgreSQL indexes it
+with a generated tsvector column and a GIN index; SQLite (local development)
+with an FTS5 table kept in sync by triggers. Ranking, the request-owner
+filter and the limit all run inside the index query, so a search only ever
+loads the rows it returns.
+"""
+import re
+from django.conf import settings
+from django.db import connection
+from .models import DocumentText
+
+# Must match the text search configuration of the generated column (migration 0009)
+POSTGRES_CONFIG = 'english'
+
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_STOP = '</mark>'
+
+DOCUMENT_TYPES = [choice for choice, _ in DocumentText.DOCUMENT_TYPE_CHOICES]
+
+WORD = re.compile(r'\w+')
+
+
+def proforma_text(proforma, text):
+    return _join(
+        proforma.vendor_name,
+        proforma.vendor_address,
+        proforma.terms,
+        *_item_descriptions(proforma.items_data),
+        text,
+    )
+
+
+def receipt_text(receipt, text):
+    data = receipt.extracted_data or {}
+    return _join(data.get('vendor_name'), *_item_descriptions(data), text)
+
+
+def purchase_order_text(purchase_order):
+    return _join(
+        purchase_order.po_number,
+        purchase_order.vendor_name,
+        purchase_order.vendor_address,
+        purchase_order.terms,
+        *_item_descriptions(purchase_order.items_data),
+    )
+
+
+def _item_descriptions(data):
+    items = (data or {}).get('items') or (data or {}).get('items_data', {}).get('items') or []
+    return [item.get('description') for item in items if isinstance(item, dict)]
+
+
+def _join(*parts):
+    return '\n'.join(str(part) for part in parts if part)
+
+
+def index_document(document, document_type, text):
+    """Store the searchable text of a Proforma, Receipt or PurchaseOrder"""
+    DocumentText.objects.update_or_create(
+        **{document_type: document},
+        defaults={
+            'document_type': document_type,
+            'request_id': document.request_id,
+            # tsvector values are capped at 1 MB; the first pages carry what people search for
+            'text': text[:settings.SEARCH_MAX_TEXT_CHARS],
+        }
+    )
+
+
+def _fts5_query(query):
+    """FTS5 MATCH expression: every whitespace-separated term must appear, hyphenated terms as phrases"""
+    phrases = []
+    for term in query.split():
+        words = WORD.findall(term)
+        if words:
+            phrases.append('"' + ' '.join(words) + '"')
+    return ' '.join(phrases)
+
+
+def _filters(owner, document_types, params):
+    clauses = []
+    if owner is not None:
+        clauses.append('r.created_by_id = %s')
+        params.append(owner.pk)
+    if document_types:
+        clauses.append(f"documents_documenttext.document_type IN ({', '.join(['%s'] * len(document_types))})")
+        params.extend(document_types)
+    return ''.join(f' AND {clause}' for clause in clauses)
+
+
+def _search_postgresql(query, owner, document_types, limit):
+    headline_options = f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxWords=30, MinWords=10, MaxFragments=2'
+    params = [POSTGRES_CONFIG, headline_options, POSTGRES_CONFIG, query]
+    filters = _filters(owner, document_types, params)
+    params.append(limit)
+    # Headlines are expensive, so only the ranked top rows get one
+    sql = f"""
+        SELECT ranked.id, ranked.rank, ts_headline(%s, ranked.text, ranked.query, %s)
+        FROM (
+            SELECT documents_documenttext.id, documents_documenttext.text, q.query,
+                ts_rank_cd(documents_documenttext.search_vector, q.query) AS rank
+            FROM documents_documenttext
+            CROSS JOIN websearch_to_tsquery(%s, %s) AS q(query)
+            JOIN requests_purchaserequest r ON r.id = documents_documenttext.request_id
+            WHERE documents_documenttext.search_vector @@ q.query{filters}
+            ORDER BY rank DESC
+            LIMIT %s
+        ) ranked
+        ORDER BY ranked.rank DESC
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _search_sqlite(query, owner, document_types, limit):
+    match = _fts5_query(query)
+    if not match:
+        return []
+    params = [HIGHLIGHT_START, HIGHLIGHT_STOP, match]
+    filters = _filters(owner, document_types, params)
+    params.append(limit)
+    sql = f"""
+        SELECT documents_documenttext.id, -bm25(documents_documenttext_fts) AS rank,
+            snippet(documents_documenttext_fts, 0, %s, %s, '...', 24)
+        FROM documents_documenttext_fts
+        JOIN documents_documenttext ON documents_documenttext.id = documents_documenttext_fts.rowid
+        JOIN requests_purchaserequest r ON r.id = documents_documenttext.request_id
+        WHERE documents_documenttext_fts MATCH %s{filters}
+        ORDER BY rank DESC
+        LIMIT %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _search_fallback(query, owner, document_types, limit):
+    """Unindexed substring search for other databases"""
+    texts = DocumentText.objects.filter(text__icontains=query)
+    if owner is not None:
+        texts = texts.filter(request__created_by=owner)
+    if document_types:
+        texts = texts.filter(document_type__in=document_types)
+    return [(pk, 1.0, '') for pk in texts.order_by('-updated_at').values_list('id', flat=True)[:limit]]
+
+
+def search_documents(query, owner=None, document_types=None, limit=20):
+    """
+    Ranked full-text search of document texts.
+
+    Args:
+        query: search terms (PostgreSQL also accepts "quoted phrases", or, -exclusions)
+        owner: only documents of this user's requests (None for all)
+        document_types: restrict to these DocumentText.document_type values
+        limit: maximum number of results
+
+    Returns:
+        list: result dicts, best match first
+    """
+    search = {
+        'postgresql': _search_postgresql,
+        'sqlite': _search_sqlite,
+    }.get(connection.vendor, _search_fallback)
+    rows = search(query, owner, document_types, limit)
+
+    texts = DocumentText.objects.select_related('request', 'proforma', 'receipt', 'purchase_order').in_bulk(
+        [pk for pk, _, _ in rows]
+    )
+    results = []
+    for pk, rank, snippet in rows:
+        text = texts[pk]
+        document = text.proforma or text.receipt or text.purchase_order
+        results.append({
+            'type': text.document_type,
+            'id': document.pk,
+            'request': text.request_id,
+            'request_title': text.request.title,
+            'vendor_name': _vendor_name(document, text.document_type),
+            'rank': float(f'{float(rank):.4g}'),
+            'snippet': snippet,
+        })
+    return results
+
+
+def _vendor_name(document, document_type):
+    if document_type == 'receipt':
+        return (document.extracted_data or {}).get('vendor_name', '')
+    return document.vendor_name
@@ -0,0 +1,57 @@
+"""
+Purchase order numbers.
+
+Numbers are PO-<YYYYMMDD>-<NNNN>, counting from 1 each day. The count lives
+in one PurchaseOrderSequence row per day, incremented by a single
+INSERT ... ON CONFLICT DO UPDATE ... RETURNING statement: one round trip, no
+scan of the day's purchase orders, and concurrent approvals queue on the
+row lock instead of racing for the same number. The increment belongs to
+the caller's transaction, so a rolled-back approval leaves no gap.
+"""
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import PurchaseOrderSequence
+
+PREFIX = 'PO'
+
+UPSERT_SQL = f"""
+    INSERT INTO {PurchaseOrderSequence._meta.db_table} (day, last_value)
+    VALUES (%s, 1)
+    ON CONFLICT (day) DO UPDATE
+    SET last_value = {PurchaseOrderSequence._meta.db_table}.last_value + 1
+    RETURNING last_value
+"""
+
+
+def _supports_upsert_returning():
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        # RETURNING arrived in SQLite 3.35
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return False
+
+
+def next_value(day):
+    """Increment and return the counter of a day"""
+    if _supports_upsert_returning():
+        with connection.cursor() as cursor:
+            cursor.execute(UPSERT_SQL, [day])
+            return cursor.fetchone()[0]
+
+    # Other databases: lock the day's row, then increment it
+    with transaction.atomic():
+        sequence, _ = PurchaseOrderSequence.objects.select_for_update().get_or_create(day=day)
+        PurchaseOrderSequence.objects.filter(pk=sequence.pk).update(last_value=F('last_value') + 1)
+        return PurchaseOrderSequence.objects.values_list('last_value', flat=True).get(pk=sequence.pk)
+
+
+def format_po_number(day, value):
+    return f"{PREFIX}-{day:%Y%m%d}-{value:04d}"
+
+
+def allocate_po_number(day=None):
+    """The next purchase order number for a day (default today)"""
+    day = day or timezone.localdate()
+    return format_po_number(day, next_value(day))
@@ -1,65 +1,183 @@
+import os
+from django.conf import settings
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Proforma, PurchaseOrder, Receipt
+from .models import Proforma, PurchaseOrder, Receipt, ExtractionJob, UploadSession
+from .upload_handlers import (
+    DOCUMENT_CONTENT_TYPES, SNIFF_BYTES, open_completed_upload, sniff_content_type, upload_too_large
+)
 
 
-class ProformaSerializer(serializers.ModelSerializer):
+class DocumentUploadMixin(serializers.Serializer):
+    """Accept a document as a streamed `file` or as a completed chunked `upload` session"""
+    
+    upload = serializers.PrimaryKeyRelatedField(
+        queryset=UploadSession.objects.filter(status='complete'),
+        write_only=True,
+        required=False
+    )
+    
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if upload_too_large(self.context.get('request')):
+            # The streamed file was dropped part way through
+            raise serializers.ValidationError({'file': 'File is too large'})
+        upload = attrs.get('upload')
+        file = attrs.get('file')
+        if self.instance is None and bool(upload) == bool(file):
+            raise serializers.ValidationError('Provide either a file or a completed upload')
+        
+        if upload:
+            request = self.context.get('request')
+            if request and upload.created_by_id != request.user.id:
+                raise serializers.ValidationError({'upload': 'Upload not found'})
+            content_type, size = upload.content_type, upload.size
+        elif file:
+            content_type = getattr(file, 'sniffed_content_type', None)
+            if content_type is None:
+                content_type = sniff_content_type(file.read(SNIFF_BYTES))
+                file.seek(0)
+            size = file.size
+        else:
+            return attrs
+        
+        if content_type not in DOCUMENT_CONTENT_TYPES:
+            raise serializers.ValidationError({'file': 'Unsupported file type; upload a PDF or an image'})
+        if size > settings.DOCUMENT_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError({'file': 'File is too large'})
+        return attrs
+    
+    def create(self, validated_data):
+        upload = validated_data.pop('upload', None)
+        if upload:
+            validated_data['file'] = open_completed_upload(upload)
+        file = validated_data['file']
+        validated_data['content_hash'] = getattr(file, 'sha256', '')
+        # Storage names files by content; keep what the client called it
+        validated_data['original_filename'] = os.path.basename(file.name or '')[:255]
+        instance = super().create(validated_data)
+        if upload:
+            # The assembled file now lives in storage
+            file.close()
+            upload.delete()
+        return instance
+
+
+def preview_url(route_name, obj):
+    """Preview URL versioned by content hash, so browsers can cache it indefinitely"""
+    if not obj.file:
+        return None
+    url = reverse(route_name, args=[obj.pk])
+    return f"{url}?v={obj.content_hash[:16]}" if obj.content_hash else url
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Serializer for resumable chunked uploads"""
+    
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'filename', 'size', 'offset', 'status',
+            'content_type', 'content_hash', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'offset', 'status', 'content_type', 'content_hash', 'created_at', 'updated_at']
+    
+    def validate_size(self, value):
+        if value > settings.DOCUMENT_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError('File is too large')
+        return value
+
+
+class ProformaSerializer(DocumentUploadMixin, serializers.ModelSerializer):
     """Serializer for proforma documents"""
     
     file_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
     
     class Meta:
         model = Proforma
         fields = [
-            'id', 'request', 'file', 'file_url', 'uploaded_at',
+            'id', 'request', 'file', 'upload', 'file_url', 'preview_url', 'original_filename', 'content_hash', 'uploaded_at',
             'vendor_name', 'vendor_address', 'total_amount',
             'items_data', 'terms', 'extraction_metadata'
         ]
-        read_only_fields = ['id', 'uploaded_at', 'extraction_metadata']
+        read_only_fields = ['id', 'original_filename', 'content_hash', 'uploaded_at', 'extraction_metadata']
+        extra_kwargs = {'file': {'required': False}}
     
     def get_file_url(self, obj):
         return obj.file.url if obj.file else None
+    
+    def get_preview_url(self, obj):
+        return preview_url('proforma-preview', obj)
 
 
 class PurchaseOrderSerializer(serializers.ModelSerializer):
     """Serializer for purchase orders"""
     
     file_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
     generated_by_username = serializers.CharField(source='generated_by.username', read_only=True)
     
     class Meta:
         model = PurchaseOrder
         fields = [
-            'id', 'request', 'po_number', 'file', 'file_url',
+            'id', 'request', 'po_number', 'file', 'file_url', 'preview_url', 'download_url',
+            'original_filename', 'content_hash',
             'generated_at', 'generated_by', 'generated_by_username',
             'vendor_name', 'vendor_address', 'items_data',
             'total_amount', 'terms'
         ]
-        read_only_fields = ['id', 'po_number', 'generated_at', 'generated_by']
+        read_only_fields = ['id', 'po_number', 'original_filename', 'content_hash', 'generated_at', 'generated_by']
     
     def get_file_url(self, obj):
         return obj.file.url if obj.file else None
+    
+    def get_preview_url(self, obj):
+        return preview_url('purchase-order-preview', obj)
+    
+    def get_download_url(self, obj):
+        # Works before the PDF is rendered; the download renders it if needed
+        return reverse('purchase-order-download', args=[obj.pk])
 
 
-class ReceiptSerializer(serializers.ModelSerializer):
+class ReceiptSerializer(DocumentUploadMixin, serializers.ModelSerializer):
     """Serializer for receipts"""
     
     file_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
     uploaded_by_username = serializers.CharField(source='uploaded_by.username', read_only=True)
     
     class Meta:
         model = Receipt
         fields = [
-            'id', 'request', 'file', 'file_url', 'uploaded_at',
+            'id', 'request', 'file', 'upload', 'file_url', 'preview_url', 'original_filename', 'content_hash', 'uploaded_at',
             'uploaded_by', 'uploaded_by_username', 'validation_status',
             'extracted_data', 'validation_results', 'discrepancies',
             'validated_at'
         ]
         read_only_fields = [
-            'id', 'uploaded_at', 'uploaded_by', 'validation_status',
+            'id', 'original_filename', 'content_hash', 'uploaded_at', 'uploaded_by', 'validation_status',
             'extracted_data', 'validation_results', 'discrepancies',
             'validated_at'
         ]
+        extra_kwargs = {'file': {'required': False}}
     
     def get_file_url(self, obj):
         return obj.file.url if obj.file else None
+    
+    def get_preview_url(self, obj):
+        return preview_url('receipt-preview', obj)
 
+
+class ExtractionJobSerializer(serializers.ModelSerializer):
+    """Serializer for background extraction job status"""
+    
+    class Meta:
+        model = ExtractionJob
+        fields = [
+            'id', 'job_type', 'status', 'progress', 'stage',
+            'proforma', 'receipt', 'purchase_order', 'attempts', 'error',
+            'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
@@ -3,21 +3,31 @@ Services for document processing and PO generation
 """
 from django.conf import settings
 from django.core.files.base import ContentFile
+from django.db import transaction
 from .models import PurchaseOrder
 from .document_processor import DocumentProcessor
-from .po_generator import generate_po_pdf
+from .fingerprints import fingerprint_document
+from .po_generator import po_render_context, render_po_pdf, render_queryset
+from . import search
 from django.utils import timezone
+import hashlib
 import os
 
 
 def generate_purchase_order(purchase_request, generated_by):
-    """Generate a purchase order after final approval and create PDF file"""
+    """
+    Create the purchase order after final approval and queue its PDF for rendering.
+    
+    Only database rows are written, so this is cheap inside the approval
+    transaction; the document worker renders the PDF once it commits (and
+    render_purchase_order_pdf renders it on first download if still missing).
+    """
     # Check if PO already exists
     if hasattr(purchase_request, 'purchase_order'):
         po = purchase_request.purchase_order
         # Regenerate PDF if it doesn't exist
         if not po.file:
-            _generate_po_pdf_file(po)
+            _queue_po_render(po, generated_by)
         return po
     
     # Get vendor and items from proforma if available
@@ -60,30 +70,155 @@ def generate_purchase_order(purchase_request, generated_by):
         terms=terms
     )
     
-    # Generate PDF file
-    _generate_po_pdf_file(po)
+    # Render the PDF in the background
+    _queue_po_render(po, generated_by)
     
     return po
 
 
-def _generate_po_pdf_file(purchase_order):
-    """Generate and save PDF file for purchase order"""
-    try:
+def _queue_po_render(purchase_order, generated_by):
+    from .jobs import enqueue_job
+    enqueue_job('purchase_order_render', created_by=generated_by, purchase_order=purchase_order)
+
+
+def render_purchase_order_pdf(purchase_order):
+    """
+    Render and save the PDF of a purchase order unless it already has one.
+    
+    The PO row is locked while rendering, so the background renderer and a
+    first download never both write a file.
+    
+    Returns:
+        PurchaseOrder: the purchase order with its file
+    """
+    with transaction.atomic():
+        # of=('self',): only the PO row is locked, not the request and users joined in for the render
+        purchase_order = render_queryset(
+            PurchaseOrder.objects.select_for_update(of=('self',))
+        ).get(pk=purchase_order.pk)
+        if purchase_order.file:
+            return purchase_order
+        
         # Generate PDF
-        pdf_buffer = generate_po_pdf(purchase_order)
+        content = render_po_pdf(po_render_context(purchase_order))
         
         # Create filename
         filename = f"PO_{purchase_order.po_number}.pdf"
         
         # Save to file field
-        purchase_order.file.save(
-            filename,
-            ContentFile(pdf_buffer.read()),
-            save=True
+        purchase_order.content_hash = hashlib.sha256(content).hexdigest()
+        purchase_order.original_filename = filename
+        content_file = ContentFile(content)
+        content_file.sha256 = purchase_order.content_hash
+        purchase_order.file.save(filename, content_file, save=True)
+    _index_text(purchase_order, 'purchase_order', search.purchase_order_text(purchase_order))
+    return purchase_order
+
+
+def process_proforma(proforma, processor=None):
+    """Extract data from an uploaded proforma and store it on the instance"""
+    processor = processor or DocumentProcessor()
+    extracted_data = processor.extract_proforma_data(proforma.file.path)
+    
+    proforma.vendor_name = extracted_data.get('vendor_name', '')
+    proforma.vendor_address = extracted_data.get('vendor_address', '')
+    proforma.total_amount = extracted_data.get('total_amount')
+    proforma.items_data = extracted_data.get('items_data', {})
+    proforma.terms = extracted_data.get('terms', '')
+    proforma.extraction_metadata = extracted_data.get('extraction_metadata', {})
+    if settings.DUPLICATE_DETECTION_ENABLED:
+        # Proformas have no discrepancies field; duplicates are recorded with the extraction
+        proforma.extraction_metadata['possible_duplicates'] = _find_duplicates(
+            proforma, 'proforma', processor.last_text
+        )
+    proforma.save()
+    _index_text(proforma, 'proforma', search.proforma_text(proforma, processor.last_text))
+    return proforma
+
+
+def validate_receipt(receipt, processor=None, extract=True, progress=None):
+    """
+    Extract receipt data and validate it against the request's purchase order
+    
+    Args:
+        receipt: Receipt instance
+        processor: DocumentProcessor to reuse (a new one is created if omitted)
+        extract: re-run extraction on the file instead of using extracted_data
+        progress: optional callable(percent, stage, data=None) for reporting progress
+        
+    Returns:
+        Receipt: the updated receipt
+    """
+    processor = processor or DocumentProcessor()
+    
+    duplicates = duplicate_discrepancies(receipt.discrepancies)
+    if extract or not receipt.extracted_data:
+        if progress:
+            progress(10, 'extracting')
+        receipt.extracted_data = processor.extract_receipt_data(receipt.file.path)
+        _index_text(receipt, 'receipt', search.receipt_text(receipt, processor.last_text))
+        if settings.DUPLICATE_DETECTION_ENABLED:
+            if progress:
+                progress(60, 'checking duplicates')
+            duplicates = _find_duplicates(receipt, 'receipt', processor.last_text)
+    
+    purchase_request = receipt.request
+    if hasattr(purchase_request, 'purchase_order'):
+        if progress:
+            progress(70, 'validating')
+        validation_results, discrepancies = processor.validate_receipt_against_po(
+            receipt.extracted_data, purchase_request.purchase_order
         )
+        discrepancies += duplicates
+        
+        receipt.validation_results = validation_results
+        receipt.discrepancies = discrepancies
+        receipt.validation_status = receipt_validation_status(validation_results, discrepancies)
+        receipt.validated_at = timezone.now()
+        if progress:
+            progress(90, 'validation done', {
+                'validation_status': receipt.validation_status,
+                'validation_results': {
+                    key: validation_results[key]
+                    for key in ('vendor_match', 'amount_match', 'items_match', 'overall_valid')
+                },
+                'discrepancy_count': len(discrepancies),
+            })
+    else:
+        receipt.discrepancies = [
+            d for d in receipt.discrepancies if d.get('type') != 'possible_duplicate'
+        ] + duplicates
+    
+    receipt.save()
+    return receipt
+
+
+def receipt_validation_status(validation_results, discrepancies):
+    """Map validation results to a Receipt.validation_status value"""
+    if validation_results['overall_valid'] and not duplicate_discrepancies(discrepancies):
+        return 'valid'
+    elif discrepancies:
+        return 'discrepancy'
+    return 'invalid'
+
+
+def duplicate_discrepancies(discrepancies):
+    """The 'possible_duplicate' entries of a discrepancy list"""
+    return [d for d in discrepancies or [] if d.get('type') == 'possible_duplicate']
+
+
+def _find_duplicates(document, document_type, text):
+    """Fingerprint an uploaded document and return likely duplicates; never fails the upload"""
+    try:
+        return fingerprint_document(document, document_type, text)
     except Exception as e:
-        # Log error but don't fail PO creation
-        print(f"Error generating PO PDF: {e}")
-        import traceback
-        traceback.print_exc()
+        print(f"Error checking for duplicate {document_type}: {e}")
+        return []
 
+
+def _index_text(document, document_type, text):
+    """Update a document's full-text search entry; never fails the extraction"""
+    try:
+        search.index_document(document, document_type, text)
+    except Exception as e:
+        print(f"Error indexing {document_type} text: {e}")
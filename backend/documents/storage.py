@@ -0,0 +1,151 @@
+"""
+Content-addressed storage for proforma, receipt and purchase order files.
+
+A file is stored once under the SHA-256 of its bytes, sharded by hash prefix
+(documents/blobs/ab/cd/abcd...ef.pdf), whatever it was called and however
+often it is uploaded. Saving a file whose bytes are already stored writes
+nothing; saving new bytes is one rename (streamed uploads) or one write.
+There are no name collisions, so Django's exists()/suffix loop never runs.
+
+A DocumentBlob row per stored file counts the documents that reference it;
+the file (and its text layer) is deleted when the last one goes. The
+client's filename is kept on the document as original_filename.
+"""
+import hashlib
+import os
+import tempfile
+from django.apps import apps
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .text_layer import layer_path
+
+BLOB_DIR = 'documents/blobs'
+
+# Bytes per read when hashing or copying content without a temporary file
+CHUNK_SIZE = 64 * 1024
+
+
+def blob_name(content_hash, extension):
+    """Storage name of the bytes with this hash, e.g. documents/blobs/ab/cd/abcd....pdf"""
+    return f'{BLOB_DIR}/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{extension.lower()}'
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_DIR + '/')
+
+
+def _content_hash(content):
+    """SHA-256 of a file, from the upload handler when it already computed it"""
+    content_hash = getattr(content, 'sha256', None)
+    if content_hash:
+        return content_hash
+    hasher = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks(CHUNK_SIZE):
+        hasher.update(chunk if isinstance(chunk, bytes) else chunk.encode())
+    content.seek(0)
+    return hasher.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that names files by content hash and counts references"""
+
+    def get_available_name(self, name, max_length=None):
+        # The final name depends on the content, not on what is already stored
+        return name
+
+    def _save(self, name, content):
+        content_hash = _content_hash(content)
+        name = blob_name(content_hash, os.path.splitext(name)[1])
+        # Count the reference first: a blob with references is never collected
+        self._add_reference(name, content_hash, content.size)
+
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            if hasattr(content, 'temporary_file_path'):
+                # Saving consumes a temporary file, as the rename would have
+                try:
+                    os.remove(content.temporary_file_path())
+                except FileNotFoundError:
+                    pass
+            return name
+
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        if hasattr(content, 'temporary_file_path'):
+            # Same bytes whoever wins a race, so overwriting is harmless
+            file_move_safe(content.temporary_file_path(), full_path, allow_overwrite=True)
+        else:
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    content.seek(0)
+                    for chunk in content.chunks(CHUNK_SIZE):
+                        f.write(chunk if isinstance(chunk, bytes) else chunk.encode())
+                os.replace(temp_path, full_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+    def _add_reference(self, name, content_hash, size):
+        DocumentBlob = apps.get_model('documents', 'DocumentBlob')
+        if DocumentBlob.objects.filter(name=name).update(refcount=F('refcount') + 1):
+            return
+        try:
+            with transaction.atomic():
+                DocumentBlob.objects.create(name=name, content_hash=content_hash, size=size, refcount=1)
+        except IntegrityError:
+            # Another upload of the same bytes created the row first
+            DocumentBlob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+    def release(self, name):
+        """Drop one reference to a stored file; the last one deletes it once the transaction commits"""
+        if not is_blob(name):
+            return
+        DocumentBlob = apps.get_model('documents', 'DocumentBlob')
+        DocumentBlob.objects.filter(name=name, refcount__gt=0).update(refcount=F('refcount') - 1)
+        transaction.on_commit(lambda: self.collect(name))
+
+    def collect(self, name):
+        """Delete a stored file if nothing references it any more"""
+        DocumentBlob = apps.get_model('documents', 'DocumentBlob')
+        with transaction.atomic():
+            # The row lock keeps a concurrent upload of the same bytes from reusing a file being deleted
+            deleted, _ = DocumentBlob.objects.filter(name=name, refcount=0).delete()
+            if not deleted:
+                return False
+            for path in (self.path(name), layer_path(self.path(name))):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return True
+
+
+document_storage = ContentAddressedStorage()
+
+
+def get_document_storage():
+    """Storage of document files (a callable so migrations don't serialize the instance)"""
+    return document_storage
+
+
+def release_document_file(sender, instance, **kwargs):
+    """post_delete: drop the deleted document's reference to its file"""
+    if instance.file:
+        document_storage.release(instance.file.name)
+
+
+def release_replaced_file(sender, instance, **kwargs):
+    """pre_save: drop the reference to a file that is being replaced"""
+    if instance.pk is None or not instance.file or instance.file._committed:
+        return
+    old_name = sender.objects.filter(pk=instance.pk).values_list('file', flat=True).first()
+    if old_name and old_name != instance.file.name:
+        document_storage.release(old_name)
@@ -0,0 +1,207 @@
+"""
+Live progress of extraction jobs.
+
+The document worker records each extraction step (pages read, text
+extracted, LLM started, fields parsed, validation done) as an
+ExtractionEvent. These async views follow that table and push new events to
+the client, as a server-sent event stream or as a long-poll fallback. Under
+ASGI a waiting client holds a coroutine, not a worker thread.
+
+EventSource cannot send headers, so browsers first POST to
+/api/jobs/{id}/events/token/ for a stream token: signed, bound to one user
+and one job, and valid for JOB_EVENTS_TOKEN_TTL seconds. Access tokens are
+never accepted in the URL, where they would end up in logs.
+"""
+import asyncio
+import json
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from users.models import User
+from .models import ExtractionEvent, ExtractionJob
+
+TERMINAL_STATUSES = ('completed', 'failed')
+
+# Events sent per database read
+EVENT_BATCH_SIZE = 100
+
+# Longest a long-poll request waits for new events, in seconds
+MAX_POLL_WAIT = 30
+
+
+STREAM_TOKEN_SALT = 'documents.job-events'
+
+
+def make_stream_token(user, job):
+    """Short-lived token that only lets this user follow this job's events"""
+    return signing.dumps({'user': user.pk, 'job': job.pk}, salt=STREAM_TOKEN_SALT)
+
+
+def _stream_token_user(token, pk):
+    """The user a stream token was issued to, if it is valid for job pk"""
+    try:
+        payload = signing.loads(token, salt=STREAM_TOKEN_SALT, max_age=settings.JOB_EVENTS_TOKEN_TTL)
+    except signing.BadSignature:
+        return None
+    if payload.get('job') != pk:
+        return None
+    return User.objects.filter(pk=payload.get('user'), is_active=True).first()
+
+
+def _authenticate(request, pk):
+    """The requesting user from a JWT header, a stream token for job pk (?stream_token=) or the session, or None"""
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        return None
+    if result is not None:
+        return result[0]
+    if request.GET.get('stream_token'):
+        return _stream_token_user(request.GET['stream_token'], pk)
+    user = request.user
+    return user if user.is_authenticated else None
+
+
+def _get_job(user, pk):
+    """The job with this id if the user may follow it, else None"""
+    if user.is_staff_role():
+        jobs = ExtractionJob.objects.filter(created_by=user)
+    elif user.is_approver() or user.is_finance():
+        jobs = ExtractionJob.objects.all()
+    else:
+        return None
+    return jobs.filter(pk=pk).first()
+
+
+def _event_data(event):
+    return {
+        'id': event.id,
+        'job': event.job_id,
+        'progress': event.progress,
+        'stage': event.stage,
+        'data': event.data,
+        'created_at': event.created_at,
+    }
+
+
+async def _events_after(job_id, last_id):
+    events = ExtractionEvent.objects.filter(job_id=job_id, id__gt=last_id).order_by('id')
+    return [event async for event in events[:EVENT_BATCH_SIZE]]
+
+
+async def _job_status(job_id):
+    return await ExtractionJob.objects.filter(pk=job_id).values_list('status', flat=True).afirst()
+
+
+async def _authorized_job(request, pk):
+    user = await sync_to_async(_authenticate)(request, pk)
+    if user is None:
+        return None, JsonResponse({'error': 'Authentication credentials were not provided'}, status=401)
+    job = await sync_to_async(_get_job)(user, pk)
+    if job is None:
+        return None, JsonResponse({'error': 'Job not found'}, status=404)
+    return job, None
+
+
+def _last_event_id(request, parameter):
+    try:
+        return int(request.headers.get('Last-Event-ID') or request.GET.get(parameter) or 0)
+    except ValueError:
+        return 0
+
+
+def _sse(data, event=None, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, cls=DjangoJSONEncoder)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+async def job_event_stream(request, pk):
+    """
+    GET /api/jobs/{id}/events/ - server-sent events for an extraction job.
+
+    Sends a `status` event with the job's current state, then a `progress`
+    event per extraction step and finally a `done` event, after which the
+    stream closes. Reconnecting clients resume from the Last-Event-ID header
+    (or ?after=). Authenticate with the usual Authorization header or, from
+    an EventSource, with ?stream_token= from POST /api/jobs/{id}/events/token/.
+    """
+    job, error = await _authorized_job(request, pk)
+    if error:
+        return error
+    last_id = _last_event_id(request, 'after')
+
+    async def stream():
+        nonlocal last_id
+        yield f'retry: {int(settings.JOB_EVENTS_POLL_INTERVAL * 1000)}\n\n'
+        yield _sse({'id': job.pk, 'status': job.status, 'progress': job.progress, 'stage': job.stage}, 'status')
+        started = last_sent = time.monotonic()
+        while True:
+            # Status first: events written before the job finished are then always read below
+            status = await _job_status(job.pk)
+            events = await _events_after(job.pk, last_id)
+            for event in events:
+                last_id = event.id
+                yield _sse(_event_data(event), 'progress', event.id)
+            if events:
+                last_sent = time.monotonic()
+                continue
+            if status in TERMINAL_STATUSES or status is None:
+                yield _sse({'id': job.pk, 'status': status}, 'done')
+                return
+
+            now = time.monotonic()
+            if now - started > settings.JOB_EVENTS_MAX_STREAM:
+                # Bounded streams let proxies recycle connections; the client reconnects with Last-Event-ID
+                return
+            if now - last_sent > settings.JOB_EVENTS_HEARTBEAT:
+                yield ': keepalive\n\n'
+                last_sent = now
+            await asyncio.sleep(settings.JOB_EVENTS_POLL_INTERVAL)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Tells nginx not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def job_event_poll(request, pk):
+    """
+    GET /api/jobs/{id}/events/poll/?after=<event id>&wait=<seconds> - long-poll fallback.
+
+    Returns as soon as there are events after `after` or the job has finished,
+    or with an empty list once `wait` seconds pass.
+    """
+    job, error = await _authorized_job(request, pk)
+    if error:
+        return error
+    last_id = _last_event_id(request, 'after')
+    try:
+        wait = min(float(request.GET.get('wait', MAX_POLL_WAIT)), MAX_POLL_WAIT)
+    except ValueError:
+        wait = MAX_POLL_WAIT
+
+    deadline = time.monotonic() + wait
+    while True:
+        status = await _job_status(job.pk)
+        events = await _events_after(job.pk, last_id)
+        if events or status in TERMINAL_STATUSES or time.monotonic() >= deadline:
+            break
+        await asyncio.sleep(settings.JOB_EVENTS_POLL_INTERVAL)
+
+    return JsonResponse({
+        'status': status,
+        'events': [_event_data(event) for event in events],
+        'last_event_id': events[-1].id if events else last_id,
+    })
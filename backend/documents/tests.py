@@ -1,3 +1,1379 @@
-from django.test import TestCase
+import hashlib
+import io
+import itertools
+import os
+import json
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from types import SimpleNamespace
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import openai
+import pypdfium2
+from reportlab.pdfgen import canvas
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.test import (
+    Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+from requests.models import PurchaseRequest, RequestItem
+from users.models import User
+from .document_processor import DocumentProcessor
+from .extraction_cache import ExtractionCache
+from .fingerprints import fingerprint_document
+from .exports import export_purchase_orders, parse_export_params
+from .benchmark import _RSSMonitor, build_corpus, compare_to_baseline, load_baseline, render_receipt, run_benchmark
+from . import extraction_cache, jobs, vendors
+from .jobs import _claimable_filter, claim_job, claim_next_job, prune_events_periodically, run_job
+from .line_matcher import assign, match_line_items
+from .llm_client import CircuitBreaker, LLMClient, LLMResponse, LLMUnavailable
+from .po_generator import po_render_context, render_po_pdf, render_queryset
+from .models import (
+    DocumentBlob, ExtractionCacheEntry, ExtractionJob, Proforma, PurchaseOrder, PurchaseOrderSequence, Receipt, VendorTemplate
+)
+from .prompt_builder import build_prompt_chunks, clean_lines, merge_partial_results
+from .rule_extractor import extract, extract_proforma
+from .search import index_document, search_documents
+from .sequences import allocate_po_number, next_value
+from .services import render_purchase_order_pdf
+from .storage import BLOB_DIR
+from .streams import _authenticate, make_stream_token
+from .text_layer import layer_path
+from .upload_handlers import StreamingHashUploadHandler
+from .vendor_templates import _apply_locator, _find_locator, apply_template, fingerprint
+from .vendors import VendorIndex, normalize_vendor_name, vendors_match
 
-# Create your tests here.
+
+class POSequenceTests(TestCase):
+    """PO numbers come from a per-day counter"""
+
+    def test_numbers_count_up_per_day(self):
+        day = date(2025, 10, 31)
+        self.assertEqual(allocate_po_number(day), 'PO-20251031-0001')
+        self.assertEqual(allocate_po_number(day), 'PO-20251031-0002')
+        self.assertEqual(allocate_po_number(date(2025, 11, 1)), 'PO-20251101-0001')
+        self.assertEqual(PurchaseOrderSequence.objects.get(day=day).last_value, 2)
+
+    def test_continues_from_existing_counter(self):
+        today = timezone.localdate()
+        PurchaseOrderSequence.objects.create(day=today, last_value=41)
+        user = User.objects.create_user(username='staff', password='p', role='staff')
+        request = PurchaseRequest.objects.create(title='Chairs', description='d', amount=10, created_by=user)
+        po = PurchaseOrder.objects.create(request=request, vendor_name='ACME', total_amount=10)
+        self.assertEqual(po.po_number, f"PO-{today:%Y%m%d}-0042")
+
+
+class ThreadedTestMixin:
+    """Helpers for tests that hit the database from several threads"""
+
+    def _in_thread(self, func):
+        def run(*args):
+            try:
+                return func(*args)
+            finally:
+                # Each thread has its own database connection; don't leak them
+                connections.close_all()
+        return run
+
+    def _skip_in_memory_sqlite(self):
+        # Threads share an in-memory SQLite database through a shared cache, which
+        # reports table locks instead of waiting; file databases and PostgreSQL wait
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('needs a database that serializes concurrent writers')
+
+
+class POSequenceConcurrencyTests(ThreadedTestMixin, TransactionTestCase):
+    """Concurrent allocations never hand out the same number"""
+
+    THREADS = 16
+    PER_THREAD = 25
+
+    def test_many_threads_get_distinct_consecutive_numbers(self):
+        self._skip_in_memory_sqlite()
+        day = date(2025, 10, 31)
+
+        def allocate(_):
+            return [next_value(day) for _ in range(self.PER_THREAD)]
+
+        with ThreadPoolExecutor(self.THREADS) as executor:
+            batches = list(executor.map(self._in_thread(allocate), range(self.THREADS)))
+
+        values = [value for batch in batches for value in batch]
+        total = self.THREADS * self.PER_THREAD
+        self.assertEqual(sorted(values), list(range(1, total + 1)))
+        for batch in batches:
+            # Each thread sees its own numbers strictly increasing
+            self.assertEqual(batch, sorted(batch))
+        self.assertEqual(PurchaseOrderSequence.objects.get(day=day).last_value, total)
+
+    def test_concurrent_purchase_orders_do_not_collide(self):
+        self._skip_in_memory_sqlite()
+        user = User.objects.create_user(username='staff', password='p', role='staff')
+        requests = [
+            PurchaseRequest.objects.create(title=f'Request {i}', description='d', amount=10, created_by=user)
+            for i in range(self.THREADS * 2)
+        ]
+
+        def create(request):
+            return PurchaseOrder.objects.create(request=request, vendor_name='ACME', total_amount=10).po_number
+
+        with ThreadPoolExecutor(self.THREADS) as executor:
+            numbers = list(executor.map(self._in_thread(create), requests))
+
+        self.assertEqual(len(set(numbers)), len(requests))
+        self.assertEqual(PurchaseOrder.objects.count(), len(requests))
+
+
+class PromptBuilderTests(TestCase):
+    """Prompt text keeps every item line and drops only page headers/footers"""
+
+    ITEMS = ['Cable 2mm 10 500', 'Cable 4mm 10 700', 'Cable 6mm 5 900']
+
+    def test_repeated_shape_item_rows_are_kept(self):
+        text = '\n'.join(['ACME Supplies', 'Description Qty Price'] + self.ITEMS + ['Total 2,500.00'])
+        chunks, stats = build_prompt_chunks(text, max_tokens=1000)
+        for line in self.ITEMS:
+            self.assertIn(line, chunks[0])
+        self.assertEqual(stats['dropped_lines'], 0)
+
+    def test_item_rows_are_kept_when_trimming_to_budget(self):
+        filler = [f'Clause {i}: the seller may change these conditions' for i in range(200)]
+        text = '\n'.join(['ACME Supplies'] * 30 + ['Terms and conditions'] + filler + self.ITEMS)
+        chunks, stats = build_prompt_chunks(text, max_tokens=150)
+        for line in self.ITEMS:
+            self.assertIn(line, chunks[0])
+        self.assertGreater(stats['dropped_lines'], 0)
+
+    def test_headers_and_footers_repeated_across_pages_are_dropped(self):
+        pages = [
+            'ACME Supplies Ltd\nKigali, Rwanda\nCable 2mm 10 500\nConfidential',
+            'ACME Supplies Ltd\nKigali, Rwanda\nCable 2mm 10 500\nConfidential',
+        ]
+        lines = clean_lines('\n'.join(pages), pages)
+        self.assertEqual(lines.count('ACME Supplies Ltd'), 1)
+        self.assertEqual(lines.count('Confidential'), 1)
+        # Lines with numbers are never treated as boilerplate
+        self.assertEqual(lines.count('Cable 2mm 10 500'), 2)
+
+    def test_nothing_is_dropped_without_page_texts(self):
+        text = 'Installation\nInstallation\nInstallation\nTotal 30.00'
+        self.assertEqual(clean_lines(text), ['Installation'] * 3 + ['Total 30.00'])
+
+    def test_identical_items_from_different_chunks_are_kept(self):
+        item = {'description': 'Cable 2mm', 'quantity': 10, 'unit_price': 50}
+        merged = merge_partial_results([
+            {'vendor_name': 'ACME', 'items_data': {'items': [item]}},
+            {'total_amount': 1000, 'items_data': {'items': [dict(item)]}},
+        ], 'proforma')
+        self.assertEqual(merged['items_data']['items'], [item, item])
+        self.assertEqual(merged['total_amount'], 1000)
+
+
+def layout_words(lines):
+    """Text layer words for (top, text) lines, laid out left to right on a 0-1 page"""
+    words = []
+    for top, text in lines:
+        x0 = 0.1
+        for part in text.split():
+            x1 = x0 + 0.012 * len(part)
+            words.append({'text': part, 'x0': x0, 'x1': x1, 'top': top, 'bottom': top + 0.01, '_top_pt': top * 800})
+            x0 = x1 + 0.01
+    return words
+
+
+class VendorTemplateTests(TestCase):
+    """Learned templates read the right field and only for the vendor that printed it"""
+
+    LEARNED = [(0.05, 'ACME Supplies Invoice'), (0.80, 'Sub Total 90.00'), (0.85, 'Total 100.00')]
+
+    def test_locator_matches_the_whole_label(self):
+        locator = _find_locator(layout_words(self.LEARNED), 'amount', 100.0)
+        self.assertEqual(locator['label'], 'total')
+        words = layout_words([(0.80, 'Sub Total 180.00'), (0.85, 'Total 200.00')])
+        self.assertEqual(_apply_locator(words, 'amount', locator), 200.0)
+
+    def test_repeated_label_resolves_to_the_learned_position(self):
+        locator = _find_locator(layout_words(self.LEARNED), 'amount', 100.0)
+        words = layout_words([(0.30, 'Total 50.00'), (0.86, 'Total 200.00')])
+        self.assertEqual(_apply_locator(words, 'amount', locator), 200.0)
+
+    def _template(self, layout):
+        locator = _find_locator(layout['last'], 'amount', 100.0)
+        return VendorTemplate.objects.create(
+            vendor_name='ACME Supplies',
+            document_type='proforma',
+            fingerprint=fingerprint(layout),
+            fields={
+                'vendor_name': 'ACME Supplies',
+                'vendor_address': 'Plot 12, Kigali',
+                'terms': 'Payment within 30 days',
+                'locators': {'total_amount': {'page': 'last', 'kind': 'amount', **locator}},
+            },
+        )
+
+    def test_template_requires_the_vendor_name_in_the_text(self):
+        words = layout_words(self.LEARNED)
+        layout = {'first': words, 'last': words}
+        self._template(layout)
+        self.assertIsNone(apply_template('', 'Globex Invoice\nTotal 100.00', 'proforma', layout))
+
+        result = apply_template('', 'ACME  supplies\nInvoice\nTotal 100.00', 'proforma', layout)
+        self.assertEqual(result['vendor_name'], 'ACME Supplies')
+        self.assertEqual(result['total_amount'], 100.0)
+        # Stored constants the document does not print are not returned
+        self.assertEqual(result['vendor_address'], '')
+        self.assertEqual(result['terms'], '')
+
+
+class ScriptedLLMHandler(BaseHTTPRequestHandler):
+    """Chat completions endpoint answering each request with the server's next scripted step"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            self.server.requests += 1
+            status, delay = self.server.script.pop(0) if self.server.script else (200, 0)
+        time.sleep(delay)
+        if status == 200:
+            body = {
+                'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': 'stub',
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': '{"vendor_name": "ACME"}'}}],
+                'usage': {'prompt_tokens': 12, 'completion_tokens': 5, 'total_tokens': 17},
+            }
+        else:
+            body = {'error': {'message': f'status {status}', 'type': 'server_error'}}
+        data = json.dumps(body).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out and hung up
+            pass
+
+
+class LLMClientTests(SimpleTestCase):
+    """LLMClient against a local stub server: retries, deadline and circuit breaker"""
+
+    MESSAGES = [{'role': 'user', 'content': 'Extract'}]
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ScriptedLLMHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.server.script = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def llm_client(self, script, **kwargs):
+        """A client for the stub server, which answers with (status, delay) steps then 200s"""
+        self.server.script = list(script)
+        client = LLMClient(api_key='stub', base_url=f'http://127.0.0.1:{self.server.server_port}/v1', **kwargs)
+        client._backoff = lambda attempt: 0
+        self.addCleanup(client.http_client.close)
+        return client
+
+    def test_retries_server_errors(self):
+        client = self.llm_client([(500, 0), (503, 0)], max_retries=2)
+        response = client.complete_json(self.MESSAGES)
+        self.assertEqual(json.loads(response.content), {'vendor_name': 'ACME'})
+        self.assertEqual((response.prompt_tokens, response.completion_tokens), (12, 5))
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(client.breaker.state, 'closed')
+
+    def test_retries_timeouts(self):
+        client = self.llm_client([(200, 1.0)], timeout=0.2, max_retries=1)
+        response = client.complete_json(self.MESSAGES)
+        self.assertEqual(json.loads(response.content), {'vendor_name': 'ACME'})
+        self.assertEqual(self.server.requests, 2)
+
+    def test_gives_up_after_max_retries(self):
+        client = self.llm_client([(500, 0)] * 3, max_retries=2)
+        with self.assertRaises(LLMUnavailable):
+            client.complete_json(self.MESSAGES)
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(client.breaker.failures, 1)
+
+    def test_client_errors_are_not_retried(self):
+        client = self.llm_client([(400, 0)], max_retries=2)
+        with self.assertRaises(openai.BadRequestError):
+            client.complete_json(self.MESSAGES)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_overall_deadline_bounds_retries(self):
+        client = self.llm_client([(200, 2.0)] * 10, timeout=0.3, deadline=0.5, max_retries=10)
+        started = time.monotonic()
+        with self.assertRaises(LLMUnavailable):
+            client.complete_json(self.MESSAGES)
+        # The second attempt only gets what is left of the deadline
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(self.server.requests, 2)
+
+    def test_circuit_breaker_opens_half_opens_and_closes(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+        client = self.llm_client([(500, 0), (500, 0)], max_retries=0, breaker=breaker)
+        for _ in range(2):
+            with self.assertRaises(LLMUnavailable):
+                client.complete_json(self.MESSAGES)
+        self.assertEqual(breaker.state, 'open')
+
+        # Open: rejected without a request
+        with self.assertRaisesMessage(LLMUnavailable, 'circuit breaker is open'):
+            client.complete_json(self.MESSAGES)
+        self.assertEqual(self.server.requests, 2)
+
+        now[0] = 30.0
+        self.assertEqual(breaker.state, 'half_open')
+        client.complete_json(self.MESSAGES)
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(self.server.requests, 3)
+
+    def test_failed_trial_call_reopens_the_circuit(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+        client = self.llm_client([(500, 0), (500, 0)], max_retries=0, breaker=breaker)
+        with self.assertRaises(LLMUnavailable):
+            client.complete_json(self.MESSAGES)
+        now[0] = 30.0
+        # Only one trial call is let through while half-open
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        now[0] = 59.0
+        with self.assertRaises(LLMUnavailable):
+            client.complete_json(self.MESSAGES)
+        self.assertEqual(self.server.requests, 1)
+
+
+class BenchmarkTests(SimpleTestCase):
+    """The extraction benchmark holds the stored baseline and measures memory per stage"""
+
+    def test_rules_and_rendering_meet_the_baseline(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        corpus = build_corpus(directory, 4)
+        results = run_benchmark(corpus, ['rules', 'po_render'])
+        # Timings depend on the machine; the command checks them
+        self.assertEqual(compare_to_baseline(results, load_baseline(), max_slowdown=None), [])
+
+    def test_regressions_are_reported(self):
+        baseline = {'count': 20, 'seed': 0, 'stages': {
+            'rules': {'accuracy': {'vendor_name': 1.0, 'total_amount': 1.0}, 'p95_ms': 1.0, 'errors': 0},
+        }}
+        result = {
+            'stage': 'rules', 'skipped': '', 'errors': 1, 'p95_ms': 5.0,
+            'accuracy': {'vendor_name': 0.99, 'total_amount': 0.9},
+        }
+        failures = compare_to_baseline([result], baseline)
+        self.assertEqual(len(failures), 3)
+        self.assertIn('total_amount accuracy 0.9', failures[0])
+        self.assertIn('1 errors', failures[1])
+        self.assertIn('p95 5.0ms', failures[2])
+        self.assertEqual(len(compare_to_baseline([result], baseline, max_slowdown=None)), 2)
+
+    def test_memory_is_measured_per_stage(self):
+        memory = _RSSMonitor().start()
+        if memory.start_mb is None:
+            self.skipTest('RSS is only measured where /proc is available')
+        data = bytearray(64 * 1024 * 1024)
+        growth = memory.stop()
+        del data
+        self.assertGreater(growth, 48)
+        # A later stage starts from its own baseline, not the process high-water mark
+        self.assertLess(_RSSMonitor().start().stop(), 16)
+
+
+@override_settings(DOCUMENT_JOB_TIMEOUT=300, DOCUMENT_JOB_MAX_ATTEMPTS=3)
+class JobClaimTests(TestCase):
+    """Workers reclaim jobs whose heartbeat stopped, and only those"""
+
+    def _running(self, seconds_since_heartbeat, attempts=1):
+        beat = timezone.now() - timedelta(seconds=seconds_since_heartbeat)
+        return ExtractionJob.objects.create(
+            job_type='proforma_extraction', status='running', worker='w1',
+            started_at=beat, heartbeat_at=beat, attempts=attempts,
+        )
+
+    def test_running_job_with_a_recent_heartbeat_is_not_claimed(self):
+        self._running(60)
+        self.assertIsNone(claim_next_job('w2'))
+
+    def test_stale_job_is_reclaimed(self):
+        job = self._running(301)
+        claimed = claim_next_job('w2')
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual((claimed.worker, claimed.attempts), ('w2', 2))
+        # Claiming refreshed the heartbeat, so nobody else takes it
+        self.assertIsNone(claim_next_job('w3'))
+
+    def test_stale_job_out_of_attempts_fails(self):
+        job = self._running(301, attempts=3)
+        self.assertIsNone(claim_next_job('w2'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+    def test_reclaimed_job_keeps_the_new_workers_outcome(self):
+        job = self._running(301)
+        stale_run = ExtractionJob.objects.get(pk=job.pk)
+
+        def failing_step(job, processor):
+            # Meanwhile the job went stale and another worker took it over
+            claim_next_job('w2')
+            raise RuntimeError('late failure')
+
+        with mock.patch.dict('documents.jobs.JOB_HANDLERS', {'proforma_extraction': failing_step}):
+            run_job(stale_run, SimpleNamespace(on_event=None))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.error, job.finished_at), ('running', 'w2', '', None))
+        self.assertFalse(job.events.exists())
+
+    def test_finished_job_is_not_claimed(self):
+        job = ExtractionJob.objects.create(job_type='proforma_extraction', status='completed')
+        self.assertIsNone(claim_job(job.pk, 'w1', _claimable_filter()))
+
+
+class JobConcurrencyTests(ThreadedTestMixin, TransactionTestCase):
+    """Racing workers never run the same job twice"""
+
+    THREADS = 8
+
+    def test_only_one_worker_claims_a_job(self):
+        self._skip_in_memory_sqlite()
+        job = ExtractionJob.objects.create(job_type='proforma_extraction')
+
+        def claim(worker):
+            return claim_job(job.pk, worker, _claimable_filter())
+
+        with ThreadPoolExecutor(self.THREADS) as executor:
+            claimed = list(executor.map(self._in_thread(claim), [f'w{i}' for i in range(self.THREADS)]))
+
+        winners = [result for result in claimed if result is not None]
+        self.assertEqual(len(winners), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.worker, job.attempts), (winners[0].worker, 1))
+
+    def test_workers_claim_distinct_jobs(self):
+        self._skip_in_memory_sqlite()
+        queued = [ExtractionJob.objects.create(job_type='proforma_extraction') for _ in range(self.THREADS)]
+
+        with ThreadPoolExecutor(self.THREADS) as executor:
+            claimed = list(executor.map(self._in_thread(claim_next_job), [f'w{i}' for i in range(self.THREADS)]))
+
+        self.assertEqual(sorted(job.pk for job in claimed if job), [job.pk for job in queued])
+
+    @override_settings(DOCUMENT_JOB_TIMEOUT=0.3, DOCUMENT_JOB_HEARTBEAT_INTERVAL=0.05)
+    def test_heartbeat_keeps_a_long_step_from_being_reclaimed(self):
+        self._skip_in_memory_sqlite()
+        ExtractionJob.objects.create(job_type='proforma_extraction')
+        job = claim_next_job('w1')
+        reclaimed = []
+
+        def long_step(job, processor):
+            # One slow step with no progress reports, longer than the timeout
+            time.sleep(1.0)
+            reclaimed.append(claim_next_job('w2'))
+
+        with mock.patch.dict('documents.jobs.JOB_HANDLERS', {'proforma_extraction': long_step}):
+            run_job(job, SimpleNamespace(on_event=None))
+
+        self.assertEqual(reclaimed, [None])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.attempts), ('completed', 'w1', 1))
+
+
+class JobEventStreamAuthTests(TestCase):
+    """Event streams take a short-lived per-job token in the URL, never an access token"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='staff', password='p', role='staff')
+        self.job = ExtractionJob.objects.create(job_type='proforma_extraction', created_by=self.user)
+        self.other_job = ExtractionJob.objects.create(job_type='proforma_extraction', created_by=self.user)
+        self.factory = RequestFactory()
+
+    def _request(self, **params):
+        request = self.factory.get(f'/api/jobs/{self.job.pk}/events/', params)
+        request.user = AnonymousUser()
+        return request
+
+    def test_stream_token_opens_only_its_job(self):
+        token = make_stream_token(self.user, self.job)
+        self.assertEqual(_authenticate(self._request(stream_token=token), self.job.pk), self.user)
+        self.assertIsNone(_authenticate(self._request(stream_token=token), self.other_job.pk))
+        self.assertIsNone(_authenticate(self._request(stream_token=token + 'x'), self.job.pk))
+
+    @override_settings(JOB_EVENTS_TOKEN_TTL=-1)
+    def test_expired_stream_token_is_rejected(self):
+        token = make_stream_token(self.user, self.job)
+        self.assertIsNone(_authenticate(self._request(stream_token=token), self.job.pk))
+
+    def test_access_token_in_the_url_is_rejected(self):
+        access = str(RefreshToken.for_user(self.user).access_token)
+        self.assertIsNone(_authenticate(self._request(token=access), self.job.pk))
+        self.assertIsNone(_authenticate(self._request(stream_token=access), self.job.pk))
+
+    def test_token_endpoint_is_limited_to_visible_jobs(self):
+        client = Client()
+        client.force_login(self.user)
+        response = client.post(f'/api/jobs/{self.job.pk}/events/token/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(_authenticate(self._request(stream_token=response.json()['token']), self.job.pk), self.user)
+
+        other = User.objects.create_user(username='other', password='p', role='staff')
+        client.force_login(other)
+        self.assertEqual(client.post(f'/api/jobs/{self.job.pk}/events/token/').status_code, 404)
+
+
+class EventPruneTests(TestCase):
+    """Expired events are deleted periodically, not after every job"""
+
+    @override_settings(JOB_EVENTS_PRUNE_INTERVAL=3600, JOB_EVENTS_TTL=60)
+    def test_prunes_at_most_once_per_interval(self):
+        old = ExtractionJob.objects.create(
+            job_type='proforma_extraction', status='completed', finished_at=timezone.now() - timedelta(hours=1)
+        )
+        old.report_progress(50, 'text extracted')
+        with mock.patch.object(jobs, '_last_prune', None):
+            self.assertEqual(prune_events_periodically(), 1)
+            old.report_progress(60, 'fields parsed')
+            with self.assertNumQueries(0):
+                self.assertEqual(prune_events_periodically(), 0)
+        self.assertEqual(old.events.count(), 1)
+
+
+_media_root = tempfile.mkdtemp(prefix='documents-tests-')
+
+
+@override_settings(MEDIA_ROOT=_media_root, DOCUMENT_PREVIEW_DIR=_media_root + '/previews')
+class PurchaseOrderExportTests(TestCase):
+    """A PO that fails to export never corrupts the archive"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(_media_root, ignore_errors=True)
+
+    def setUp(self):
+        user = User.objects.create_user(username='staff', password='p', role='staff')
+        self.purchase_orders = []
+        for index in range(3):
+            request = PurchaseRequest.objects.create(title=f'Request {index}', description='d', amount=10, created_by=user)
+            RequestItem.objects.create(request=request, description='Chair', quantity=1, unit_price=10)
+            self.purchase_orders.append(
+                PurchaseOrder.objects.create(request=request, vendor_name='ACME', total_amount=10, items_data={})
+            )
+        render_purchase_order_pdf(self.purchase_orders[0])
+        # The second PO's stored file has gone missing
+        PurchaseOrder.objects.filter(pk=self.purchase_orders[1].pk).update(file='documents/blobs/00/00/missing.pdf')
+
+    def _export(self, output, processes=1):
+        count, chunks = export_purchase_orders(
+            PurchaseOrder.objects.all(), parse_export_params({'output': output}), processes=processes
+        )
+        return count, b''.join(chunks)
+
+    def _assert_zip_has_error_entry(self, data):
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertIsNone(archive.testzip())
+        missing = self.purchase_orders[1].po_number
+        self.assertEqual(sorted(archive.namelist()), sorted([
+            f'PO_{self.purchase_orders[0].po_number}.pdf',
+            f'PO_{missing}.error.txt',
+            f'PO_{self.purchase_orders[2].po_number}.pdf',
+        ]))
+        self.assertIn(b'could not be exported', archive.read(f'PO_{missing}.error.txt'))
+
+    def test_zip_gets_an_error_entry_for_a_failed_po(self):
+        count, data = self._export('zip')
+        self.assertEqual(count, 3)
+        self._assert_zip_has_error_entry(data)
+
+    def test_pool_failures_become_error_entries(self):
+        # A thread pool stands in for the process pool; failures come back from future.result()
+        with ThreadPoolExecutor(2) as executor, mock.patch('documents.exports.get_executor', return_value=executor):
+            _, data = self._export('zip', processes=2)
+        self._assert_zip_has_error_entry(data)
+
+    def test_merged_pdf_leaves_out_a_failed_po(self):
+        _, data = self._export('pdf')
+        self.assertEqual(len(pypdfium2.PdfDocument(data)), 2)
+
+
+class ExtractionCacheTests(TestCase):
+    """The cache stays within its size limit without summing the table on every put"""
+
+    def setUp(self):
+        patcher = mock.patch.multiple(extraction_cache, _estimated_total=None, _puts_since_sync=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _put(self, cache, index, size=300):
+        cache.put(f'{index:064x}', 'receipt', 'x' * size, 'v1')
+
+    def _sums(self, queries):
+        return [query for query in queries.captured_queries if 'SUM(' in query['sql'].upper()]
+
+    def test_puts_under_the_limit_do_not_sum_the_table(self):
+        cache = ExtractionCache(max_bytes=10000)
+        self._put(cache, 0)
+        with CaptureQueriesContext(connection) as queries:
+            for index in range(1, 10):
+                self._put(cache, index)
+        self.assertEqual(self._sums(queries), [])
+
+    def test_evicts_least_recently_used_entries_when_over_the_limit(self):
+        cache = ExtractionCache(max_bytes=1000)
+        for index in range(10):
+            self._put(cache, index)
+            total = sum(ExtractionCacheEntry.objects.values_list('size', flat=True))
+            self.assertLessEqual(total, 1000)
+        self.assertEqual(
+            sorted(ExtractionCacheEntry.objects.values_list('content_hash', flat=True)),
+            [f'{index:064x}' for index in (7, 8, 9)],
+        )
+
+    def test_resyncs_every_n_puts(self):
+        cache = ExtractionCache(max_bytes=10 ** 9)
+        with mock.patch.object(extraction_cache, 'EVICT_SYNC_PUTS', 5):
+            with CaptureQueriesContext(connection) as queries:
+                for index in range(12):
+                    self._put(cache, index)
+        # The first put and every fifth after it
+        self.assertEqual(len(self._sums(queries)), 3)
+
+
+class PORenderQueryTests(TestCase):
+    """Render contexts for any number of purchase orders cost a constant number of queries"""
+
+    def _purchase_orders(self, count):
+        staff = User.objects.create_user(username=f'staff{count}', password='p', role='staff')
+        level_1 = User.objects.create_user(username=f'approver1-{count}', password='p', role='approver_level_1')
+        level_2 = User.objects.create_user(username=f'approver2-{count}', password='p', role='approver_level_2')
+        pks = []
+        for index in range(count):
+            request = PurchaseRequest.objects.create(
+                title=f'Request {index}', description='d', amount=20, created_by=staff,
+                approved_by_level_1=level_1, approved_by_level_2=level_2, approved_at=timezone.now(),
+            )
+            RequestItem.objects.create(request=request, description='Chair', quantity=1, unit_price=10)
+            RequestItem.objects.create(request=request, description='Desk', quantity=1, unit_price=10)
+            pks.append(PurchaseOrder.objects.create(request=request, vendor_name='ACME', total_amount=20, items_data={}).pk)
+        return pks
+
+    def test_query_count_does_not_grow_with_purchase_orders(self):
+        for count in (2, 15):
+            pks = self._purchase_orders(count)
+            # One query for POs, requests and users, one for all their items
+            with self.assertNumQueries(2):
+                contexts = [po_render_context(po) for po in render_queryset().filter(pk__in=pks)]
+            with self.assertNumQueries(0):
+                pdfs = [render_po_pdf(context) for context in contexts]
+            self.assertEqual(len(pdfs), count)
+            self.assertTrue(all(pdf.startswith(b'%PDF') for pdf in pdfs))
+            self.assertEqual(len(contexts[0]['items']), 2)
+            self.assertEqual(len(contexts[0]['approvals']), 2)
+
+
+class RuleEngineTests(SimpleTestCase):
+    """Rule-based extraction scores each field and cross-checks the total"""
+
+    PROFORMA = (
+        'ACME Supplies Ltd\n12 KN 4 Ave, Kigali\nPROFORMA INVOICE\nDate: 2025-03-01\n'
+        'Chair  2  50.00  100.00\nDesk  1  200.00  200.00\n'
+        'Subtotal: 300.00\nVAT 18%: 54.00\nTotal: 354.00'
+    )
+
+    def test_consistent_totals_raise_confidence(self):
+        fields, confidence = extract(self.PROFORMA)
+        self.assertEqual((fields['subtotal'], fields['tax'], fields['total_amount']), (300.0, 54.0, 354.0))
+        self.assertEqual(len(fields['items']), 2)
+        self.assertEqual(confidence['total_amount'], 0.98)
+        self.assertEqual(confidence['items'], 0.95)
+
+        metadata = extract_proforma(self.PROFORMA)['extraction_metadata']
+        self.assertEqual((metadata['method'], metadata['confidence']), ('rule_engine', 'high'))
+        self.assertEqual(metadata['confidence_score'], 0.85)
+
+    def test_total_that_does_not_add_up_keeps_its_label_confidence(self):
+        text = self.PROFORMA.replace('Subtotal: 300.00\nVAT 18%: 54.00\n', '').replace('354.00', '500.00')
+        fields, confidence = extract(text)
+        self.assertEqual(fields['total_amount'], 500.0)
+        self.assertEqual(confidence['total_amount'], 0.9)
+        self.assertEqual(confidence['items'], 0.9)
+
+    def test_contradictory_total_lowers_confidence(self):
+        text = (
+            'ACME Supplies Ltd\nChair  4  90.00  360.00\n'
+            'Subtotal: 360.00\nVAT 18%: 64.80\nTotal: $999.80'
+        )
+        fields, confidence = extract(text)
+        self.assertEqual((fields['subtotal'], fields['tax'], fields['total_amount']), (360.0, 64.8, 999.8))
+        # The items still agree with the subtotal
+        self.assertEqual(confidence['items'], 0.95)
+        self.assertEqual(confidence['total_amount'], 0.3)
+        self.assertEqual(extract_proforma(text)['extraction_metadata']['confidence'], 'low')
+
+    def test_missing_total_is_inferred_with_low_confidence(self):
+        fields, confidence = extract('Kivu Office World Ltd\nSubtotal: 100.00\nTax: 18.00')
+        self.assertEqual((fields['total_amount'], confidence['total_amount']), (118.0, 0.7))
+
+        fields, confidence = extract('Kivu Office World Ltd\nChair  2  50.00  100.00\nDesk  1  20.00  20.00')
+        self.assertEqual((fields['total_amount'], confidence['total_amount']), (120.0, 0.5))
+
+    def test_missing_vendor_makes_the_result_low_confidence(self):
+        metadata = extract_proforma('Chair  2  50.00  100.00\nTotal: 100.00')['extraction_metadata']
+        self.assertEqual((metadata['confidence'], metadata['confidence_score']), ('low', 0.0))
+
+
+@override_settings(EXTRACTION_RULES_FIRST=True, EXTRACTION_RULES_MIN_CONFIDENCE=0.85, VENDOR_TEMPLATES_ENABLED=False)
+class RulesFirstExtractionTests(SimpleTestCase):
+    """Confident rule results skip the LLM; unsure ones go to it"""
+
+    def _processor(self, text):
+        processor = DocumentProcessor(use_cache=False)
+        processor.extract_text = lambda file_path: text
+        processor.llm_client = mock.Mock()
+        processor.llm_client.complete_json.return_value = LLMResponse(
+            content=json.dumps({'vendor_name': 'ACME Supplies Ltd', 'total_amount': 354.0}),
+            prompt_tokens=10, completion_tokens=5, elapsed_ms=1,
+        )
+        return processor
+
+    def test_confident_rules_skip_the_llm(self):
+        processor = self._processor(RuleEngineTests.PROFORMA)
+        result = processor.extract_proforma_data('quote.pdf')
+        processor.llm_client.complete_json.assert_not_called()
+        self.assertEqual(result['extraction_metadata']['method'], 'rule_engine')
+        self.assertEqual(result['total_amount'], 354.0)
+
+    def test_unsure_rules_go_to_the_llm(self):
+        processor = self._processor('Chair  2  50.00  100.00\nTotal: 354.00')
+        result = processor.extract_proforma_data('quote.pdf')
+        processor.llm_client.complete_json.assert_called_once()
+        self.assertEqual(result['vendor_name'], 'ACME Supplies Ltd')
+
+
+    def test_contradictory_total_goes_to_the_llm(self):
+        text = 'ACME Supplies Ltd\nChair  4  90.00  360.00\nSubtotal: 360.00\nVAT 18%: 64.80\nTotal: $999.80'
+        processor = self._processor(text)
+        processor.extract_proforma_data('quote.pdf')
+        processor.llm_client.complete_json.assert_called_once()
+
+class LineMatcherTests(SimpleTestCase):
+    """Receipt lines are paired with PO lines by a minimum-cost assignment"""
+
+    def _brute_force(self, cost):
+        rows, columns = cost.shape
+        if rows <= columns:
+            return min(sum(cost[i, j] for i, j in enumerate(perm)) for perm in itertools.permutations(range(columns), rows))
+        return min(sum(cost[i, j] for j, i in enumerate(perm)) for perm in itertools.permutations(range(rows), columns))
+
+    def test_assignment_is_optimal_where_greedy_is_not(self):
+        # Greedy takes the cheapest cell (0, 0) and is left with 100
+        cost = np.array([[1.0, 2.0], [2.0, 100.0]])
+        self.assertEqual(assign(cost), [(0, 1), (1, 0)])
+
+    def test_assignment_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        for shape in [(1, 1), (3, 3), (4, 6), (6, 4), (5, 5)]:
+            cost = rng.random(shape).round(3)
+            pairs = assign(cost)
+            self.assertEqual(len(pairs), min(shape))
+            self.assertEqual(len({i for i, _ in pairs}), len(pairs))
+            self.assertEqual(len({j for _, j in pairs}), len(pairs))
+            self.assertAlmostEqual(sum(cost[i, j] for i, j in pairs), self._brute_force(cost))
+
+    def test_lines_are_matched_and_discrepancies_reported(self):
+        po_items = [
+            {'description': 'Office chair', 'quantity': 4, 'unit_price': 50},
+            {'description': 'Standing desk', 'quantity': 1, 'unit_price': 300},
+            {'description': 'HDMI cable', 'quantity': 10, 'unit_price': 5},
+        ]
+        receipt_items = [
+            {'description': 'Standing Desk (oak)', 'quantity': 1, 'unit_price': 300},
+            {'description': 'Office chairs', 'quantity': 5, 'unit_price': 50},
+            {'description': 'Gift wrapping', 'quantity': 1, 'unit_price': 2},
+        ]
+        matches, discrepancies = match_line_items(receipt_items, po_items)
+        self.assertEqual(sorted((m['receipt_line'], m['po_line']) for m in matches), [(0, 1), (1, 0)])
+        types = sorted((d['type'], d.get('receipt_line'), d.get('po_line')) for d in discrepancies)
+        self.assertEqual(types, [
+            ('line_quantity_mismatch', 1, 0),
+            ('missing_line_item', None, 2),
+            ('unexpected_line_item', 2, None),
+        ])
+
+
+class VendorNameTests(TestCase):
+    """Vendor names are compared in a canonical form and suggested from a trigram index"""
+
+    def setUp(self):
+        # Each test builds the process-wide index from its own database
+        patcher = mock.patch.object(vendors, '_index', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_normalization(self):
+        self.assertEqual(normalize_vendor_name('ACME Ltd.'), 'acme')
+        self.assertEqual(normalize_vendor_name('Acme Limited'), 'acme')
+        self.assertEqual(normalize_vendor_name('Café Ünïon S.A.'), 'cafe union')
+        self.assertEqual(normalize_vendor_name('The Smith & Sons Co'), 'smith and sons')
+        # Suffixes are only stripped from the end and never down to nothing
+        self.assertEqual(normalize_vendor_name('Company Ltd'), 'company')
+        self.assertEqual(normalize_vendor_name('Limited Editions Inc'), 'limited editions')
+
+    def test_vendors_match(self):
+        self.assertTrue(vendors_match('ACME Ltd.', 'Acme Limited'))
+        self.assertTrue(vendors_match('Office Supplies Kigali', 'Office Suplies Kigali Ltd'))
+        self.assertFalse(vendors_match('ACME', 'ACME Office Furniture'))
+        self.assertFalse(vendors_match('', ''))
+
+    def test_index_lookup(self):
+        index = VendorIndex(['Acme Ltd', 'Kigali Office Supplies', 'Bright Stationery', 'ACME LIMITED'])
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.lookup('acme'), [('Acme Ltd', 1.0)])
+        suggestions = index.lookup('Kigali Ofice Suplies')
+        self.assertEqual(suggestions[0][0], 'Kigali Office Supplies')
+        self.assertLess(suggestions[0][1], 1.0)
+        self.assertEqual(index.lookup('zzzz'), [])
+        self.assertEqual(len(index.lookup('Acme Kigali Stationery', limit=2, threshold=0)), 2)
+
+    def test_suggestions_endpoint(self):
+        user = User.objects.create_user(username='staff', password='p', role='staff')
+        request = PurchaseRequest.objects.create(title='Chairs', description='d', amount=10, created_by=user)
+        PurchaseOrder.objects.create(request=request, vendor_name='Kigali Office Supplies Ltd', total_amount=10)
+        client = Client()
+        client.force_login(user)
+
+        response = client.get('/api/proformas/vendor-suggestions/', {'q': 'kigali ofice supplies'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['suggestions'][0]['vendor_name'], 'Kigali Office Supplies Ltd')
+
+        # Vendors saved after the index was built are suggested straight away
+        request = PurchaseRequest.objects.create(title='Paper', description='d', amount=10, created_by=user)
+        PurchaseOrder.objects.create(request=request, vendor_name='Bright Stationery', total_amount=10)
+        response = client.get('/api/proformas/vendor-suggestions/', {'q': 'Bright Stationery Inc'})
+        self.assertEqual(response.json()['suggestions'], [{'vendor_name': 'Bright Stationery', 'similarity': 1.0}])
+
+        self.assertEqual(client.get('/api/proformas/vendor-suggestions/').status_code, 400)
+
+
+RECEIPT = {
+    'vendor_name': 'ACME Supplies Ltd',
+    'date': '2025-03-01',
+    'items': [
+        {'description': 'Chair', 'quantity': 2, 'unit_price': 50.0, 'total': 100.0},
+        {'description': 'Desk', 'quantity': 1, 'unit_price': 200.0, 'total': 200.0},
+    ],
+    'total_amount': 300.0,
+}
+
+
+def receipt_text(truth):
+    lines = [truth['vendor_name'], '12 KN 4 Ave, Kigali', f"Date: {truth['date']}"]
+    lines += [f"{item['quantity']} x {item['description']} @ {item['unit_price']:.2f} {item['total']:.2f}" for item in truth['items']]
+    lines.append(f"TOTAL {truth['total_amount']:.2f}")
+    return '\n'.join(lines)
+
+
+@override_settings(MEDIA_ROOT=_media_root)
+class DuplicateDetectionTests(TestCase):
+    """Uploads are flagged when they look like a document already on file"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(_media_root, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='staff', password='p', role='staff')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def _receipt(self, truth, name, path=None):
+        if path is None:
+            path = f'{self.directory}/{name}.pdf'
+            render_receipt(truth, path)
+        request = PurchaseRequest.objects.create(title=name, description='d', amount=10, created_by=self.user)
+        receipt = Receipt(request=request)
+        with open(path, 'rb') as f:
+            receipt.file.save(f'{name}.pdf', File(f), save=True)
+        return receipt, fingerprint_document(receipt, 'receipt', receipt_text(truth))
+
+    def test_identical_file_is_flagged(self):
+        first, duplicates = self._receipt(RECEIPT, 'first')
+        self.assertEqual(duplicates, [])
+        # The same bytes uploaded again under another name
+        _, duplicates = self._receipt(RECEIPT, 'again', path=f'{self.directory}/first.pdf')
+        self.assertEqual(len(duplicates), 1)
+        self.assertEqual(duplicates[0]['type'], 'possible_duplicate')
+        self.assertEqual(duplicates[0]['duplicate_of'], first.pk)
+        self.assertEqual(duplicates[0]['request'], first.request_id)
+        self.assertEqual((duplicates[0]['match'], duplicates[0]['severity']), ('identical_file', 'high'))
+
+    def test_stored_content_hash_is_not_recomputed(self):
+        first, _ = self._receipt(RECEIPT, 'first')
+        # Rows without a hash get one stored the first time they are fingerprinted
+        self.assertEqual(Receipt.objects.get(pk=first.pk).content_hash, first.content_hash)
+        self.assertEqual(len(first.content_hash), 64)
+
+        request = PurchaseRequest.objects.create(title='again', description='d', amount=10, created_by=self.user)
+        receipt = Receipt(request=request, content_hash=first.content_hash)
+        with open(first.file.path, 'rb') as f:
+            receipt.file.save('again.pdf', File(f), save=True)
+        with mock.patch('documents.previews.file_sha256') as file_sha256:
+            duplicates = fingerprint_document(receipt, 'receipt', receipt_text(RECEIPT))
+        file_sha256.assert_not_called()
+        self.assertEqual(duplicates[0]['match'], 'identical_file')
+
+    def test_near_duplicate_is_flagged(self):
+        first, _ = self._receipt(RECEIPT, 'first')
+        edited = dict(RECEIPT, items=RECEIPT['items'] + [{'description': 'Bag', 'quantity': 1, 'unit_price': 0.5, 'total': 0.5}])
+        _, duplicates = self._receipt(edited, 'edited')
+        self.assertEqual([d['duplicate_of'] for d in duplicates], [first.pk])
+        self.assertIn(duplicates[0]['match'], ('text', 'text_and_image'))
+        self.assertGreaterEqual(duplicates[0]['text_similarity'], 0.8)
+
+    def test_different_documents_are_not_flagged(self):
+        self._receipt(RECEIPT, 'first')
+        other = dict(
+            RECEIPT, vendor_name='Kivu Office World', date='2025-07-09', total_amount=320.0,
+            items=[{'description': 'Toner cartridge', 'quantity': 4, 'unit_price': 80.0, 'total': 320.0}],
+        )
+        _, duplicates = self._receipt(other, 'other')
+        self.assertEqual(duplicates, [])
+
+    def test_only_documents_of_the_same_type_are_compared(self):
+        receipt, _ = self._receipt(RECEIPT, 'first')
+        request = PurchaseRequest.objects.create(title='proforma', description='d', amount=10, created_by=self.user)
+        proforma = Proforma(request=request)
+        with open(receipt.file.path, 'rb') as f:
+            proforma.file.save('first.pdf', File(f), save=True)
+        self.assertEqual(fingerprint_document(proforma, 'proforma', receipt_text(RECEIPT)), [])
+
+
+def pdf_bytes(*lines):
+    buffer = io.BytesIO()
+    page = canvas.Canvas(buffer)
+    for index, line in enumerate(lines):
+        page.drawString(100, 750 - 20 * index, line)
+    page.save()
+    return buffer.getvalue()
+
+
+@override_settings(
+    MEDIA_ROOT=_media_root,
+    DOCUMENT_UPLOAD_TEMP_DIR=_media_root + '/uploads/tmp',
+    DOCUMENT_PREVIEW_DIR=_media_root + '/previews',
+)
+class ChunkedUploadTests(TestCase):
+    """Large documents can be uploaded in chunks and resumed after a failure"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(_media_root, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='staff', password='p', role='staff')
+        self.request = PurchaseRequest.objects.create(title='Chairs', description='d', amount=10, created_by=self.user)
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.data = pdf_bytes('ACME Supplies Ltd', 'Total: $100.00')
+
+    def _start(self, size):
+        return self.client.post('/api/uploads/', {'filename': 'proforma.pdf', 'size': size}, content_type='application/json')
+
+    def _send(self, session_id, offset, chunk):
+        return self.client.patch(
+            f'/api/uploads/{session_id}/', chunk,
+            content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def test_upload_resumes_from_the_received_offset(self):
+        response = self._start(len(self.data))
+        self.assertEqual(response.status_code, 201)
+        session_id = response.json()['id']
+        half = len(self.data) // 2
+
+        self.assertEqual(self._send(session_id, 0, self.data[:half]).json()['offset'], half)
+        # A retried chunk from the wrong offset is refused with the offset to resume from
+        response = self._send(session_id, 0, self.data[half:])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], half)
+        self.assertEqual(self.client.get(f'/api/uploads/{session_id}/').json()['offset'], half)
+
+        response = self._send(session_id, half, self.data[half:])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'complete')
+        self.assertEqual(response.json()['content_hash'], hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(self._send(session_id, len(self.data), b'x').status_code, 409)
+
+        response = self.client.post('/api/proformas/', {'request': self.request.pk, 'upload': session_id})
+        self.assertEqual(response.status_code, 202)
+        proforma = Proforma.objects.get(request=self.request)
+        self.assertEqual(proforma.original_filename, 'proforma.pdf')
+        with proforma.file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(os.listdir(_media_root + '/uploads/tmp'), [])
+
+    def test_chunk_past_the_declared_size_is_refused(self):
+        session_id = self._start(10).json()['id']
+        self.assertEqual(self._send(session_id, 0, b'x' * 11).status_code, 400)
+        self.assertEqual(self.client.get(f'/api/uploads/{session_id}/').json()['offset'], 0)
+
+    def test_uploads_belong_to_their_owner(self):
+        session_id = self._start(len(self.data)).json()['id']
+        other = User.objects.create_user(username='other', password='p', role='staff')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(f'/api/uploads/{session_id}/').status_code, 404)
+        self.assertEqual(self._send(session_id, 0, self.data).status_code, 404)
+
+    def test_size_limit(self):
+        with self.settings(DOCUMENT_UPLOAD_MAX_SIZE=len(self.data) - 1):
+            self.assertEqual(self._start(len(self.data)).status_code, 400)
+            response = self.client.post(
+                '/api/proformas/',
+                {'request': self.request.pk, 'file': SimpleUploadedFile('proforma.pdf', self.data)},
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('too large', str(response.json()))
+        self.assertEqual(self._start(len(self.data)).status_code, 201)
+
+    def _post_streamed(self, data):
+        """Post a direct upload, returning the response and the bytes the handler was given"""
+        receive = StreamingHashUploadHandler.receive_data_chunk
+        with mock.patch.object(StreamingHashUploadHandler, 'receive_data_chunk', autospec=True, side_effect=receive) as spy:
+            response = self.client.post(
+                '/api/proformas/', {'request': self.request.pk, 'file': SimpleUploadedFile('scan.pdf', data)},
+            )
+        return response, sum(len(call.args[1]) for call in spy.call_args_list)
+
+    def test_oversized_upload_is_stopped_while_streaming(self):
+        data = b'%PDF-1.4\n' + os.urandom(1024 * 1024)
+        limit = 100 * 1024
+        with self.settings(DOCUMENT_UPLOAD_MAX_SIZE=limit):
+            response, received = self._post_streamed(data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['file'], ['File is too large'])
+        # Reading stops within one chunk of the limit, not at the end of the body
+        self.assertLessEqual(received, limit + StreamingHashUploadHandler.chunk_size)
+        self.assertFalse(Proforma.objects.exists())
+        self.assertEqual(os.listdir(_media_root + '/uploads/tmp'), [])
+
+        # A declared Content-Length over the request limit is refused before any file byte is read
+        with self.settings(DOCUMENT_BATCH_MAX_SIZE=limit):
+            response, received = self._post_streamed(data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(received, 0)
+
+
+@override_settings(
+    MEDIA_ROOT=_media_root,
+    DOCUMENT_UPLOAD_TEMP_DIR=_media_root + '/uploads/tmp',
+    DOCUMENT_PREVIEW_DIR=_media_root + '/previews',
+    DOCUMENT_BATCH_WORKERS=4,
+)
+class BatchUploadTests(ThreadedTestMixin, TransactionTestCase):
+    """A batch reports a result for every file, and one bad file never fails the rest"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(_media_root, ignore_errors=True)
+
+    def setUp(self):
+        self._skip_in_memory_sqlite()
+        self.user = User.objects.create_user(username='staff', password='p', role='staff')
+        self.requests = [
+            PurchaseRequest.objects.create(title=f'Request {index}', description='d', amount=10, created_by=self.user, status='approved')
+            for index in range(4)
+        ]
+        self.pending = PurchaseRequest.objects.create(title='Pending', description='d', amount=10, created_by=self.user)
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_files_get_one_result_each(self):
+        files = [SimpleUploadedFile(f'r{index}.pdf', pdf_bytes(f'Vendor {index}')) for index in range(3)]
+        files.append(SimpleUploadedFile('notes.txt', b'not a receipt'))
+        request_ids = [self.requests[0].pk, self.requests[1].pk, self.pending.pk, self.requests[2].pk]
+        response = self.client.post('/api/receipts/batch/', {'files': files, 'requests': request_ids})
+
+        self.assertEqual(response.status_code, 202)
+        body = response.json()
+        self.assertEqual((body['count'], body['accepted'], body['rejected']), (4, 2, 2))
+        results = body['results']
+        self.assertEqual([r['file'] for r in results], ['r0.pdf', 'r1.pdf', 'r2.pdf', 'notes.txt'])
+        self.assertEqual([r['request'] for r in results], [str(pk) for pk in request_ids])
+        self.assertEqual([r['status'] for r in results], ['queued', 'queued', 'rejected', 'rejected'])
+        self.assertIn('approved requests', results[2]['error'])
+        self.assertIn('Unsupported file type', str(results[3]['error']))
+
+        receipts = Receipt.objects.order_by('request_id')
+        self.assertEqual([r.pk for r in receipts], [results[0]['receipt'], results[1]['receipt']])
+        self.assertEqual(
+            sorted(ExtractionJob.objects.values_list('receipt_id', flat=True)),
+            sorted(r['receipt'] for r in results[:2]),
+        )
+        self.assertTrue(all(r['job']['status'] == 'queued' for r in results[:2]))
+
+    def test_archive_members_are_mapped_by_folder_or_manifest(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr(f'{self.requests[0].pk}/a.pdf', pdf_bytes('Vendor A'))
+            zf.writestr('b.pdf', pdf_bytes('Vendor B'))
+            zf.writestr('c.pdf', pdf_bytes('Vendor C'))
+            zf.writestr('__MACOSX/._a.pdf', b'resource fork')
+            zf.writestr('manifest.json', json.dumps({'b.pdf': self.requests[1].pk}))
+        response = self.client.post('/api/receipts/batch/', {'archive': SimpleUploadedFile('batch.zip', archive.getvalue())})
+
+        self.assertEqual(response.status_code, 202)
+        results = {r['file']: r for r in response.json()['results']}
+        self.assertEqual(set(results), {f'{self.requests[0].pk}/a.pdf', 'b.pdf', 'c.pdf'})
+        self.assertEqual(results[f'{self.requests[0].pk}/a.pdf']['status'], 'queued')
+        self.assertEqual(results['b.pdf']['request'], self.requests[1].pk)
+        self.assertEqual(results['b.pdf']['status'], 'queued')
+        self.assertEqual(results['c.pdf']['status'], 'rejected')
+        self.assertEqual(results['c.pdf']['error'], 'No purchase request given for this file')
+        self.assertEqual(Receipt.objects.count(), 2)
+        self.assertEqual(os.listdir(_media_root + '/uploads/tmp'), [])
+
+    def test_unusable_batches_are_refused(self):
+        response = self.client.post('/api/receipts/batch/', {'archive': SimpleUploadedFile('batch.zip', b'not a zip')})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'archive is not a valid zip file')
+
+        # Nothing accepted: still one result per file
+        response = self.client.post('/api/receipts/batch/', {
+            'files': [SimpleUploadedFile('r.pdf', pdf_bytes('Vendor'))], 'requests': [self.pending.pk],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['rejected'], 1)
+        self.assertFalse(Receipt.objects.exists())
+
+        with self.settings(DOCUMENT_BATCH_MAX_SIZE=1024):
+            archive = SimpleUploadedFile('batch.zip', b'PK\x03\x04' + os.urandom(64 * 1024))
+            response = self.client.post('/api/receipts/batch/', {'archive': archive})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'File is too large')
+
+
+class DocumentSearchTests(TestCase):
+    """Search ranks matches in the index and only shows staff their own requests"""
+
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', password='p', role='staff')
+        self.other_staff = User.objects.create_user(username='other', password='p', role='staff')
+        self.client = Client()
+        self.documents = {}
+        for name, owner, text in [
+            ('toner', self.staff, 'Toner cartridge 4471-B x4. Toner for the second floor printer. Spare toner.'),
+            ('printer', self.staff, 'Laser printer with one toner cartridge included, delivery and installation on site'),
+            ('chairs', self.staff, 'Office chairs, ergonomic, black'),
+            ('other', self.other_staff, 'Toner cartridge 4471-B for the finance office'),
+        ]:
+            request = PurchaseRequest.objects.create(title=name, description='d', amount=10, created_by=owner)
+            purchase_order = PurchaseOrder.objects.create(request=request, vendor_name='ACME', total_amount=10)
+            index_document(purchase_order, 'purchase_order', text)
+            self.documents[name] = purchase_order
+
+    def _titles(self, results):
+        return [result['request_title'] for result in results]
+
+    def test_results_are_ranked(self):
+        results = search_documents('toner')
+        self.assertEqual(set(self._titles(results)), {'toner', 'printer', 'other'})
+        self.assertEqual(results[0]['request_title'], 'toner')
+        ranks = [result['rank'] for result in results]
+        self.assertEqual(ranks, sorted(ranks, reverse=True))
+        self.assertEqual(self._titles(search_documents('toner', limit=1)), ['toner'])
+
+    def test_every_term_must_match(self):
+        self.assertEqual(set(self._titles(search_documents('toner 4471-B'))), {'toner', 'other'})
+        self.assertEqual(search_documents('toner chairs'), [])
+        result = search_documents('chairs')[0]
+        self.assertEqual((result['type'], result['id']), ('purchase_order', self.documents['chairs'].pk))
+        self.assertIn('<mark>chairs</mark>', result['snippet'].lower())
+
+    def test_owner_and_type_filters(self):
+        self.assertEqual(set(self._titles(search_documents('4471-B', owner=self.staff))), {'toner'})
+        self.assertEqual(search_documents('toner', document_types=['proforma', 'receipt']), [])
+
+    def test_results_depend_on_role(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/search/', {'q': '4471-B'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._titles(response.json()['results']), ['toner'])
+
+        for role in ('approver_level_1', 'approver_level_2', 'finance'):
+            self.client.force_login(User.objects.create_user(username=role, password='p', role=role))
+            results = self.client.get('/api/search/', {'q': '4471-B'}).json()['results']
+            self.assertEqual(set(self._titles(results)), {'toner', 'other'})
+
+    def test_invalid_queries(self):
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get('/api/search/').status_code, 400)
+        self.assertEqual(self.client.get('/api/search/', {'q': 'toner', 'type': 'invoice'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/search/', {'q': 'toner', 'limit': 'ten'}).status_code, 400)
+
+
+@override_settings(MEDIA_ROOT=_media_root, DOCUMENT_PREVIEW_DIR=_media_root + '/previews', DOCUMENT_JOBS_INLINE=False)
+class PurchaseOrderRenderTests(TestCase):
+    """Approval only queues the PO PDF; the worker or the first download renders it"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(_media_root, ignore_errors=True)
+
+    def setUp(self):
+        staff = User.objects.create_user(username='staff', password='p', role='staff')
+        self.request = PurchaseRequest.objects.create(title='Chairs', description='d', amount=100, created_by=staff)
+        RequestItem.objects.create(request=self.request, description='Chair', quantity=2, unit_price=50)
+        self.client = Client()
+        self.renders = mock.patch('documents.services.render_po_pdf', wraps=render_po_pdf)
+        self.render = self.renders.start()
+        self.addCleanup(self.renders.stop)
+
+    def _approve(self):
+        for role in ('approver_level_1', 'approver_level_2'):
+            self.client.force_login(User.objects.create_user(username=role, password='p', role=role))
+            response = self.client.patch(f'/api/requests/{self.request.pk}/approve/', content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+        self.request.refresh_from_db()
+        return self.request.purchase_order
+
+    def test_approval_queues_the_render(self):
+        purchase_order = self._approve()
+        self.assertEqual(self.request.status, 'approved')
+        self.assertFalse(purchase_order.file)
+        self.render.assert_not_called()
+        self.assertEqual(
+            list(purchase_order.jobs.values_list('job_type', 'status')), [('purchase_order_render', 'queued')]
+        )
+
+        run_job(claim_next_job('w1'))
+        purchase_order.refresh_from_db()
+        self.assertTrue(purchase_order.file)
+        self.assertEqual(purchase_order.jobs.get().status, 'completed')
+        self.assertEqual(self.render.call_count, 1)
+
+    def test_download_renders_once_when_missing(self):
+        purchase_order = self._approve()
+        response = self.client.get(self.client.get(f'/api/purchase-orders/{purchase_order.pk}/').json()['download_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content)[:5], b'%PDF-')
+        self.assertIn(f'PO_{purchase_order.po_number}.pdf', response['Content-Disposition'])
+        self.assertEqual(self.render.call_count, 1)
+
+        # The queued job and later downloads reuse the stored file
+        run_job(claim_next_job('w1'))
+        response = self.client.get(f'/api/purchase-orders/{purchase_order.pk}/download/')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+        self.assertEqual(self.render.call_count, 1)
+
+
+@override_settings(MEDIA_ROOT=_media_root, DOCUMENT_PREVIEW_DIR=_media_root + '/previews')
+class ContentAddressedStorageTests(TestCase):
+    """Identical bytes are stored once and deleted with their last document"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(_media_root, ignore_errors=True)
+
+    def setUp(self):
+        user = User.objects.create_user(username='staff', password='p', role='staff')
+        self.request = PurchaseRequest.objects.create(title='Chairs', description='d', amount=10, created_by=user)
+        self.data = pdf_bytes('ACME Supplies Ltd', 'Total: $100.00')
+
+    def _receipt(self, name, data=None):
+        receipt = Receipt(request=self.request)
+        receipt.file.save(name, ContentFile(data or self.data), save=True)
+        return receipt
+
+    def test_identical_bytes_share_one_file(self):
+        first = self._receipt('quote.pdf')
+        second = self._receipt('quote copy.pdf')
+        self.assertEqual(first.file.name, second.file.name)
+        content_hash = hashlib.sha256(self.data).hexdigest()
+        self.assertEqual(first.file.name, f'{BLOB_DIR}/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}.pdf')
+        blob = DocumentBlob.objects.get()
+        self.assertEqual((blob.refcount, blob.size), (2, len(self.data)))
+        self.assertEqual(len(os.listdir(os.path.dirname(first.file.path))), 1)
+
+        self._receipt('other.pdf', pdf_bytes('Another vendor'))
+        self.assertEqual(sorted(DocumentBlob.objects.values_list('refcount', flat=True)), [1, 2])
+
+    def test_last_delete_frees_the_file(self):
+        first = self._receipt('quote.pdf')
+        second = self._receipt('quote copy.pdf')
+        path = first.file.path
+        with open(layer_path(path), 'wb') as f:
+            f.write(b'layer')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(DocumentBlob.objects.get().refcount, 1)
+        self.assertTrue(os.path.exists(path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(DocumentBlob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(layer_path(path)))
+
+    def test_replacing_a_file_releases_the_old_one(self):
+        receipt = self._receipt('quote.pdf')
+        old_path = receipt.file.path
+        with self.captureOnCommitCallbacks(execute=True):
+            receipt.file = ContentFile(pdf_bytes('Corrected quote'), name='quote v2.pdf')
+            receipt.save()
+        self.assertFalse(os.path.exists(old_path))
+        self.assertEqual(list(DocumentBlob.objects.values_list('name', 'refcount')), [(receipt.file.name, 1)])
+
+    def test_compact_command_moves_legacy_files_and_fixes_counts(self):
+        legacy_dir = os.path.join(_media_root, 'documents/receipts/2025/01/01')
+        os.makedirs(legacy_dir, exist_ok=True)
+        for index in range(2):
+            with open(os.path.join(legacy_dir, f'old{index}.pdf'), 'wb') as f:
+                f.write(self.data)
+            Receipt.objects.create(request=self.request, file=f'documents/receipts/2025/01/01/old{index}.pdf')
+        call_command('compact_document_storage', stdout=io.StringIO(), stderr=io.StringIO())
+
+        names = set(Receipt.objects.values_list('file', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names.pop().startswith(BLOB_DIR + '/'))
+        self.assertEqual(sorted(Receipt.objects.values_list('original_filename', flat=True)), ['old0.pdf', 'old1.pdf'])
+        self.assertEqual(DocumentBlob.objects.get().refcount, 2)
+        self.assertEqual(os.listdir(legacy_dir), [])
+
+        DocumentBlob.objects.update(refcount=5)
+        call_command('compact_document_storage', stdout=io.StringIO())
+        self.assertEqual(DocumentBlob.objects.get().refcount, 2)
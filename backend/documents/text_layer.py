@@ -0,0 +1,145 @@
+"""
+Persisted per-page text layer of a document.
+
+Extraction reads each page once (the PDF text layer, or OCR for scans and
+images) and stores the page texts with every word's bounding box and
+confidence in a compressed columnar file next to the document
+(<file>.layer.npz). Re-extraction, vendor templates and new rule or prompt
+versions read this layer instead of parsing or OCR'ing the source again.
+
+This module does not touch Django models so it is safe to import in pool
+worker processes.
+"""
+import os
+import tempfile
+import numpy as np
+
+# Bump when the stored arrays or how they are produced change
+LAYER_VERSION = 1
+LAYER_SUFFIX = '.layer.npz'
+
+# Confidence recorded for words read from a PDF text layer
+NATIVE_CONFIDENCE = 100
+
+SOURCES = ('pdf', 'ocr')
+
+
+class LayerPage:
+    """
+    Text and words of one page.
+
+    words are (text, x0, top, x1, bottom, confidence) tuples with the box as
+    fractions of the page width/height and confidence 0-100 (-1 if unknown).
+    width and height are in PDF points, or pixels for images.
+    """
+
+    def __init__(self, text, width, height, words=(), source='pdf'):
+        self.text = text
+        self.width = width
+        self.height = height
+        self.words = list(words)
+        self.source = source
+
+
+def _pack_strings(strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded], dtype=np.uint64)
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(blob, offsets, start=0, stop=None):
+    data = blob.tobytes()
+    stop = len(offsets) - 1 if stop is None else stop
+    return [data[int(offsets[i]):int(offsets[i + 1])].decode('utf-8') for i in range(start, stop)]
+
+
+class TextLayer:
+    """Columnar text layer of a whole document; pages are decoded on demand"""
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.page_texts = _unpack_strings(arrays['page_text'], arrays['page_text_offsets'])
+
+    @classmethod
+    def from_pages(cls, pages):
+        words = [word for page in pages for word in page.words]
+        page_text, page_text_offsets = _pack_strings([page.text for page in pages])
+        word_text, word_text_offsets = _pack_strings([word[0] for word in words])
+        page_word_offsets = np.zeros(len(pages) + 1, dtype=np.uint64)
+        page_word_offsets[1:] = np.cumsum([len(page.words) for page in pages], dtype=np.uint64)
+        return cls({
+            'version': np.array(LAYER_VERSION),
+            'page_text': page_text,
+            'page_text_offsets': page_text_offsets,
+            'page_size': np.array([(page.width, page.height) for page in pages], dtype=np.float32).reshape(-1, 2),
+            'page_source': np.array([SOURCES.index(page.source) for page in pages], dtype=np.uint8),
+            'page_word_offsets': page_word_offsets,
+            'word_text': word_text,
+            'word_text_offsets': word_text_offsets,
+            'word_box': np.array([word[1:5] for word in words], dtype=np.float32).reshape(-1, 4),
+            'word_confidence': np.array([word[5] for word in words], dtype=np.int8),
+        })
+
+    def __len__(self):
+        return len(self.page_texts)
+
+    @property
+    def text(self):
+        """Document text, joined the same way as DocumentProcessor.extract_text_from_pdf"""
+        return ''.join(text + "\n" for text in self.page_texts if text)
+
+    def page(self, index):
+        """LayerPage for a page index (negative indexes count from the end)"""
+        index = range(len(self))[index]
+        start = int(self.arrays['page_word_offsets'][index])
+        stop = int(self.arrays['page_word_offsets'][index + 1])
+        texts = _unpack_strings(self.arrays['word_text'], self.arrays['word_text_offsets'], start, stop)
+        boxes = self.arrays['word_box'][start:stop].tolist()
+        confidences = self.arrays['word_confidence'][start:stop].tolist()
+        width, height = self.arrays['page_size'][index].tolist()
+        words = [(text, *box, confidence) for text, box, confidence in zip(texts, boxes, confidences)]
+        return LayerPage(
+            self.page_texts[index], width, height, words,
+            SOURCES[int(self.arrays['page_source'][index])]
+        )
+
+
+def layer_path(file_path):
+    return file_path + LAYER_SUFFIX
+
+
+def save_layer(file_path, layer):
+    """Write a document's text layer next to it; failures are logged, never raised"""
+    path = layer_path(file_path)
+    try:
+        # Write then rename so concurrent readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, source_size=np.array(os.path.getsize(file_path)), **layer.arrays)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    except Exception as e:
+        print(f"Error saving text layer: {e}")
+
+
+def load_layer(file_path):
+    """The stored text layer of a document, or None if there is none or it is out of date"""
+    path = layer_path(file_path)
+    try:
+        if os.path.getmtime(path) < os.path.getmtime(file_path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Error reading text layer: {e}")
+        return None
+    if int(arrays.pop('source_size')) != os.path.getsize(file_path) or int(arrays['version']) != LAYER_VERSION:
+        return None
+    return TextLayer(arrays)
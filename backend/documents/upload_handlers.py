@@ -0,0 +1,229 @@
+"""
+Streaming upload handling for proforma and receipt files.
+
+Uploaded chunks are written straight to a temporary file on the same
+filesystem as MEDIA_ROOT while the SHA-256 is computed and the content type
+is sniffed from the first bytes, so a file is read exactly once, memory use
+stays flat whatever its size, and saving it to storage is a rename rather
+than a copy. Large scanned bundles can instead be sent as resumable chunked
+uploads (see UploadSession).
+"""
+import hashlib
+import os
+import tempfile
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+# Magic numbers of the file types we accept or recognise
+SIGNATURES = [
+    (b'%PDF-', 'application/pdf'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+    (b'PK\x03\x04', 'application/zip'),
+]
+
+# Content types that can be uploaded as proformas/receipts
+DOCUMENT_CONTENT_TYPES = {'application/pdf', 'image/jpeg', 'image/png', 'image/gif', 'image/bmp'}
+
+# Bytes kept for sniffing; PDF readers accept junk before the header within the first 1 KB
+SNIFF_BYTES = 1024
+
+
+def sniff_content_type(head):
+    """Content type from a file's first bytes, or 'application/octet-stream'"""
+    if b'%PDF-' in head[:SNIFF_BYTES]:
+        return 'application/pdf'
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return 'application/octet-stream'
+
+
+def upload_temp_dir():
+    """Directory for in-progress uploads (DOCUMENT_UPLOAD_TEMP_DIR), created on first use"""
+    os.makedirs(settings.DOCUMENT_UPLOAD_TEMP_DIR, exist_ok=True)
+    return settings.DOCUMENT_UPLOAD_TEMP_DIR
+
+
+class StreamedUploadedFile(TemporaryUploadedFile):
+    """TemporaryUploadedFile created in DOCUMENT_UPLOAD_TEMP_DIR"""
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix='.upload' + ext, dir=upload_temp_dir())
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+
+
+def upload_too_large(request):
+    """Whether StreamingHashUploadHandler stopped this request's upload for exceeding the size limit"""
+    return getattr(request, 'upload_too_large', False)
+
+
+class StreamingHashUploadHandler(FileUploadHandler):
+    """
+    Write uploaded files to disk chunk by chunk, hashing and sniffing as they arrive.
+
+    The resulting file has `sha256` and `sniffed_content_type` attributes.
+    Files over DOCUMENT_UPLOAD_MAX_SIZE (DOCUMENT_BATCH_MAX_SIZE for a batch
+    `archive`) stop the upload as soon as the limit is passed, and requests
+    declaring more than DOCUMENT_BATCH_MAX_SIZE bytes before any is written;
+    the request is then marked so views can report it (see upload_too_large).
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # No single request may carry more than the largest batch; checked before reading the body
+        self.request_too_large = content_length > settings.DOCUMENT_BATCH_MAX_SIZE
+
+    def _stop(self):
+        self.request.upload_too_large = True
+        raise StopUpload(connection_reset=True)
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if self.request_too_large:
+            self._stop()
+        self.max_size = settings.DOCUMENT_BATCH_MAX_SIZE if self.field_name == 'archive' else settings.DOCUMENT_UPLOAD_MAX_SIZE
+        self.received = 0
+        self.hasher = hashlib.sha256()
+        self.head = b''
+        self.file = StreamedUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self._stop()
+        if len(self.head) < SNIFF_BYTES:
+            self.head += raw_data[:SNIFF_BYTES]
+        self.hasher.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self.hasher.hexdigest()
+        self.file.sniffed_content_type = sniff_content_type(self.head)
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            temp_location = self.file.temporary_file_path()
+            try:
+                self.file.close()
+                os.remove(temp_location)
+            except FileNotFoundError:
+                pass
+
+
+class AssembledUpload(File):
+    """A completed chunked upload; storage moves it into place instead of copying"""
+
+    def __init__(self, path, name, sha256, content_type):
+        super().__init__(open(path, 'rb'), name=name)
+        self.path = path
+        self.sha256 = sha256
+        self.sniffed_content_type = content_type
+
+    def temporary_file_path(self):
+        return self.path
+
+
+# Bytes read from the request body per write when appending a chunk
+APPEND_BUFFER_SIZE = 64 * 1024
+
+
+def append_chunk(session, stream, length):
+    """
+    Append length bytes read from stream to a chunked upload at its current offset.
+
+    The caller must hold a lock on the session row. When the last byte arrives
+    the assembled file is hashed and sniffed (one sequential read; hash state
+    cannot be carried between requests that may land on different workers).
+
+    Returns:
+        UploadSession: the updated session
+    """
+    path = session.partial_path
+    upload_temp_dir()
+    mode = 'r+b' if os.path.exists(path) else 'wb'
+    remaining = length
+    with open(path, mode) as f:
+        f.seek(session.offset)
+        while remaining > 0:
+            data = stream.read(min(APPEND_BUFFER_SIZE, remaining))
+            if not data:
+                break
+            f.write(data)
+            remaining -= len(data)
+        f.truncate()
+    session.offset += length - remaining
+
+    if session.offset >= session.size:
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            head = f.read(SNIFF_BYTES)
+            hasher.update(head)
+            for chunk in iter(lambda: f.read(APPEND_BUFFER_SIZE), b''):
+                hasher.update(chunk)
+        session.content_hash = hasher.hexdigest()
+        session.content_type = sniff_content_type(head)
+        session.status = 'complete'
+    session.save()
+    return session
+
+
+def open_completed_upload(session):
+    """The assembled file of a complete session, ready to assign to a FileField"""
+    return AssembledUpload(session.partial_path, session.filename, session.content_hash, session.content_type)
+
+
+def expire_upload_sessions():
+    """Delete chunked uploads that have not been touched for UPLOAD_SESSION_TTL seconds"""
+    from datetime import timedelta
+    from django.utils import timezone
+    from .models import UploadSession
+    cutoff = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+    for session in UploadSession.objects.filter(updated_at__lt=cutoff):
+        try:
+            os.remove(session.partial_path)
+        except FileNotFoundError:
+            pass
+        session.delete()
+
+
+def spool_file(source, name, max_size):
+    """
+    Copy a readable stream (e.g. a zip member) to a temporary upload file, hashing and sniffing it.
+
+    Raises:
+        ValueError: the stream is larger than max_size bytes
+
+    Returns:
+        StreamedUploadedFile: with `sha256` and `sniffed_content_type` set, ready for a serializer
+    """
+    upload = StreamedUploadedFile(name, 'application/octet-stream', 0, None)
+    hasher = hashlib.sha256()
+    head = b''
+    size = 0
+    try:
+        for chunk in iter(lambda: source.read(APPEND_BUFFER_SIZE), b''):
+            size += len(chunk)
+            if size > max_size:
+                raise ValueError('File is too large')
+            if len(head) < SNIFF_BYTES:
+                head += chunk[:SNIFF_BYTES]
+            hasher.update(chunk)
+            upload.write(chunk)
+    except BaseException:
+        upload.close()
+        raise
+    upload.seek(0)
+    upload.size = size
+    upload.sha256 = hasher.hexdigest()
+    upload.sniffed_content_type = sniff_content_type(head)
+    upload.content_type = upload.sniffed_content_type
+    return upload
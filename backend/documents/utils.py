@@ -3,7 +3,12 @@ from django.utils import timezone
 
 
 def get_document_upload_path(instance, filename):
-    """Generate upload path for documents"""
+    """
+    Generate upload path for documents
+    
+    Document fields use content-addressed storage, which keeps only the
+    extension of this name; the file is stored under its hash.
+    """
     # Get the model name
     model_name = instance.__class__.__name__.lower()
     # Get date for folder structure
@@ -0,0 +1,344 @@
+"""
+Per-vendor layout templates.
+
+After a high-confidence LLM extraction of a PDF, the page layout is
+fingerprinted by its anchor words (static labels and letterhead text at
+quantized positions) and the positions of the variable fields are recorded.
+Later documents whose fingerprint matches are extracted deterministically
+from those positions, so recurring suppliers stop costing LLM calls.
+"""
+import pdfplumber
+from .models import VendorTemplate
+from .rule_extractor import parse_amount, parse_date, extract as extract_rules
+from .text_layer import load_layer
+
+# Grid used to quantize anchor word positions (columns x rows per page)
+GRID_COLUMNS = 20
+GRID_ROWS = 40
+
+# Jaccard similarity of anchor sets required to apply a template
+MATCH_THRESHOLD = 0.6
+
+# Words on the same line have tops within this many points
+LINE_TOLERANCE = 3
+
+# Templates that fail more often than they succeed are dropped after this many failures
+MAX_FAILURES = 3
+
+# Fields whose values are the same on every document from a vendor
+CONSTANT_FIELDS = {
+    'proforma': ['vendor_name', 'vendor_address', 'terms'],
+    'receipt': ['vendor_name'],
+}
+
+# Variable fields located by position: field -> (page, parser)
+LOCATED_FIELDS = {
+    'total_amount': ('last', 'amount'),
+    'date': ('first', 'date'),
+}
+
+
+def _is_anchor(text):
+    return len(text) >= 3 and text.isalpha()
+
+
+def _page_words(page):
+    """Words with positions normalised to 0-1 page coordinates"""
+    words = []
+    for word in page.extract_words():
+        words.append({
+            'text': word['text'],
+            'x0': word['x0'] / page.width,
+            'x1': word['x1'] / page.width,
+            'top': word['top'] / page.height,
+            'bottom': word['bottom'] / page.height,
+            '_top_pt': word['top'],
+        })
+    return words
+
+
+def _layer_words(page):
+    """Words of a stored text layer page, in the same form as _page_words"""
+    return [
+        {'text': text, 'x0': x0, 'x1': x1, 'top': top, 'bottom': bottom, '_top_pt': top * page.height}
+        for text, x0, top, x1, bottom, _ in page.words
+    ]
+
+
+def read_layout(file_path, layer=None):
+    """
+    First- and last-page words of a document, or None if it has no words.
+    
+    Words come from the document's stored text layer (so scans work too),
+    falling back to parsing the PDF.
+    """
+    layer = layer or load_layer(file_path)
+    if layer is not None and len(layer):
+        first = _layer_words(layer.page(0))
+        if not first:
+            return None
+        return {'first': first, 'last': _layer_words(layer.page(-1)) if len(layer) > 1 else first}
+    if not file_path.lower().endswith('.pdf'):
+        return None
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            if not pdf.pages:
+                return None
+            layout = {'first': _page_words(pdf.pages[0])}
+            layout['last'] = _page_words(pdf.pages[-1]) if len(pdf.pages) > 1 else layout['first']
+    except Exception as e:
+        print(f"Error reading PDF layout: {e}")
+        return None
+    if not layout['first']:
+        return None
+    return layout
+
+
+def fingerprint(layout):
+    """Anchor words of the first page with their quantized positions"""
+    anchors = set()
+    for word in layout['first']:
+        if _is_anchor(word['text']):
+            column = int(word['x0'] * GRID_COLUMNS)
+            row = int(word['top'] * GRID_ROWS)
+            anchors.add(f"{word['text'].lower()}@{column},{row}")
+    return sorted(anchors)
+
+
+def similarity(a, b):
+    a, b = set(a), set(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _lines(words):
+    """Group words into lines, each sorted left to right"""
+    lines = []
+    for word in sorted(words, key=lambda w: (w['_top_pt'], w['x0'])):
+        if lines and abs(lines[-1][0]['_top_pt'] - word['_top_pt']) <= LINE_TOLERANCE:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return [sorted(line, key=lambda w: w['x0']) for line in lines]
+
+
+def _parse(kind, text):
+    if kind == 'amount':
+        return parse_amount(text.strip('$€£:'))
+    return parse_date(text)
+
+
+def _box(words):
+    return [
+        min(w['x0'] for w in words),
+        min(w['top'] for w in words),
+        max(w['x1'] for w in words),
+        max(w['bottom'] for w in words),
+    ]
+
+
+def _label(words):
+    """The label before a value: the words with letters directly preceding it, e.g. 'sub total'"""
+    label = []
+    for word in reversed(words):
+        if not any(ch.isalpha() for ch in word['text']):
+            break
+        label.insert(0, word['text'].lower().strip(':'))
+    return ' '.join(part for part in label if part)
+
+
+def _find_locator(words, kind, value):
+    """Find the label and value box for a known field value"""
+    for line in _lines(words):
+        for index, word in enumerate(line):
+            if kind == 'amount':
+                candidates = [line[index:index + 1]]
+            else:
+                candidates = [line[index:index + n] for n in (1, 2, 3)]
+            for value_words in candidates:
+                text = ' '.join(w['text'] for w in value_words)
+                parsed = _parse(kind, text)
+                if parsed is None or parsed != value:
+                    continue
+                return {
+                    'label': _label(line[:index]),
+                    'box': _box(value_words),
+                }
+    return None
+
+
+def _distance(box, other):
+    """Distance between the centres of two boxes"""
+    dx = (box[0] + box[2]) / 2 - (other[0] + other[2]) / 2
+    dy = (box[1] + box[3]) / 2 - (other[1] + other[3]) / 2
+    return (dx * dx + dy * dy) ** 0.5
+
+
+def _apply_locator(words, kind, locator):
+    """Read a field value using a stored locator; label first, then position"""
+    box = locator['box']
+
+    if locator.get('label'):
+        # Values after the whole learned label ('total' does not match 'sub total');
+        # when the label appears more than once, the one nearest the learned position wins
+        candidates = []
+        for line in _lines(words):
+            for index in range(1, len(line)):
+                if _label(line[:index]) != locator['label']:
+                    continue
+                for n in range(1, min(3, len(line) - index) + 1):
+                    value_words = line[index:index + n]
+                    parsed = _parse(kind, ' '.join(w['text'] for w in value_words))
+                    if parsed is not None:
+                        candidates.append((_distance(_box(value_words), box), parsed))
+                        break
+        if candidates:
+            return min(candidates, key=lambda candidate: candidate[0])[1]
+
+    # No label on the page: fall back to whatever sits in the learned box
+    tolerance = 0.01
+    inside = [
+        w for w in words
+        if w['x0'] >= box[0] - tolerance and w['x1'] <= box[2] + tolerance
+        and w['top'] >= box[1] - tolerance and w['bottom'] <= box[3] + tolerance
+    ]
+    if inside:
+        return _parse(kind, ' '.join(w['text'] for w in sorted(inside, key=lambda w: w['x0'])))
+    return None
+
+
+def _squash(text):
+    return ' '.join((text or '').lower().split())
+
+
+def _in_text(value, text):
+    """Whether a stored value is printed in the document (ignoring case and line breaks)"""
+    value = _squash(value)
+    return bool(value) and value in text
+
+
+def learn_template(file_path, result, document_type, layout=None):
+    """Create or refresh the vendor's template from a trusted extraction result"""
+    vendor_name = (result.get('vendor_name') or '').strip()
+    if not vendor_name:
+        return None
+    layout = layout or read_layout(file_path)
+    if not layout:
+        return None
+
+    fields = {field: result.get(field) for field in CONSTANT_FIELDS[document_type] if result.get(field)}
+    locators = {}
+    for field, (page, kind) in LOCATED_FIELDS.items():
+        value = result.get(field)
+        if value in (None, ''):
+            continue
+        if kind == 'amount':
+            value = parse_amount(str(value))
+        locator = _find_locator(layout[page], kind, value)
+        if locator:
+            locators[field] = {'page': page, 'kind': kind, **locator}
+    if 'total_amount' not in locators:
+        # A template that cannot find the total is not worth keeping
+        return None
+    fields['locators'] = locators
+
+    anchors = fingerprint(layout)
+    template = match_template(anchors, document_type)
+    if template and template.vendor_name.lower() == vendor_name.lower():
+        template.fingerprint = anchors
+        template.fields = fields
+        template.samples += 1
+        template.failures = 0
+        template.save()
+        return template
+    return VendorTemplate.objects.create(
+        vendor_name=vendor_name,
+        document_type=document_type,
+        fingerprint=anchors,
+        fields=fields,
+    )
+
+
+def match_template(anchors, document_type, text=None):
+    """
+    Best-matching template above MATCH_THRESHOLD, or None.
+
+    With text, only templates whose vendor name is printed in it match, so a
+    look-alike layout from another supplier is not read as this vendor.
+    """
+    best, best_score = None, MATCH_THRESHOLD
+    squashed = _squash(text) if text is not None else None
+    for template in VendorTemplate.objects.filter(document_type=document_type).only('id', 'vendor_name', 'fingerprint'):
+        score = similarity(anchors, template.fingerprint)
+        if score < best_score:
+            continue
+        if squashed is not None and not _in_text(template.vendor_name, squashed):
+            continue
+        best, best_score = template, score
+    if best:
+        best.refresh_from_db()
+    return best
+
+
+def apply_template(file_path, text, document_type, layout=None):
+    """
+    Extract a document with a matching vendor template.
+
+    Returns:
+        dict or None: extraction result, or None if no template matched or applying it failed
+    """
+    layout = layout or read_layout(file_path)
+    if not layout:
+        return None
+    squashed = _squash(text)
+    template = match_template(fingerprint(layout), document_type, text)
+    if not template:
+        return None
+
+    values = {}
+    for field, locator in template.fields.get('locators', {}).items():
+        values[field] = _apply_locator(layout[locator['page']], locator['kind'], locator)
+
+    if values.get('total_amount') is None:
+        template.failures += 1
+        if template.failures >= MAX_FAILURES and template.failures > template.hits:
+            template.delete()
+        else:
+            template.save(update_fields=['failures', 'updated_at'])
+        return None
+
+    template.hits += 1
+    template.save(update_fields=['hits', 'updated_at'])
+
+    # Line items vary per document; read them with the rule engine
+    rule_fields, _ = extract_rules(text)
+    items = rule_fields.get('items', [])
+    metadata = {
+        'method': 'vendor_template',
+        'template_id': template.id,
+        'success': True,
+        'confidence': 'high',
+    }
+    # Stored constants are only returned when this document actually prints them
+    constants = {
+        field: value for field, value in template.fields.items()
+        if field in CONSTANT_FIELDS[document_type] and _in_text(value, squashed)
+    }
+    if document_type == 'proforma':
+        items_data = {'items': items} if items else {}
+        return {
+            'vendor_name': constants.get('vendor_name', template.vendor_name),
+            'vendor_address': constants.get('vendor_address', ''),
+            'total_amount': values['total_amount'],
+            'items_data': items_data,
+            'terms': constants.get('terms', ''),
+            'extraction_metadata': metadata,
+        }
+    return {
+        'vendor_name': constants.get('vendor_name', template.vendor_name),
+        'items': items,
+        'total_amount': values['total_amount'],
+        'date': values.get('date'),
+        'extraction_metadata': metadata,
+    }
@@ -0,0 +1,187 @@
+"""
+Vendor name normalization and lookup.
+
+Names are folded to a canonical form (Unicode folded, punctuation and legal
+suffixes removed) so "ACME Ltd." and "Acme Limited" compare equal, and fuzzy
+comparisons use character trigrams instead of substring tests. A trigram
+index over the vendor names already known from proformas and purchase orders
+answers "did you mean" lookups without scanning every vendor.
+"""
+import re
+import threading
+import time
+import unicodedata
+import numpy as np
+from django.conf import settings
+
+# Trailing words that only state the legal form of a company
+LEGAL_SUFFIXES = {
+    'ltd', 'limited', 'inc', 'incorporated', 'llc', 'llp', 'lp', 'plc', 'co', 'company', 'corp',
+    'corporation', 'gmbh', 'ag', 'sa', 'sarl', 'sas', 'srl', 'spa', 'bv', 'nv', 'pty', 'pvt',
+    'private', 'public', 'group', 'holdings', 'intl', 'international', 'ab', 'as', 'oy', 'kk',
+}
+
+# Trigram similarity at or above which two vendor names are treated as the same vendor
+MATCH_THRESHOLD = 0.8
+
+# Minimum similarity for "did you mean" suggestions
+SUGGESTION_THRESHOLD = 0.4
+
+NON_WORD = re.compile(r'[^a-z0-9]+')
+# Dotted abbreviations such as "S.A." or "B.V." collapse to one word before splitting
+DOTTED_ABBREVIATION = re.compile(r'\b(?:[a-z]\.){2,}')
+
+
+def normalize_vendor_name(name):
+    """Canonical form of a vendor name for comparison, e.g. 'Café Ünïon S.A.' -> 'cafe union'"""
+    text = unicodedata.normalize('NFKD', str(name or ''))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    text = text.replace('&', ' and ')
+    text = DOTTED_ABBREVIATION.sub(lambda m: m.group(0).replace('.', ''), text)
+    words = NON_WORD.sub(' ', text).split()
+    if words and words[0] == 'the' and len(words) > 1:
+        words = words[1:]
+    # Strip suffixes from the end only, and never down to nothing ("Company Ltd")
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+    return ' '.join(words)
+
+
+def trigrams(normalized):
+    padded = f'  {normalized} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """Dice coefficient of the trigram sets of two vendor names (0-1)"""
+    a, b = normalize_vendor_name(a), normalize_vendor_name(b)
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    grams_a, grams_b = trigrams(a), trigrams(b)
+    return 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+def vendors_match(a, b):
+    """True if two vendor names refer to the same vendor"""
+    return similarity(a, b) >= MATCH_THRESHOLD
+
+
+class VendorIndex:
+    """
+    Inverted trigram index over known vendor names.
+
+    Postings are integer vendor ids; a lookup counts shared trigrams for every
+    candidate at once with NumPy, so it stays well under a millisecond for
+    tens of thousands of vendors.
+    """
+
+    def __init__(self, names=()):
+        self.ids = {}
+        self.display_names = []
+        self.gram_counts = []
+        self.postings = {}
+        self._arrays = {}
+        self._sizes = None
+        self._lock = threading.Lock()
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.display_names)
+
+    def add(self, name):
+        normalized = normalize_vendor_name(name)
+        if not normalized:
+            return
+        with self._lock:
+            if normalized in self.ids:
+                return
+            vendor_id = len(self.display_names)
+            grams = trigrams(normalized)
+            self.ids[normalized] = vendor_id
+            self.display_names.append(name.strip())
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(vendor_id)
+                self._arrays.pop(gram, None)
+            self._sizes = None
+
+    def _posting_array(self, gram):
+        array = self._arrays.get(gram)
+        if array is None:
+            array = self._arrays[gram] = np.array(self.postings[gram], dtype=np.int32)
+        return array
+
+    def lookup(self, name, limit=5, threshold=SUGGESTION_THRESHOLD):
+        """
+        Known vendors most similar to name.
+
+        Returns:
+            list of (vendor name, similarity) tuples, best first
+        """
+        normalized = normalize_vendor_name(name)
+        if not normalized:
+            return []
+        if normalized in self.ids:
+            return [(self.display_names[self.ids[normalized]], 1.0)]
+        grams = trigrams(normalized)
+        with self._lock:
+            arrays = [self._posting_array(gram) for gram in grams if gram in self.postings]
+            if self._sizes is None:
+                self._sizes = np.array(self.gram_counts, dtype=np.float64)
+            sizes = self._sizes
+        if not arrays:
+            return []
+        shared = np.bincount(np.concatenate(arrays), minlength=len(sizes))
+        candidates = np.flatnonzero(shared)
+        scores = 2 * shared[candidates] / (len(grams) + sizes[candidates])
+        keep = scores >= threshold
+        candidates, scores = candidates[keep], scores[keep]
+        if len(candidates) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            candidates, scores = candidates[top], scores[top]
+        order = np.lexsort((candidates, -scores))
+        return [(self.display_names[candidates[i]], round(float(scores[i]), 3)) for i in order]
+
+
+_index = None
+_index_built_at = 0.0
+_index_lock = threading.Lock()
+
+
+def _known_vendor_names():
+    from .models import Proforma, PurchaseOrder
+    names = set(Proforma.objects.exclude(vendor_name='').values_list('vendor_name', flat=True).distinct())
+    names.update(PurchaseOrder.objects.exclude(vendor_name='').values_list('vendor_name', flat=True).distinct())
+    return sorted(names)
+
+
+def get_vendor_index():
+    """
+    Process-wide index of vendor names from proformas and purchase orders.
+
+    Saves in this process update it immediately (see remember_vendor); it is
+    rebuilt every VENDOR_INDEX_TTL seconds to pick up other processes' writes.
+    """
+    global _index, _index_built_at
+    with _index_lock:
+        if _index is None or time.monotonic() - _index_built_at > settings.VENDOR_INDEX_TTL:
+            _index = VendorIndex(_known_vendor_names())
+            _index_built_at = time.monotonic()
+        return _index
+
+
+def remember_vendor(sender, instance, **kwargs):
+    """post_save receiver adding a saved document's vendor to a built index"""
+    if _index is not None and instance.vendor_name:
+        _index.add(instance.vendor_name)
+
+
+def suggest_vendors(name, limit=5):
+    """'Did you mean' suggestions for a vendor name"""
+    return [
+        {'vendor_name': vendor_name, 'similarity': score}
+        for vendor_name, score in get_vendor_index().lookup(name, limit=limit)
+    ]
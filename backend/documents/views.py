@@ -1,15 +1,80 @@
-from rest_framework import viewsets, status, permissions
-from rest_framework.decorators import action
-from rest_framework.response import Response
+import os
+from django.conf import settings
 from django.db import transaction
-from django.utils import timezone
-from .models import Proforma, PurchaseOrder, Receipt
-from .serializers import ProformaSerializer, PurchaseOrderSerializer, ReceiptSerializer
-from .document_processor import DocumentProcessor
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponseNotModified, StreamingHttpResponse
+from rest_framework import viewsets, mixins, status, permissions
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.response import Response
+from .models import Proforma, PurchaseOrder, Receipt, ExtractionJob, UploadSession
+from .serializers import (
+    ProformaSerializer,
+    PurchaseOrderSerializer,
+    ReceiptSerializer,
+    ExtractionJobSerializer,
+    UploadSessionSerializer
+)
+from .exports import CONTENT_TYPES, ExportError, aiter_chunks, export_filename, export_purchase_orders, parse_export_params
+from .batch import BatchError, entries_from_archive, entries_from_files, open_archive, parse_manifest, run_batch
+from .jobs import enqueue_job
+from .search import DOCUMENT_TYPES, search_documents
+from .streams import make_stream_token
+from .previews import PREVIEW_CONTENT_TYPE, PREVIEW_SIZES, PreviewError, document_hash, get_preview, page_count
+from .upload_handlers import append_chunk, expire_upload_sessions, upload_too_large
+from .services import render_purchase_order_pdf
+from .vendors import suggest_vendors
 from requests.models import PurchaseRequest
 
 
-class ProformaViewSet(viewsets.ModelViewSet):
+class PreviewMixin:
+    """Adds GET {id}/preview/?size=thumb|medium|large&page=1 serving a rendered page image"""
+    
+    def ensure_file(self, document):
+        """The document to preview; viewsets whose files are generated create them here"""
+        return document
+    
+    @action(detail=True, methods=['get'])
+    def preview(self, request, pk=None):
+        """Rendered page preview, cached on disk and in the browser"""
+        document = self.ensure_file(self.get_object())
+        if not document.file:
+            return Response({'error': 'Document has no file'}, status=status.HTTP_404_NOT_FOUND)
+        
+        size = request.query_params.get('size', 'thumb')
+        if size not in PREVIEW_SIZES:
+            return Response(
+                {'error': f"size must be one of: {', '.join(PREVIEW_SIZES)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            page_index = int(request.query_params.get('page', '1')) - 1
+        except ValueError:
+            page_index = -1
+        if page_index < 0:
+            return Response({'error': 'page must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Previews of a given file never change, so the ETag only needs the hash
+        etag = f'"{document_hash(document)[:32]}-{size}-{page_index + 1}"'
+        cache_control = f'private, max-age={settings.PREVIEW_CACHE_MAX_AGE}, immutable'
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            response['Cache-Control'] = cache_control
+            return response
+        
+        try:
+            path = get_preview(document, size, page_index)
+        except PreviewError as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        
+        response = FileResponse(open(path, 'rb'), content_type=PREVIEW_CONTENT_TYPE)
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        response['X-Page-Count'] = str(page_count(document.file.path))
+        return response
+
+
+class ProformaViewSet(PreviewMixin, viewsets.ModelViewSet):
     """ViewSet for proforma documents"""
     queryset = Proforma.objects.all()
     serializer_class = ProformaSerializer
@@ -55,28 +120,25 @@ class ProformaViewSet(viewsets.ModelViewSet):
         
         proforma = serializer.save()
         
-        # Process document to extract data
-        processor = DocumentProcessor()
-        try:
-            extracted_data = processor.extract_proforma_data(proforma.file.path)
-            
-            # Update proforma with extracted data
-            proforma.vendor_name = extracted_data.get('vendor_name', '')
-            proforma.vendor_address = extracted_data.get('vendor_address', '')
-            proforma.total_amount = extracted_data.get('total_amount')
-            proforma.items_data = extracted_data.get('items_data', {})
-            proforma.terms = extracted_data.get('terms', '')
-            proforma.extraction_metadata = extracted_data.get('extraction_metadata', {})
-            proforma.save()
-            
-        except Exception as e:
-            # Log error but don't fail the upload
-            print(f"Error processing proforma: {e}")
+        # Extraction runs in the document worker
+        job = enqueue_job('proforma_extraction', created_by=request.user, proforma=proforma)
+        proforma.refresh_from_db()
         
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return _accepted_response(serializer.data, job)
+    
+    @action(detail=False, methods=['get'], url_path='vendor-suggestions')
+    def vendor_suggestions(self, request):
+        """"Did you mean" lookup of known vendor names"""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {'error': 'Query parameter q is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({'query': query, 'suggestions': suggest_vendors(query)})
 
 
-class PurchaseOrderViewSet(viewsets.ReadOnlyModelViewSet):
+class PurchaseOrderViewSet(PreviewMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for purchase orders (read-only)"""
     queryset = PurchaseOrder.objects.all()
     serializer_class = PurchaseOrderSerializer
@@ -90,9 +152,59 @@ class PurchaseOrderViewSet(viewsets.ReadOnlyModelViewSet):
         elif user.is_approver() or user.is_finance():
             return PurchaseOrder.objects.all()
         return PurchaseOrder.objects.none()
+    
+    def ensure_file(self, purchase_order):
+        """Render the PDF now if the background renderer has not done so yet"""
+        if purchase_order.file:
+            return purchase_order
+        try:
+            return render_purchase_order_pdf(purchase_order)
+        except Exception as e:
+            print(f"Error generating PO PDF: {e}")
+            return purchase_order
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """GET /api/purchase-orders/{id}/download/ - the PO PDF, rendered on first request if missing"""
+        purchase_order = self.ensure_file(self.get_object())
+        if not purchase_order.file:
+            return Response(
+                {'error': 'Purchase order PDF could not be generated'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        return FileResponse(
+            purchase_order.file.open('rb'),
+            as_attachment=True,
+            filename=f"PO_{purchase_order.po_number}.pdf",
+            content_type='application/pdf'
+        )
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        GET /api/purchase-orders/export/?output=zip|pdf&from=2025-10-01&to=2025-10-31&vendor=acme&status=valid,none
+        
+        Streams every matching purchase order the user may see as a zip of
+        PDFs or one merged PDF. status filters by receipt validation status
+        ('none' for POs without a receipt).
+        """
+        try:
+            options = parse_export_params(request.query_params)
+            count, chunks = export_purchase_orders(
+                self.get_queryset(), options, processes=settings.PO_EXPORT_HTTP_PROCESSES
+            )
+        except ExportError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if isinstance(request._request, ASGIRequest):
+            chunks = aiter_chunks(chunks)
+        response = StreamingHttpResponse(chunks, content_type=CONTENT_TYPES[options['output']])
+        response['Content-Disposition'] = f'attachment; filename="{export_filename(options)}"'
+        response['X-Purchase-Order-Count'] = str(count)
+        return response
 
 
-class ReceiptViewSet(viewsets.ModelViewSet):
+class ReceiptViewSet(PreviewMixin, viewsets.ModelViewSet):
     """ViewSet for receipts"""
     queryset = Receipt.objects.all()
     serializer_class = ReceiptSerializer
@@ -109,69 +221,76 @@ class ReceiptViewSet(viewsets.ModelViewSet):
     
     def create(self, request, *args, **kwargs):
         """Upload and validate receipt"""
-        request_id = request.data.get('request')
-        
-        try:
-            purchase_request = PurchaseRequest.objects.get(id=request_id)
-        except PurchaseRequest.DoesNotExist:
-            return Response(
-                {'error': 'Purchase request not found'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        
-        # Check permissions
-        if purchase_request.created_by != request.user and not request.user.is_finance():
-            return Response(
-                {'error': 'You do not have permission to upload receipt for this request'},
-                status=status.HTTP_403_FORBIDDEN
-            )
-        
-        # Check if request is approved
-        if purchase_request.status != 'approved':
-            return Response(
-                {'error': 'Receipt can only be uploaded for approved requests'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        error = _receipt_upload_error(request.user, request.data.get('request'))
+        if error:
+            message, error_status = error
+            return Response({'error': message}, status=error_status)
         
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
         receipt = serializer.save(uploaded_by=request.user)
         
-        # Process and validate receipt
-        processor = DocumentProcessor()
+        # Extraction and validation run in the document worker
+        job = enqueue_job('receipt_extraction', created_by=request.user, receipt=receipt)
+        receipt.refresh_from_db()
+        
+        return _accepted_response(serializer.data, job)
+    
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Upload many receipts at once.
+        
+        Send a zip `archive`, or several `files` with a `requests` id for each.
+        A `manifest` JSON object (or manifest.json in the archive) may map file
+        names to request ids instead; archive members in a `<request id>/`
+        folder need neither. Returns a per-file manifest.
+        """
+        archive = None
         try:
-            extracted_data = processor.extract_receipt_data(receipt.file.path)
-            receipt.extracted_data = extracted_data
-            
-            # Validate against PO if exists
-            if hasattr(purchase_request, 'purchase_order'):
-                po = purchase_request.purchase_order
-                validation_results, discrepancies = processor.validate_receipt_against_po(
-                    extracted_data, po
+            manifest = parse_manifest(request.data.get('manifest'))
+            if upload_too_large(request):
+                return Response({'error': 'File is too large'}, status=status.HTTP_400_BAD_REQUEST)
+            if 'archive' in request.FILES:
+                archive = open_archive(request.FILES['archive'])
+                entries = entries_from_archive(archive, manifest)
+            else:
+                entries = entries_from_files(
+                    request.FILES.getlist('files'),
+                    request.data.getlist('requests') if hasattr(request.data, 'getlist') else [],
+                    manifest
                 )
-                
-                receipt.validation_results = validation_results
-                receipt.discrepancies = discrepancies
-                
-                if validation_results['overall_valid']:
-                    receipt.validation_status = 'valid'
-                elif discrepancies:
-                    receipt.validation_status = 'discrepancy'
-                else:
-                    receipt.validation_status = 'invalid'
-                
-                receipt.validated_at = timezone.now()
-            
-            receipt.save()
-            
-        except Exception as e:
-            # Log error but don't fail the upload
-            print(f"Error processing receipt: {e}")
-            receipt.validation_status = 'pending'
-            receipt.save()
+            if not entries:
+                return Response(
+                    {'error': 'Send an archive or one or more files'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            results = run_batch(entries, self._ingest_receipt, archive)
+        except BatchError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        finally:
+            if archive is not None:
+                archive.close()
         
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        accepted = sum(1 for result in results if result['status'] == 'queued')
+        return Response(
+            {'count': len(results), 'accepted': accepted, 'rejected': len(results) - accepted, 'results': results},
+            status=status.HTTP_202_ACCEPTED if accepted else status.HTTP_400_BAD_REQUEST
+        )
+    
+    def _ingest_receipt(self, request_id, file):
+        """Create and queue one receipt of a batch; returns its manifest fields"""
+        error = _receipt_upload_error(self.request.user, request_id)
+        if error:
+            return {'error': error[0]}
+        
+        serializer = self.get_serializer(data={'request': request_id, 'file': file})
+        if not serializer.is_valid():
+            return {'error': serializer.errors}
+        receipt = serializer.save(uploaded_by=self.request.user)
+        job = enqueue_job('receipt_extraction', created_by=self.request.user, receipt=receipt)
+        return {'receipt': receipt.pk, 'job': ExtractionJobSerializer(job).data}
     
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def validate(self, request, pk=None):
@@ -184,34 +303,163 @@ class ReceiptViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        processor = DocumentProcessor()
+        job = enqueue_job('receipt_validation', created_by=request.user, receipt=receipt)
+        receipt.refresh_from_db()
+        
+        return _accepted_response(self.get_serializer(receipt).data, job)
+
+
+class ExtractionJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet for polling background extraction job status"""
+    queryset = ExtractionJob.objects.all()
+    serializer_class = ExtractionJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        """Filter based on user role"""
+        user = self.request.user
+        if user.is_staff_role():
+            return ExtractionJob.objects.filter(created_by=user)
+        elif user.is_approver() or user.is_finance():
+            return ExtractionJob.objects.all()
+        return ExtractionJob.objects.none()
+    
+    @action(detail=True, methods=['post'], url_path='events/token')
+    def events_token(self, request, pk=None):
+        """Token for following this job's event stream from an EventSource (which cannot send headers)"""
+        job = self.get_object()
+        return Response({
+            'token': make_stream_token(request.user, job),
+            'expires_in': settings.JOB_EVENTS_TOKEN_TTL,
+        })
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Resumable chunked uploads for large documents.
+    
+    POST {filename, size} to start, then PATCH raw bytes with an Upload-Offset
+    header equal to the current offset (GET the session to resume after a
+    failure). Once complete, pass the session id as `upload` when creating
+    a proforma or receipt.
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        """Users only see their own uploads"""
+        return UploadSession.objects.filter(created_by=self.request.user)
+    
+    def perform_create(self, serializer):
+        expire_upload_sessions()
+        serializer.save(created_by=self.request.user)
+    
+    def partial_update(self, request, *args, **kwargs):
+        """Append a chunk of raw bytes at Upload-Offset"""
         try:
-            extracted_data = processor.extract_receipt_data(receipt.file.path)
-            receipt.extracted_data = extracted_data
-            
-            po = receipt.request.purchase_order
-            validation_results, discrepancies = processor.validate_receipt_against_po(
-                extracted_data, po
-            )
-            
-            receipt.validation_results = validation_results
-            receipt.discrepancies = discrepancies
-            
-            if validation_results['overall_valid']:
-                receipt.validation_status = 'valid'
-            elif discrepancies:
-                receipt.validation_status = 'discrepancy'
-            else:
-                receipt.validation_status = 'invalid'
-            
-            receipt.validated_at = timezone.now()
-            receipt.save()
-            
-            serializer = self.get_serializer(receipt)
-            return Response(serializer.data)
-            
-        except Exception as e:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.headers.get('Content-Length', ''))
+        except ValueError:
             return Response(
-                {'error': f'Error validating receipt: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {'error': 'Upload-Offset and Content-Length headers are required'},
+                status=status.HTTP_400_BAD_REQUEST
             )
+        
+        with transaction.atomic():
+            # Serializes concurrent appends to the same upload
+            session = self.get_queryset().select_for_update().filter(pk=kwargs['pk']).first()
+            if session is None:
+                return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+            if session.status != 'uploading':
+                return Response(
+                    {'error': 'Upload is already complete', 'offset': session.offset},
+                    status=status.HTTP_409_CONFLICT
+                )
+            if offset != session.offset:
+                return Response(
+                    {'error': 'Upload-Offset does not match the received bytes', 'offset': session.offset},
+                    status=status.HTTP_409_CONFLICT
+                )
+            if offset + length > session.size:
+                return Response(
+                    {'error': 'Chunk extends past the declared upload size'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            append_chunk(session, request.stream, length)
+        
+        return Response(self.get_serializer(session).data)
+    
+    def perform_destroy(self, instance):
+        try:
+            os.remove(instance.partial_path)
+        except FileNotFoundError:
+            pass
+        instance.delete()
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def document_search_view(request):
+    """
+    Ranked full-text search of proforma, receipt and purchase order text.
+    
+    GET /api/search/?q=part 4471-B&type=proforma,receipt&limit=20
+    """
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response(
+            {'error': 'Query parameter q is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    document_types = [t for t in request.query_params.get('type', '').split(',') if t]
+    unknown = set(document_types) - set(DOCUMENT_TYPES)
+    if unknown:
+        return Response(
+            {'error': f"type must be one of: {', '.join(DOCUMENT_TYPES)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        limit = min(max(int(request.query_params.get('limit', '20')), 1), settings.SEARCH_MAX_RESULTS)
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Filter based on user role
+    user = request.user
+    if user.is_staff_role():
+        owner = user
+    elif user.is_approver() or user.is_finance():
+        owner = None
+    else:
+        return Response({'query': query, 'results': []})
+    
+    return Response({'query': query, 'results': search_documents(query, owner, document_types, limit)})
+
+
+def _receipt_upload_error(user, request_id):
+    """Why user may not upload a receipt for a request, as (message, status), or None"""
+    try:
+        purchase_request = PurchaseRequest.objects.get(id=request_id)
+    except (PurchaseRequest.DoesNotExist, ValueError, TypeError):
+        return 'Purchase request not found', status.HTTP_404_NOT_FOUND
+    
+    # Check permissions
+    if purchase_request.created_by != user and not user.is_finance():
+        return 'You do not have permission to upload receipt for this request', status.HTTP_403_FORBIDDEN
+    
+    # Check if request is approved
+    if purchase_request.status != 'approved':
+        return 'Receipt can only be uploaded for approved requests', status.HTTP_400_BAD_REQUEST
+    return None
+
+
+def _accepted_response(data, job):
+    """202 response carrying the document data and the job to poll"""
+    return Response(
+        {**data, 'job': ExtractionJobSerializer(job).data},
+        status=status.HTTP_202_ACCEPTED
+    )
@@ -94,6 +94,8 @@ if USE_SQLITE:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # A file (not the in-memory default) so tests can write from several threads
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
         }
     }
 else:
@@ -230,5 +232,87 @@ CORS_EXPOSE_HEADERS = [
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
 
 # File Upload Settings
+# Files are streamed to DOCUMENT_UPLOAD_TEMP_DIR (hashed and sniffed on the way), never held in memory;
+# keep it on the same filesystem as MEDIA_ROOT so saving an upload is a rename
+FILE_UPLOAD_HANDLERS = ['documents.upload_handlers.StreamingHashUploadHandler']
+DOCUMENT_UPLOAD_TEMP_DIR = os.getenv('DOCUMENT_UPLOAD_TEMP_DIR', str(MEDIA_ROOT / 'uploads' / 'tmp'))
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
-DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
+DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB (non-file form data)
+DOCUMENT_UPLOAD_MAX_SIZE = int(os.getenv('DOCUMENT_UPLOAD_MAX_SIZE', str(500 * 1024 * 1024)))  # Bytes per proforma/receipt
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', '86400'))  # Seconds an unfinished chunked upload is kept
+
+# Batch receipt uploads (POST /api/receipts/batch/)
+DOCUMENT_BATCH_MAX_FILES = int(os.getenv('DOCUMENT_BATCH_MAX_FILES', '500'))
+DOCUMENT_BATCH_MAX_SIZE = int(os.getenv('DOCUMENT_BATCH_MAX_SIZE', str(2 * 1024 * 1024 * 1024)))  # Bytes per batch request (and per upload request)
+DOCUMENT_BATCH_WORKERS = int(os.getenv('DOCUMENT_BATCH_WORKERS', '4'))  # Files ingested concurrently per batch
+DATA_UPLOAD_MAX_NUMBER_FILES = DOCUMENT_BATCH_MAX_FILES
+
+# Background document processing (see `python manage.py run_document_worker`)
+# Set DOCUMENT_JOBS_INLINE=True to run extraction jobs inside the request (no worker needed)
+DOCUMENT_JOBS_INLINE = os.getenv('DOCUMENT_JOBS_INLINE', 'False').lower() == 'true'
+DOCUMENT_WORKER_PROCESSES = int(os.getenv('DOCUMENT_WORKER_PROCESSES', '2'))
+DOCUMENT_JOB_TIMEOUT = int(os.getenv('DOCUMENT_JOB_TIMEOUT', '300'))  # Seconds without a heartbeat before a job is retried
+DOCUMENT_JOB_HEARTBEAT_INTERVAL = float(os.getenv('DOCUMENT_JOB_HEARTBEAT_INTERVAL', '30'))  # Seconds between heartbeats of a running job
+DOCUMENT_JOB_MAX_ATTEMPTS = int(os.getenv('DOCUMENT_JOB_MAX_ATTEMPTS', '3'))
+
+# Bulk purchase order export (GET /api/purchase-orders/export/, `python manage.py export_purchase_orders`)
+PO_EXPORT_PROCESSES = int(os.getenv('PO_EXPORT_PROCESSES', '2'))  # Processes collecting/rendering PDFs for the command; 1 runs in-process
+PO_EXPORT_HTTP_PROCESSES = int(os.getenv('PO_EXPORT_HTTP_PROCESSES', '1'))  # Same for API exports; forking from a threaded server is unsafe
+PO_EXPORT_MAX_PDF_ORDERS = int(os.getenv('PO_EXPORT_MAX_PDF_ORDERS', '2000'))  # Larger exports must use zip
+
+# Live job progress (GET /api/jobs/{id}/events/); serve through ASGI so open streams don't hold threads
+JOB_EVENTS_POLL_INTERVAL = float(os.getenv('JOB_EVENTS_POLL_INTERVAL', '0.5'))  # Seconds between checks for new events
+JOB_EVENTS_HEARTBEAT = float(os.getenv('JOB_EVENTS_HEARTBEAT', '15'))  # Seconds of silence before a keepalive comment
+JOB_EVENTS_MAX_STREAM = float(os.getenv('JOB_EVENTS_MAX_STREAM', '300'))  # Seconds before the client is asked to reconnect
+JOB_EVENTS_TTL = int(os.getenv('JOB_EVENTS_TTL', '86400'))  # Seconds events are kept after their job finishes
+JOB_EVENTS_PRUNE_INTERVAL = float(os.getenv('JOB_EVENTS_PRUNE_INTERVAL', '3600'))  # Seconds between deletions of expired events
+JOB_EVENTS_TOKEN_TTL = int(os.getenv('JOB_EVENTS_TOKEN_TTL', '60'))  # Seconds a stream token can open a job's event stream
+
+# Extraction cache keyed by document content hash
+EXTRACTION_CACHE_ENABLED = os.getenv('EXTRACTION_CACHE_ENABLED', 'True').lower() == 'true'
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv('EXTRACTION_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))  # 256MB
+
+# PDF text extraction
+PDF_MAX_PAGES = int(os.getenv('PDF_MAX_PAGES', '500'))  # Pages beyond this are ignored
+PDF_EXTRACTION_WORKERS = int(os.getenv('PDF_EXTRACTION_WORKERS', '1'))  # >1 extracts pages in a process pool
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '16'))  # Shorter PDFs are always extracted in-process
+PDF_OCR_ENABLED = os.getenv('PDF_OCR_ENABLED', 'True').lower() == 'true'  # OCR pages that have no usable text layer
+PDF_OCR_DPI = int(os.getenv('PDF_OCR_DPI', '200'))
+TEXT_LAYER_ENABLED = os.getenv('TEXT_LAYER_ENABLED', 'True').lower() == 'true'  # Store page words/boxes next to each file (<file>.layer.npz)
+
+# OCR engine: 'auto' uses a warm tesserocr API per worker when available, else the tesseract CLI
+OCR_ENGINE = os.getenv('OCR_ENGINE', 'auto')  # 'auto', 'tesserocr' or 'pytesseract'
+OCR_LANG = os.getenv('OCR_LANG', 'eng')
+OCR_TESSDATA_PATH = os.getenv('OCR_TESSDATA_PATH', '')  # e.g. /usr/share/tesseract-ocr/5/tessdata
+OCR_MAX_DPI = int(os.getenv('OCR_MAX_DPI', '300'))  # Higher-resolution images are downscaled before OCR
+OCR_DESKEW = os.getenv('OCR_DESKEW', 'True').lower() == 'true'
+
+# LLM client (shared per process)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', '')  # Override to point at a proxy or local stub server
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '30'))  # Seconds per attempt
+LLM_DEADLINE = float(os.getenv('LLM_DEADLINE', '60'))  # Seconds for all attempts of one call
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('LLM_CIRCUIT_FAILURE_THRESHOLD', '5'))  # Consecutive failures before opening
+LLM_CIRCUIT_RESET_TIMEOUT = float(os.getenv('LLM_CIRCUIT_RESET_TIMEOUT', '60'))  # Seconds before a trial call
+PROMPT_MAX_INPUT_TOKENS = int(os.getenv('PROMPT_MAX_INPUT_TOKENS', '3000'))  # Document tokens per LLM call
+PROMPT_MAX_CHUNKS = int(os.getenv('PROMPT_MAX_CHUNKS', '3'))  # LLM calls per document when it does not fit
+
+# Rule-based extraction: skip the LLM when the rule engine is confident enough
+EXTRACTION_RULES_FIRST = os.getenv('EXTRACTION_RULES_FIRST', 'True').lower() == 'true'
+EXTRACTION_RULES_MIN_CONFIDENCE = float(os.getenv('EXTRACTION_RULES_MIN_CONFIDENCE', '0.85'))  # 0-1, weakest of vendor/total
+VENDOR_TEMPLATES_ENABLED = os.getenv('VENDOR_TEMPLATES_ENABLED', 'True').lower() == 'true'  # Learn per-vendor PDF layouts from LLM results
+
+# Seconds before the in-process vendor name index is rebuilt from the database
+VENDOR_INDEX_TTL = int(os.getenv('VENDOR_INDEX_TTL', '300'))
+
+# Fingerprint uploaded proformas/receipts and flag likely duplicates
+DUPLICATE_DETECTION_ENABLED = os.getenv('DUPLICATE_DETECTION_ENABLED', 'True').lower() == 'true'
+
+# Full-text search of extracted document text (GET /api/search/)
+SEARCH_MAX_TEXT_CHARS = int(os.getenv('SEARCH_MAX_TEXT_CHARS', '200000'))  # Characters indexed per document
+SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', '100'))
+
+# Rendered page previews, keyed by document content hash (see documents/previews.py)
+DOCUMENT_PREVIEW_DIR = os.getenv('DOCUMENT_PREVIEW_DIR', str(MEDIA_ROOT / 'previews'))
+PREVIEW_CACHE_MAX_AGE = int(os.getenv('PREVIEW_CACHE_MAX_AGE', str(365 * 24 * 3600)))  # Seconds browsers may cache a preview
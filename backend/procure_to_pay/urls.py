@@ -12,7 +12,15 @@ from drf_yasg import openapi
 
 from users.views import login_view, current_user_view, UserRegistrationView
 from requests.views import PurchaseRequestViewSet
-from documents.views import ProformaViewSet, PurchaseOrderViewSet, ReceiptViewSet
+from documents.views import (
+    ProformaViewSet,
+    PurchaseOrderViewSet,
+    ReceiptViewSet,
+    ExtractionJobViewSet,
+    UploadSessionViewSet,
+    document_search_view
+)
+from documents.streams import job_event_poll, job_event_stream
 
 # Swagger/OpenAPI schema
 schema_view = get_schema_view(
@@ -31,12 +39,17 @@ router.register(r'requests', PurchaseRequestViewSet, basename='request')
 router.register(r'proformas', ProformaViewSet, basename='proforma')
 router.register(r'purchase-orders', PurchaseOrderViewSet, basename='purchase-order')
 router.register(r'receipts', ReceiptViewSet, basename='receipt')
+router.register(r'jobs', ExtractionJobViewSet, basename='job')
+router.register(r'uploads', UploadSessionViewSet, basename='upload')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     
     # API endpoints
     path('api/', include(router.urls)),
+    path('api/jobs/<int:pk>/events/', job_event_stream, name='job-events'),
+    path('api/jobs/<int:pk>/events/poll/', job_event_poll, name='job-events-poll'),
+    path('api/search/', document_search_view, name='document-search'),
     
     # Authentication
     path('api/auth/register/', UserRegistrationView.as_view(), name='register'),
@@ -122,7 +122,7 @@ class PurchaseRequestViewSet(viewsets.ModelViewSet):
             if success:
                 # Generate PO if fully approved
                 if purchase_request.status == 'approved':
-                    from documents.models import PurchaseOrder
+                    # Only creates rows; the PDF is rendered after commit by the document worker
                     from documents.services import generate_purchase_order
                     generate_purchase_order(purchase_request, request.user)
                 
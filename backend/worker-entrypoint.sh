@@ -0,0 +1,11 @@
+#!/bin/sh
+set -e
+
+# The backend container applies migrations and seeds users; the worker only
+# waits until the schema is current so it never races those steps
+until python manage.py migrate --check >/dev/null 2>&1; do
+    echo "Waiting for migrations to be applied..."
+    sleep 2
+done
+
+exec "$@"
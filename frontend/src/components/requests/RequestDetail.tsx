@@ -1,10 +1,11 @@
-import React, { useState } from "react";
+import React, { useEffect, useRef, useState } from "react";
 import { toast } from "sonner";
 import {
   PurchaseRequest,
   documentsAPI,
   requestsAPI,
   getFileUrl,
+  followJob,
 } from "../../services/api";
 import { useAuth } from "../../context/AuthContext";
 import RequestForm from "./RequestForm";
@@ -30,6 +31,33 @@ const RequestDetail: React.FC<RequestDetailProps> = ({
   const [error, setError] = useState("");
   const [proformaFile, setProformaFile] = useState<File | null>(null);
   const [receiptFile, setReceiptFile] = useState<File | null>(null);
+  const [jobProgress, setJobProgress] = useState<{
+    stage: string;
+    progress: number;
+  } | null>(null);
+  const stopFollowing = useRef<(() => void) | null>(null);
+
+  useEffect(() => () => stopFollowing.current?.(), []);
+
+  // Show extraction progress of an uploaded document until its job finishes
+  const trackJob = (job?: { id: number; progress: number; stage: string }) => {
+    if (!job) return;
+    stopFollowing.current?.();
+    setJobProgress({ stage: job.stage, progress: job.progress });
+    stopFollowing.current = followJob(
+      job.id,
+      (event) => setJobProgress({ stage: event.stage, progress: event.progress }),
+      (status) => {
+        setJobProgress(null);
+        if (status === "completed") {
+          toast.success("Document processed");
+        } else {
+          toast.error("Document processing failed");
+        }
+        onUpdate();
+      }
+    );
+  };
 
   const formatCurrency = (amount: string | number) => {
     const numAmount = typeof amount === "string" ? parseFloat(amount) : amount;
@@ -103,7 +131,8 @@ const RequestDetail: React.FC<RequestDetailProps> = ({
     setLoading(true);
     setError("");
     try {
-      await documentsAPI.uploadProforma(request.id, proformaFile);
+      const response = await documentsAPI.uploadProforma(request.id, proformaFile);
+      trackJob(response.data?.job);
       toast.success("Proforma uploaded!", {
         description: "The proforma invoice has been uploaded successfully.",
       });
@@ -130,7 +159,8 @@ const RequestDetail: React.FC<RequestDetailProps> = ({
     setLoading(true);
     setError("");
     try {
-      await documentsAPI.uploadReceipt(request.id, receiptFile);
+      const response = await documentsAPI.uploadReceipt(request.id, receiptFile);
+      trackJob(response.data?.job);
       toast.success("Receipt uploaded!", {
         description: "The receipt has been uploaded successfully.",
       });
@@ -180,6 +210,21 @@ const RequestDetail: React.FC<RequestDetailProps> = ({
                 </div>
               )}
 
+              {jobProgress && (
+                <div className="mb-4">
+                  <div className="flex justify-between text-sm text-gray-600 mb-1">
+                    <span>Processing document: {jobProgress.stage || "queued"}</span>
+                    <span>{jobProgress.progress}%</span>
+                  </div>
+                  <div className="w-full bg-gray-200 rounded-full h-2">
+                    <div
+                      className="bg-blue-600 h-2 rounded-full"
+                      style={{ width: `${jobProgress.progress}%` }}
+                    />
+                  </div>
+                </div>
+              )}
+
               <div className="grid grid-cols-2 gap-6 mb-6">
                 <div>
                   <h3 className="text-sm font-medium text-gray-500 mb-1">
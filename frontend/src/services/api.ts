@@ -57,6 +57,15 @@ export interface PurchaseRequest {
   receipts?: any[];
 }
 
+export interface JobEvent {
+  id: number;
+  job: number;
+  progress: number;
+  stage: string;
+  data: any;
+  created_at: string;
+}
+
 export interface LoginResponse {
   access: string;
   refresh: string;
@@ -180,6 +189,58 @@ export const documentsAPI = {
   getPurchaseOrder: (id: number) => api.get(`/purchase-orders/${id}/`),
 
   validateReceipt: (id: number) => api.post(`/receipts/${id}/validate/`),
+
+  getJob: (id: number) => api.get(`/jobs/${id}/`),
+
+  getJobEventsToken: (id: number) =>
+    api.post<{ token: string; expires_in: number }>(`/jobs/${id}/events/token/`),
+};
+
+// Follow a job's progress events; returns a function that stops following
+export const followJob = (
+  jobId: number,
+  onEvent: (event: JobEvent) => void,
+  onDone: (status: string) => void
+): (() => void) => {
+  let source: EventSource | null = null;
+  let lastEventId = 0;
+  let stopped = false;
+
+  const connect = async () => {
+    try {
+      // EventSource cannot send the Authorization header, so ask for a stream token
+      const response = await documentsAPI.getJobEventsToken(jobId);
+      if (stopped) return;
+      const params = new URLSearchParams({
+        stream_token: response.data.token,
+        after: String(lastEventId),
+      });
+      source = new EventSource(`${API_BASE_URL}/jobs/${jobId}/events/?${params}`);
+      source.addEventListener("progress", (message) => {
+        const event: JobEvent = JSON.parse((message as MessageEvent).data);
+        lastEventId = event.id;
+        onEvent(event);
+      });
+      source.addEventListener("done", (message) => {
+        stopped = true;
+        source?.close();
+        onDone(JSON.parse((message as MessageEvent).data).status);
+      });
+      source.onerror = () => {
+        // Stream tokens expire, so reconnect with a fresh one rather than the old URL
+        source?.close();
+        if (!stopped) setTimeout(connect, 1000);
+      };
+    } catch (error) {
+      if (!stopped) onDone("unknown");
+    }
+  };
+
+  connect();
+  return () => {
+    stopped = true;
+    source?.close();
+  };
 };
 
 export default api;